@@ -7,6 +7,9 @@ SEH_SEHREG.[PATIENTNR],
 [AANGEMAAKT], 
 [AANMTIJD], 
 [INDICATIE],
+[ACCDATUM],
+[ACCTIJD],
+[VERSLAGNR],
 [TRANSTEXT], 
 [BESTEMMING] 
 
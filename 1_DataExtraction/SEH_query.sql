@@ -22,30 +22,10 @@ SELECT
 
     -- EIND GEGEVENS
     [EINDTIJD],
-    [BESTEMMING],
+    [BESTEMMING]
 
-    -- Previous number of visits in the year before 
-     (
-        SELECT COUNT(*) 
-        FROM [SEH_SEHREG] prev_visits 
-        WHERE prev_visits.PATIENTNR = [SEH_SEHREG].PATIENTNR
-            AND prev_visits.AANKSDATUM > DATEADD(year, -1, [SEH_SEHREG].AANKSDATUM) 
-            AND prev_visits.AANKSDATUM < [SEH_SEHREG].AANKSDATUM
-    ) AS PreviousVisits,
-
-    -- Percentage of admissions for previous visits 
-    (
-        SELECT 
-            CASE
-                WHEN COUNT(*) > 0 
-                THEN COUNT(CASE WHEN prev_visits.BESTEMMING IN ('OPN', 'OVER') THEN 1 END) * 100.0 / COUNT(*) 
-                ELSE 0
-            END
-        FROM [SEH_SEHREG] prev_visits 
-        WHERE prev_visits.PATIENTNR = [SEH_SEHREG].PATIENTNR
-            AND prev_visits.AANKSDATUM > DATEADD(year, -1, [SEH_SEHREG].AANKSDATUM) 
-            AND prev_visits.AANKSDATUM < [SEH_SEHREG].AANKSDATUM
-    ) AS PrevAdmissionPercentage
+    -- PreviousVisits and PrevAdmissionPercentage are calculated point in time from this export
+    -- during preprocessing (patient_history.py) instead of with correlated subqueries per visit
 
 
 FROM [SEH_SEHREG]
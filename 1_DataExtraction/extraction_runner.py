@@ -0,0 +1,266 @@
+"""
+    Partitioned, parallel extraction of the training data.
+
+    Every query of the config (SEH_query.sql, LAB_query.sql, ...) is run per month of
+    AANKSDATUM instead of as one dump since 20150101. The query is wrapped in a filter on
+    the partition column (its ORDER BY is dropped), so the queries themselves still run
+    as they are. The partitions are fetched concurrently over a pool of connections, a
+    failed partition is retried on a new connection, and every partition is written to
+    its own Parquet file. The manifest (manifest.json in the output directory) keeps the
+    file, row count and query hash of every partition, so a rerun only fetches the
+    partitions that are new or missing, the last `refresh_months` months (the visits of
+    the last days are still completed in HiX) and the partitions of a changed query.
+
+    usage (from the 1_DataExtraction directory):
+    python3 extraction_runner.py [--config ./extraction_config.yaml] [--streams seh_data lab_data] [--full] [--csv]
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yaml
+
+
+########################
+# database functions   #
+########################
+
+def connect(db_config):
+    """ Connects to the database (odbc, or sqlite when a sqlite file is given) """
+
+    if db_config.get('sqlite'):
+        return sqlite3.connect(db_config['sqlite'], check_same_thread=False)  # the pool hands connections to other threads
+
+    import pyodbc  # only needed for the odbc connections
+    return pyodbc.connect(DRIVER=db_config['driver'], SERVER=db_config['server'], DATABASE=db_config['database'],
+                          UID=db_config['uid'], PWD=db_config['pwd'])
+
+
+class ConnectionPool:
+    """ At most `size` connections, created when needed, a connection that failed is closed instead of reused """
+
+    def __init__(self, db_config, size):
+        self.db_config = db_config
+        self.idle = queue.Queue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                return connect(self.db_config)
+            except Exception:
+                self.slots.release()
+                raise
+
+    def release(self, con, broken=False):
+        if broken:
+            try:
+                con.close()
+            except Exception:
+                pass
+        else:
+            self.idle.put(con)
+        self.slots.release()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+def fetch(con, query, params=()):
+    """ Executes the query, returns the column names and the rows """
+
+    cursor = con.cursor()
+    cursor.execute(query, list(params))
+    columns = [col[0] for col in cursor.description]
+
+    return columns, [tuple(row) for row in cursor.fetchall()]
+
+
+#######################
+# partition functions #
+#######################
+
+def get_partition_query(query, column):
+    """ The query restricted to one date range of the column (the ORDER BY of the query is dropped) """
+
+    query = re.sub(r'\s+ORDER\s+BY\s+[^()]*$', '', query.strip().rstrip(';').strip(), flags=re.IGNORECASE)
+    return f'SELECT * FROM (\n{query}\n) AS PARTITION_QUERY WHERE [{column}] >= ? AND [{column}] < ?'
+
+
+def get_partitions(start, end):
+    """ Monthly partitions (name, first day, first day of the next month) from the month of start up to end """
+
+    months = pd.date_range(pd.Timestamp(start).to_period('M').to_timestamp(), end, freq='MS')
+    return [(f'{month:%Y-%m}', month.date(), (month + pd.offsets.MonthBegin(1)).date()) for month in months]
+
+
+def get_query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]
+
+
+def get_todo(partitions, manifest, out_dir, query_hash, refresh_from, full=False):
+    """ Partitions to fetch: not in the manifest, file missing, other query, or ending after refresh_from """
+
+    todo = []
+    for name, first, end in partitions:
+        entry = manifest.get(name)
+        if (full or entry is None or entry['query_hash'] != query_hash or end > refresh_from
+                or not (out_dir / entry['file']).exists()):
+            todo.append((name, first, end))
+
+    return todo
+
+
+#######################
+# manifest functions  #
+#######################
+
+def load_manifest(out_dir):
+    """ {stream: {partition: entry}} of the partitions written before """
+
+    path = out_dir / 'manifest.json'
+    if not path.exists():
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(out_dir, manifest):
+    """ Writes the manifest to a temporary file and renames it, so an interrupted run keeps a valid manifest """
+
+    tmp_path = out_dir / 'manifest.json.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, out_dir / 'manifest.json')
+
+
+def write_partition(path, columns, rows):
+    """ Writes the rows of a partition to a Parquet file (through a temporary file) """
+
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_stream(out_dir, stream):
+    """ All partitions of a stream in one DataFrame, in partition order """
+
+    out_dir = Path(out_dir)
+    entries = load_manifest(out_dir).get(stream, {})
+    return pd.concat([pd.read_parquet(out_dir / entries[name]['file']) for name in sorted(entries)], ignore_index=True)
+
+
+#######################
+# extraction          #
+#######################
+
+def extract_partition(pool, query, params, retries, retry_wait):
+    """ Fetches one partition, retried on a new connection with a growing wait """
+
+    for attempt in range(retries + 1):
+        con = None
+        try:
+            con = pool.acquire()  # a failed connect is retried as well
+            columns, rows = fetch(con, query, params)
+        except Exception as e:
+            if con is not None:
+                pool.release(con, broken=True)
+            if attempt == retries:
+                raise
+            print(f'partition {params[0]} failed ({e}), retry {attempt + 1}/{retries}')
+            time.sleep(retry_wait * 2 ** attempt)
+        else:
+            pool.release(con)
+            return columns, rows
+
+
+def run_extraction(config, streams=None, full=False):
+    """ Fetches the new and missing partitions of every stream, returns the number of fetched partitions per stream """
+
+    out_dir = Path(config['out_dir'])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    lock = threading.Lock()
+
+    today = pd.Timestamp(config.get('end') or date.today())
+    partitions = get_partitions(config['start'], today)
+    refresh_from = (today.to_period('M').to_timestamp() - pd.DateOffset(months=config['refresh_months'] - 1)).date()
+
+    jobs = []
+    for stream in streams or list(config['queries']):
+        with open(config['queries'][stream]) as query_file:
+            query = get_partition_query(query_file.read(), config['partition_column'])
+        query_hash = get_query_hash(query)
+        (out_dir / stream).mkdir(exist_ok=True)
+        for name, first, end in get_todo(partitions, manifest.get(stream, {}), out_dir, query_hash, refresh_from, full):
+            jobs.append((stream, name, first, end, query, query_hash))
+
+    def run_job(pool, stream, name, first, end, query, query_hash):
+        start = time.perf_counter()
+        columns, rows = extract_partition(pool, query, [first, end], config['retries'], config['retry_wait'])
+        file = f'{stream}/{stream}_{name}.parquet'
+        write_partition(out_dir / file, columns, rows)
+
+        with lock:
+            manifest.setdefault(stream, {})[name] = {'file': file, 'rows': len(rows), 'first': str(first),
+                                                     'end': str(end), 'query_hash': query_hash,
+                                                     'extracted': datetime.now().isoformat(sep=' ', timespec='seconds'),
+                                                     'seconds': round(time.perf_counter() - start, 2)}
+            write_manifest(out_dir, manifest)
+        print(f'{stream} {name}: {len(rows)} rows ({time.perf_counter() - start:.1f}s)')
+
+    pool = ConnectionPool(config['source'], config['workers'])
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=config['workers']) as executor:
+            futures = {executor.submit(run_job, pool, *job): job for job in jobs}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed.append(futures[future][:2])
+                    print(f'{futures[future][0]} {futures[future][1]} failed: {future.exception()}')
+    finally:
+        pool.close()
+
+    if failed:
+        raise RuntimeError(f'{len(failed)} partitions failed, rerun to fetch them: {failed}')
+
+    counts = {}
+    for stream, *_ in jobs:
+        counts[stream] = counts.get(stream, 0) + 1
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partitioned, parallel extraction of the training data')
+    parser.add_argument('--config', default='./extraction_config.yaml')
+    parser.add_argument('--streams', nargs='+', help='streams of the config to extract (default: all)')
+    parser.add_argument('--full', action='store_true', help='fetch all partitions again')
+    parser.add_argument('--csv', action='store_true', help='also write every stream as one csv (; separated) for the preprocessing')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+
+    start = time.perf_counter()
+    print(f'fetched partitions: {run_extraction(config, args.streams, args.full)} ({time.perf_counter() - start:.0f}s)')
+
+    if args.csv:
+        for stream in args.streams or list(config['queries']):
+            load_stream(config['out_dir'], stream).to_csv(Path(config['out_dir']) / f'{stream}.csv', sep=';', index=False)
@@ -0,0 +1,125 @@
+"""
+    The extraction runner against a small SQLite stand-in of the SEH registration table.
+"""
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+EXTRACTION_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(EXTRACTION_DIR))
+
+import extraction_runner  # noqa: E402
+
+
+VISITS = [(1, 100, '2023-01-05'), (2, 101, '2023-01-31'), (3, 100, '2023-02-14'),
+          (4, 102, '2023-03-01'), (5, 103, '2023-03-20'), (6, 101, '2023-04-02')]
+
+
+@pytest.fixture
+def config(tmp_path):
+    """ Config of a SQLite database with the visits of january up to april 2023 and one SEH query """
+
+    db_path = tmp_path / 'source.db'
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE SEH_SEHREG (SEHID INTEGER, PATIENTNR INTEGER, AANKSDATUM TEXT, VERVALL INTEGER)')
+    con.executemany('INSERT INTO SEH_SEHREG VALUES (?, ?, ?, 0)', VISITS)
+    con.commit()
+    con.close()
+
+    query_path = tmp_path / 'SEH_query.sql'
+    query_path.write_text('SELECT [SEHID], [PATIENTNR], [AANKSDATUM]\nFROM [SEH_SEHREG]\n'
+                          'WHERE [VERVALL] = 0\nORDER BY AANKSDATUM desc;\n')
+
+    return {'source': {'sqlite': str(db_path)}, 'out_dir': str(tmp_path / 'extraction'),
+            'start': '2023-01-01', 'end': '2023-04-15', 'partition_column': 'AANKSDATUM',
+            'workers': 2, 'retries': 2, 'retry_wait': 0, 'refresh_months': 1,
+            'queries': {'seh_data': str(query_path)}}
+
+
+@pytest.mark.parametrize('query_file', sorted(EXTRACTION_DIR.glob('*.sql')), ids=lambda path: path.name)
+def test_partition_query_wraps_every_query(query_file):
+    query = query_file.read_text()
+    partition_query = extraction_runner.get_partition_query(query, 'AANKSDATUM')
+
+    head, rest = partition_query.split('\n', 1)
+    inner, tail = rest.rsplit('\n', 1)
+    assert head == 'SELECT * FROM ('
+    assert tail == ') AS PARTITION_QUERY WHERE [AANKSDATUM] >= ? AND [AANKSDATUM] < ?'
+
+    # the query is kept up to its ORDER BY and closing semicolon
+    assert query.strip().startswith(inner)
+    assert not re.search(r'ORDER\s+BY', inner, flags=re.IGNORECASE)
+    assert not inner.rstrip().endswith(';')
+    assert re.search(r'\bAANKSDATUM\b', inner.split('FROM')[0])  # the partition column is selected
+
+
+def test_partition_query_runs_per_month(config):
+    with open(config['queries']['seh_data']) as query_file:
+        query = extraction_runner.get_partition_query(query_file.read(), 'AANKSDATUM')
+
+    con = extraction_runner.connect(config['source'])
+    columns, rows = extraction_runner.fetch(con, query, ['2023-01-01', '2023-02-01'])
+    con.close()
+
+    assert columns == ['SEHID', 'PATIENTNR', 'AANKSDATUM']
+    assert sorted(row[0] for row in rows) == [1, 2]
+
+
+def test_rerun_only_fetches_the_refreshed_partitions(config):
+    assert extraction_runner.run_extraction(config) == {'seh_data': 4}
+
+    out_dir = Path(config['out_dir'])
+    manifest = extraction_runner.load_manifest(out_dir)['seh_data']
+    assert sorted(manifest) == ['2023-01', '2023-02', '2023-03', '2023-04']
+    assert [manifest[name]['rows'] for name in sorted(manifest)] == [2, 1, 2, 1]
+    assert sorted(extraction_runner.load_stream(out_dir, 'seh_data')['SEHID']) == [1, 2, 3, 4, 5, 6]
+
+    # only the last refresh_months months are fetched again
+    assert extraction_runner.run_extraction(config) == {'seh_data': 1}
+
+    # a missing file and a changed query are fetched again
+    (out_dir / manifest['2023-02']['file']).unlink()
+    assert extraction_runner.run_extraction(config) == {'seh_data': 2}
+    query_path = Path(config['queries']['seh_data'])
+    query_path.write_text(query_path.read_text().replace('[VERVALL] = 0', '[VERVALL] = 0 AND [SEHID] > 0'))
+    assert extraction_runner.run_extraction(config) == {'seh_data': 4}
+    assert extraction_runner.run_extraction(config, full=True) == {'seh_data': 4}
+
+
+def test_failed_connection_is_retried(config, monkeypatch):
+    connect = extraction_runner.connect
+    calls = []
+
+    def flaky_connect(db_config):
+        """ The first connect fails, the second connection is closed (its query fails), then the database is reachable """
+        calls.append(db_config)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('unable to open database')
+        con = connect(db_config)
+        if len(calls) == 2:
+            con.close()
+        return con
+
+    monkeypatch.setattr(extraction_runner, 'connect', flaky_connect)
+    config.update(workers=1, start='2023-03-01')
+
+    assert extraction_runner.run_extraction(config) == {'seh_data': 2}
+    assert len(calls) == 3
+    assert sorted(extraction_runner.load_stream(config['out_dir'], 'seh_data')['SEHID']) == [4, 5, 6]
+
+
+def test_partition_fails_after_the_retries(config, monkeypatch):
+    def failing_connect(db_config):
+        raise sqlite3.OperationalError('unable to open database')
+
+    monkeypatch.setattr(extraction_runner, 'connect', failing_connect)
+
+    with pytest.raises(RuntimeError, match='4 partitions failed'):
+        extraction_runner.run_extraction(config)
+    assert extraction_runner.load_manifest(Path(config['out_dir'])) == {}
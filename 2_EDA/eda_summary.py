@@ -0,0 +1,285 @@
+"""
+    Out-of-core summary of the raw extraction files.
+
+    Every file of eda_config.yaml is read once in chunks, so the memory use does not grow
+    with the size of the file (the LAB file does not fit in memory with pandas). Per file
+    the summary holds:
+    - per column: missing values, the number of distinct values (HyperLogLog sketch), the most
+      frequent values (while a column has few distinct values) and for the numeric columns
+      the minimum, maximum, mean and quantiles (from a uniform sample of the values)
+    - per bepcode (LAB) and per label (VITALS): the same statistics of the result values, and
+      the text results ('-volgt-', '<5', ...)
+    - per year: the number of rows, the days with data and the first and last date
+
+    The summary is one joblib file of DataFrames that the EDA notebooks load in a second:
+    summary = eda_summary.load_summary('./eda_summary.joblib')
+    summary['lab_data']['groups'].sort_values('count', ascending=False)
+
+    usage (from the 2_EDA directory):
+    python3 eda_summary.py [--config ./eda_config.yaml] [--out ./eda_summary.joblib] [--chunksize 500000]
+"""
+import argparse
+import time as timer
+
+import joblib
+import numpy as np
+import pandas as pd
+import yaml
+
+
+DATE_COLUMNS = {'seh_data': 'AANKSDATUM', 'lab_data': 'AFDATUM', 'vital_data': 'DateTime', 'rad_data': 'AANKSDATUM'}
+GROUPS = {'lab_data': ('BEPCODE', 'UITSLAG'), 'vital_data': ('LABEL', 'Value1')}  # (group column, value column)
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+HLL_PRECISION = 14  # 2 ** 14 registers per column, about 1 % error on the number of distinct values
+MAX_VALUES = 1000  # the value counts of a column are kept while it has at most this many distinct values
+SAMPLE_SIZE = 100000  # values per column kept for the quantiles
+GROUP_SAMPLE_SIZE = 5000  # values per bepcode or label kept for the quantiles
+
+
+#####################
+# sketches          #
+#####################
+
+def update_registers(registers, values):
+    """ Adds the values to the HyperLogLog registers of a column """
+
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object)).astype(np.uint64)
+    buckets = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+
+    # position of the first 1 bit of the rest of the hash
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    nonzero = rest > 0
+    bit_length[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+    ranks = (64 - HLL_PRECISION) - bit_length + 1
+
+    np.maximum.at(registers, buckets, ranks.astype(registers.dtype))
+
+
+def estimate_distinct(registers):
+    """ Number of distinct values from the HyperLogLog registers """
+
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m ** 2 / np.sum(2.0 ** -registers.astype(np.float64))
+    empty = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and empty:
+        estimate = m * np.log(m / empty)  # linear counting for small numbers of distinct values
+
+    return int(round(estimate))
+
+
+def update_sample(sample, groups, values, rng, size):
+    """
+        Uniform sample of at most size values per group: every value gets a random key and the values
+        with the smallest keys of a group are kept (the same as sampling all values of the file at once)
+    """
+
+    keys = rng.random(len(values))
+    groups = np.concatenate([sample['groups'], groups])
+    keys = np.concatenate([sample['keys'], keys])
+    values = np.concatenate([sample['values'], values])
+
+    order = np.lexsort((keys, groups))
+    groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ranks = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+    keep = order[ranks < size]
+
+    return {'groups': groups[ranks < size], 'keys': keys[keep], 'values': values[keep]}
+
+
+def create_sample():
+    return {'groups': np.empty(0, dtype=np.int64), 'keys': np.empty(0), 'values': np.empty(0)}
+
+
+def to_numbers(values):
+    """ Numeric values of a column of strings (with a ',' as decimal separator), NaN if not numeric """
+    return pd.to_numeric(values.str.replace(',', '.', regex=False), errors='coerce').to_numpy(dtype=np.float64)
+
+
+#####################
+# accumulating      #
+#####################
+
+def create_stats():
+    """ Running statistics of the numbers of a column or group """
+    return {'count': 0, 'missing': 0, 'numeric': 0, 'sum': 0.0, 'sum_sq': 0.0, 'min': np.inf, 'max': -np.inf}
+
+
+def update_stats(stats, numbers, n_missing):
+    """ Adds the numbers of the present values of a chunk (NaN if not numeric) and the missing values to the statistics """
+
+    finite = numbers[~np.isnan(numbers)]
+    stats['count'] += len(numbers) + n_missing
+    stats['missing'] += n_missing
+    stats['numeric'] += len(finite)
+    if len(finite):
+        stats['sum'] += finite.sum()
+        stats['sum_sq'] += (finite ** 2).sum()
+        stats['min'] = min(stats['min'], finite.min())
+        stats['max'] = max(stats['max'], finite.max())
+
+
+def add_counts(total, counts):
+    """ Sum of the running counts and the counts of a chunk (None: no counts yet) """
+    return counts if total is None else total.add(counts, fill_value=0)
+
+
+def update_value_counts(counts, name, values):
+    """ Adds the value counts of a chunk, the counts of a column are dropped once it has too many distinct values """
+
+    if name in counts and counts[name] is None:
+        return
+    merged = add_counts(counts.get(name), values.value_counts())
+    counts[name] = merged if len(merged) <= MAX_VALUES else None
+
+
+def get_codes(codes, names):
+    """ Integer code of every name (new names get the next code), the samples are sorted on the codes """
+    return np.array([codes.setdefault(name, len(codes)) for name in names], dtype=np.int64)
+
+
+def update_summary(state, chunk, date_column, group_columns):
+    """ Adds one chunk of a file to the running summary """
+
+    state['rows'] += len(chunk)
+    sample_codes, sample_numbers = [], []
+    for code, column in zip(get_codes(state['column_codes'], chunk.columns), chunk.columns):
+        values = chunk[column]
+        present = values.dropna()
+        numbers = to_numbers(present)
+        update_stats(state['columns'].setdefault(column, create_stats()), numbers, len(values) - len(present))
+        update_registers(state['registers'].setdefault(column, np.zeros(2 ** HLL_PRECISION, dtype=np.uint8)), present)
+        update_value_counts(state['values'], column, present)
+
+        numbers = numbers[~np.isnan(numbers)]
+        sample_codes.append(np.full(len(numbers), code))
+        sample_numbers.append(numbers)
+    state['sample'] = update_sample(state['sample'], np.concatenate(sample_codes), np.concatenate(sample_numbers),
+                                    state['rng'], SAMPLE_SIZE)
+
+    if group_columns is not None:
+        group_column, value_column = group_columns
+        groups, values = chunk[group_column].fillna('nan').to_numpy(dtype=object), chunk[value_column]
+        present = values.notna().to_numpy()
+        numbers = to_numbers(values.fillna(''))
+        for group, rows in pd.Series(groups).groupby(groups).indices.items():
+            update_stats(state['groups'].setdefault(group, create_stats()), numbers[rows[present[rows]]],
+                         int((~present[rows]).sum()))
+
+        is_number = ~np.isnan(numbers)
+        state['group_sample'] = update_sample(state['group_sample'], get_codes(state['group_codes'], groups[is_number]),
+                                              numbers[is_number], state['rng'], GROUP_SAMPLE_SIZE)
+
+        # the text results ('-volgt-', '<5', 'negatief', ...), long free text is counted as one value
+        texts = values[~is_number & present]
+        texts = texts.where(texts.str.len() <= 20, '(long text)')
+        counts = pd.Series(1, index=pd.MultiIndex.from_arrays([groups[~is_number & present], texts.to_numpy()],
+                                                              names=['group', 'value']))
+        state['group_texts'] = add_counts(state['group_texts'], counts.groupby(level=[0, 1]).sum())
+
+    if date_column in chunk.columns:
+        dates = pd.to_datetime(chunk[date_column], errors='coerce').dropna().dt.normalize()
+        state['dates'] = add_counts(state['dates'], dates.value_counts())
+
+
+def create_state(seed=0):
+    return {'rows': 0, 'columns': {}, 'column_codes': {}, 'registers': {}, 'values': {}, 'sample': create_sample(),
+            'groups': {}, 'group_codes': {}, 'group_sample': create_sample(), 'group_texts': None,
+            'dates': None, 'rng': np.random.default_rng(seed)}
+
+
+#####################
+# summary           #
+#####################
+
+def to_frame(stats, sample, codes):
+    """ DataFrame of the statistics per column or group, with the quantiles of the sampled values """
+
+    df = pd.DataFrame.from_dict(stats, orient='index')
+    df['missing_rate'] = df['missing'] / df['count'].clip(lower=1)
+    df['numeric_rate'] = df['numeric'] / (df['count'] - df['missing']).clip(lower=1)
+    df['mean'] = df['sum'] / df['numeric'].clip(lower=1)
+    df['std'] = np.sqrt((df['sum_sq'] / df['numeric'].clip(lower=1) - df['mean'] ** 2).clip(lower=0))
+    df.loc[df['numeric'] == 0, ['min', 'max', 'mean', 'std']] = np.nan
+
+    names = np.array(list(codes), dtype=object)
+    quantiles = pd.Series(sample['values']).groupby(names[sample['groups']]).quantile(QUANTILES).unstack()
+    quantiles = quantiles.reindex(columns=QUANTILES)
+    quantiles.columns = [f'p{int(q * 100):02d}' for q in QUANTILES]
+
+    columns = ['count', 'missing', 'missing_rate', 'numeric_rate', 'min', *quantiles.columns, 'max', 'mean', 'std']
+    return df.join(quantiles).reindex(columns=columns)
+
+
+def get_year_coverage(dates):
+    """ Rows, days with data and first and last date per year """
+
+    dates = pd.Series(dates.to_numpy(), index=pd.to_datetime(dates.index)).sort_index()
+    years = dates.index.year
+    coverage = pd.DataFrame({'rows': dates.groupby(years).sum().astype(np.int64),
+                             'days': dates.groupby(years).size(),
+                             'first': dates.index.to_series().groupby(years).min(),
+                             'last': dates.index.to_series().groupby(years).max()})
+    coverage['day_coverage'] = coverage['days'] / [366 if pd.Timestamp(year, 12, 31).dayofyear == 366 else 365
+                                                   for year in coverage.index]
+    coverage.index.name = 'year'
+
+    return coverage
+
+
+def finish_summary(state, path):
+    """ Summary of a file from its running state """
+
+    columns = to_frame(state['columns'], state['sample'], state['column_codes'])
+    columns.insert(2, 'distinct', [estimate_distinct(state['registers'][column]) for column in columns.index])
+
+    summary = {'file': path, 'rows': state['rows'], 'columns': columns,
+               'top_values': {column: counts.sort_values(ascending=False).astype(np.int64)
+                              for column, counts in state['values'].items() if counts is not None},
+               'years': get_year_coverage(state['dates']) if state['dates'] is not None else None}
+    if state['groups']:
+        summary['groups'] = to_frame(state['groups'], state['group_sample'], state['group_codes'])
+        summary['group_texts'] = state['group_texts'].astype(np.int64).sort_values(ascending=False)
+
+    return summary
+
+
+def summarize_file(path, date_column=None, group_columns=None, chunksize=500000):
+    """ Summary of one extraction file, read once in chunks """
+
+    state = create_state()
+    for chunk in pd.read_csv(path, sep=';', dtype=str, na_values=['', 'nan'], keep_default_na=False,
+                             chunksize=chunksize):
+        update_summary(state, chunk, date_column, group_columns)
+        print(f'{path}: {state["rows"]} rows', end='\r')
+    print()
+
+    return finish_summary(state, path)
+
+
+def load_summary(path='./eda_summary.joblib'):
+    """ Loads the summary written by this script: {stream: summary} """
+    return joblib.load(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Out-of-core summary of the raw extraction files')
+    parser.add_argument('--config', default='./eda_config.yaml')
+    parser.add_argument('--out', default='./eda_summary.joblib')
+    parser.add_argument('--chunksize', type=int, default=500000, help='rows per chunk')
+    parser.add_argument('--streams', nargs='+', help='keys of the config to summarize (default: all)')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+
+    summaries = {}
+    for stream in args.streams or list(config):
+        start = timer.time()
+        summaries[stream] = summarize_file(config[stream], DATE_COLUMNS.get(stream), GROUPS.get(stream), args.chunksize)
+        print(f'{stream}: {summaries[stream]["rows"]} rows in {timer.time() - start:.0f} s')
+
+    joblib.dump(summaries, args.out)
+    print(f'{args.out} written')
@@ -0,0 +1,79 @@
+"""
+    The sketches of the EDA summary: the HyperLogLog estimate of the distinct values, the uniform
+    sample per group (the same whether the values come in one chunk or many) and a summary of a small
+    file read in chunks.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('joblib')
+pytest.importorskip('yaml')
+
+import numpy as np  # noqa: E402
+
+EDA_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(EDA_DIR))
+
+import eda_summary  # noqa: E402
+
+
+def count_distinct(values, chunksize):
+    registers = np.zeros(2 ** eda_summary.HLL_PRECISION, dtype=np.uint8)
+    for start in range(0, len(values), chunksize):
+        eda_summary.update_registers(registers, pd.Series(values[start:start + chunksize]))
+    return eda_summary.estimate_distinct(registers)
+
+
+@pytest.mark.parametrize('n_distinct', [10, 1000, 200000])
+def test_distinct_values_estimate(n_distinct):
+    rng = np.random.default_rng(n_distinct)
+    values = rng.integers(0, n_distinct, size=3 * n_distinct).astype(str)  # every value about three times
+
+    estimate = count_distinct(values, chunksize=50000)
+    assert abs(estimate - len(set(values))) <= max(0.03 * len(set(values)), 1)
+
+
+def test_sample_in_chunks_is_the_sample_of_all_values():
+    groups = np.repeat([0, 1, 2], [30000, 500, 10000])
+    values = np.arange(len(groups), dtype=np.float64)
+
+    chunked, rng = eda_summary.create_sample(), np.random.default_rng(0)
+    for start in range(0, len(values), 7000):
+        chunked = eda_summary.update_sample(chunked, groups[start:start + 7000], values[start:start + 7000], rng, 2000)
+    at_once = eda_summary.update_sample(eda_summary.create_sample(), groups, values, np.random.default_rng(0), 2000)
+
+    assert np.bincount(chunked['groups']).tolist() == [2000, 500, 2000]
+    np.testing.assert_array_equal(np.sort(chunked['values']), np.sort(at_once['values']))
+
+    # uniform: the sampled values of group 0 (0 up to 29999) have about the mean and quantiles of all of them
+    sampled = chunked['values'][chunked['groups'] == 0]
+    assert abs(sampled.mean() - 15000) < 600
+    assert abs(np.quantile(sampled, 0.9) - 27000) < 900
+
+
+def test_summarize_file(tmp_path):
+    rows = ['BEPCODE;UITSLAG;AFDATUM']
+    rows += [f'NA;{140 + i % 5};2023-01-{1 + i % 28:02d}' for i in range(100)]
+    rows += ['KA;4,5;2024-02-29', 'KA;-volgt-;2024-03-01', 'KA;;2024-03-01', ';3;']
+    path = tmp_path / 'LAB.csv'
+    path.write_text('\n'.join(rows) + '\n')
+
+    summary = eda_summary.summarize_file(str(path), 'AFDATUM', eda_summary.GROUPS['lab_data'], chunksize=7)
+
+    columns = summary['columns']
+    assert summary['rows'] == 104
+    assert columns.loc['UITSLAG', ['count', 'missing', 'distinct']].tolist() == [104, 1, 8]
+    assert columns.loc['UITSLAG', 'p50'] == 142
+    assert summary['top_values']['BEPCODE'].to_dict() == {'NA': 100, 'KA': 3}
+
+    groups = summary['groups']
+    assert groups.loc['NA', ['min', 'max', 'mean']].tolist() == [140, 144, 142]
+    assert groups.loc['KA', ['count', 'missing', 'numeric_rate']].tolist() == [3, 1, 0.5]
+    assert summary['group_texts'].to_dict() == {('KA', '-volgt-'): 1}
+
+    years = summary['years']
+    assert years.loc[2023, ['rows', 'days']].tolist() == [100, 28]
+    assert years.loc[2024, 'rows'] == 3
@@ -3,6 +3,7 @@ import re
 import string
 import sys
 from datetime import date, timedelta
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -13,6 +14,10 @@ from nltk.corpus import stopwords
 from nltk.stem.snowball import SnowballStemmer  # supports Dutch langauge
 from nltk.tokenize import word_tokenize
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / '5_Deployment/flask/preprocessing/scripts'))
+import patient_history  # shared with the deployed API, so training and serving use the same features
+import calendar_features
+
 dutch_stop_words = set(stopwords.words('dutch'))
 
 
@@ -87,7 +92,7 @@ def create_date_features(df):
     """ Creates features from the date and time information """
 
     df['AANKSTIJD'] = pd.to_datetime(df['AANKSTIJD'],format= '%H:%M').dt.hour
-    df['WEEKEND']   = df['AANKSDATUM'].apply(lambda date: 1 if date.weekday() > 4 else 0)
+    df[['WEEKEND', 'HOLIDAY', 'BRIDGE_DAY', 'SCHOOL_HOLIDAY']] = calendar_features.get_calendar_features(df['AANKSDATUM'])
 
     return df
 
@@ -255,6 +260,18 @@ if __name__ == '__main__':
 
     df_seh['AANKSDATUM'] = pd.to_datetime(df_seh['AANKSDATUM'])
 
+    # PREVIOUS VISITS (point in time, from the visits in the export before the entries are filtered)
+    df_history = patient_history.build_history(df_seh)
+    df_prev = patient_history.get_point_in_time_features(df_history, df_seh['PATIENTNR'], df_seh['AANKSDATUM'])
+    df_seh['PreviousVisits'] = df_prev['PreviousVisits'].values
+    df_seh['PrevAdmissionPercentage'] = df_prev['PrevAdmissionPercentage'].values
+
+    # the export starts in 2015 (SEH_query.sql), the year before the visits of its first year is not in it. Their counts
+    # would be too low compared to the API (the history store holds every visit), so they are left missing
+    first_day = df_seh['AANKSDATUM'].min()
+    incomplete = ~(df_seh['AANKSDATUM'] - pd.DateOffset(years=1) >= first_day - pd.Timedelta(days=1))
+    df_seh.loc[incomplete, ['PreviousVisits', 'PrevAdmissionPercentage']] = np.nan
+
     print(f'Number of starting entries: {len(df_seh)}')
     # HANDLE MISSING DATA
     df_seh = remove_na_entries(df_seh, 'BESTEMMING', 'AANKSDATUM', 'TRIADATUM', 
@@ -1,11 +1,13 @@
 import sys
 from datetime import date
+from pathlib import Path
 
-import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
 import joblib
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / '5_Deployment/flask/preprocessing/scripts'))
+import vitals_cleaning  # shared with the deployed API, so training and serving clean the values the same way
+
 
 def load_data(file_path):
     """ Loads the csv data """
@@ -28,47 +30,14 @@ def merge_datetime(date_col, time_col):
     return pd.to_datetime(date_col + ' ' + time_col, format='%Y-%m-%d %H:%M:%S')
 
 
-def to_float_data(df, col):
-    """ Converts the dataframe column to float data """
-
-    df[col] = df[col].str.replace(',', '.')  # in Dutch the decimal is . and not ,
-    df[col] = df[col].astype(float)
-
-    return df
-
-
-def remove_impossible_data(df, value_col, lower_limit, upper_limit):
-    """ Removes all data outside of the given ranges """
-    df.loc[(df[value_col] < lower_limit) & (df[value_col] > upper_limit)] = np.nan
-    return df
-
-
 def scale_data(df):
+    """ Fits and saves a scaler per label and scales the values """
 
-    scaler = MinMaxScaler()
-
-    label = df['LABEL'].unique()[0]
-    df['Value1'] =  scaler.fit_transform(df[['Value1']])
-
-    joblib.dump(scaler, f'{label}_scaler.pk1')
-
-    return df
-
-
-
-
-def clean_vital_data(df, label, col, lower_lim, upper_lim):
-    """ Cleans the data of the vital data """
-    
-    df_vital = df[df['LABEL'] == label]
-
-    df_vital = df_vital.dropna(subset=[col])
-    df_vital = remove_impossible_data(df_vital, col, lower_lim, upper_lim)
-    if label != 'MEWS score':  # MEWS score is range from 0 to 3, no need to scale
-        df_vital = scale_data(df_vital)
-
-    return df_vital
+    scalers = vitals_cleaning.fit_scalers(df)
+    for label, scaler in scalers.items():
+        joblib.dump(scaler, f'{label}_scaler.pk1')
 
+    return vitals_cleaning.scale_vitals(df, vitals_cleaning.to_scale_table(scalers))
 
 
 def write_dataframe_to_csv(file_path, df, chunk_size=10000):
@@ -105,17 +74,9 @@ if __name__ == '__main__':
     df_vitals['AANKOMST'] = merge_datetime(df_vitals['AANKSDATUM'], df_vitals['AANKSTIJD'])
     df_vitals = df_vitals.drop(['AANKSDATUM', 'AANKSTIJD', 'Value2'], axis=1)
 
-    # CONVERT TO FLOAT (handles ',' decimals)
-    df_vitals = to_float_data(df_vitals, 'Value1')
-    # CLEANING AND SCALIGN THE DATA
-    df_vitals.loc[df_vitals['LABEL'].isin(['HR', 'POLS']), 'LABEL'] = 'HR'  # set same label name for heartrate
-    df_temp = clean_vital_data(df_vitals, 'Temp', 'Value1', 25, 45)
-    df_resp = clean_vital_data(df_vitals, 'Resp', 'Value1', 3, 50)
-    df_nibp = clean_vital_data(df_vitals, 'NIBP', 'Value1', 50, 250)
-    # df_vitals = clean_vital_data(df_vitals, 'NIBP', 'Value2', 10, 150)
-    df_mews = clean_vital_data(df_vitals, 'MEWS score', 'Value1', 0, 3)
-    df_hr = clean_vital_data(df_vitals, 'HR', 'Value1', 30, 200)
-    df_vitals = pd.concat([df_temp, df_resp, df_nibp, df_mews, df_hr])
+    # CLEANING AND SCALING THE DATA (float values, HR and POLS merged, implausible values dropped)
+    df_vitals = vitals_cleaning.clean_vitals(df_vitals)
+    df_vitals = scale_data(df_vitals)
 
     # WRITING OUTPUT
     out_path = sys.argv[1].rsplit('/', maxsplit=1)[0] + f'/processed/{date.today()}'
@@ -0,0 +1,190 @@
+"""
+    Evaluation of the time based models.
+
+    All threshold metrics are derived from one descending sort of the scores per
+    horizon: the scores are grouped by unique value and the confusion matrix at
+    every threshold follows from the cumulative positive and negative counts.
+    Bootstrap replicates reuse the same sort, a replicate is a vector of sample
+    counts so all replicates are evaluated at once with matrix operations.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+METRICS = ['AUC', 'Sensitivity', 'Specificity', 'Accuracy', 'Precision', 'F1-Score']
+
+
+##################
+# sorted counts  #
+##################
+
+def get_score_groups(y_true, y_score):
+    """ Sorts the scores once (descending), returns the unique scores and the sort order with the group starts """
+
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_score = np.asarray(y_score, dtype=np.float64)
+
+    order = np.argsort(-y_score, kind='mergesort')
+    sorted_scores = y_score[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+
+    return sorted_scores[group_starts], y_true[order], group_starts
+
+
+def get_group_counts(y_sorted, group_starts, weights=None):
+    """ Counts the positives and negatives per unique score, weights are bootstrap counts (replicates x samples) """
+
+    if weights is None:
+        weights = np.ones((1, len(y_sorted)))
+
+    pos = np.add.reduceat(weights * y_sorted, group_starts, axis=1)
+    neg = np.add.reduceat(weights * (1 - y_sorted), group_starts, axis=1)
+
+    return pos, neg
+
+
+def get_auc(pos, neg):
+    """ Calculates the AUC from the counts per unique score (ties count for a half) """
+
+    cum_pos = np.cumsum(pos, axis=1)
+    n_pos, n_neg = cum_pos[:, -1], neg.sum(axis=1)
+    pos_above = cum_pos - pos
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (neg * (pos_above + pos / 2)).sum(axis=1) / (n_pos * n_neg)
+
+
+def get_confusion_counts(pos, neg, n_above):
+    """ Gets tp, fp, tn and fn when the first n_above unique scores are predicted as positive """
+
+    cum_pos = np.c_[np.zeros(len(pos)), np.cumsum(pos, axis=1)]
+    cum_neg = np.c_[np.zeros(len(neg)), np.cumsum(neg, axis=1)]
+
+    tp, fp = cum_pos[:, n_above], cum_neg[:, n_above]
+    fn, tn = cum_pos[:, -1:] - tp, cum_neg[:, -1:] - fp
+
+    return tp, fp, tn, fn
+
+
+def get_threshold_metrics(tp, fp, tn, fn):
+    """ Derives the threshold metrics from the confusion counts """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sensitivity = tp / (tp + fn)
+        specificity = tn / (tn + fp)
+        accuracy = (tp + tn) / (tp + fp + tn + fn)
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0)
+        f1 = np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0)
+
+    return {'Sensitivity': sensitivity, 'Specificity': specificity, 'Accuracy': accuracy,
+            'Precision': precision, 'F1-Score': f1}
+
+
+######################
+# evaluation metrics #
+######################
+
+def get_metrics(y_true, y_score, threshold=0.5, n_boot=0, alpha=0.05, seed=0, chunk_size=100):
+    """ Calculates all metrics at the threshold (score > threshold is positive), with bootstrap CIs if n_boot > 0 """
+
+    unique_scores, y_sorted, group_starts = get_score_groups(y_true, y_score)
+    n_above = np.searchsorted(-unique_scores, -threshold, side='left')  # unique scores > threshold
+
+    pos, neg = get_group_counts(y_sorted, group_starts)
+    metrics = {'AUC': get_auc(pos, neg)[0]}
+    metrics.update({name: values.item() for name, values in get_threshold_metrics(*get_confusion_counts(pos, neg, [n_above])).items()})
+
+    if n_boot > 0:
+        boot = bootstrap_metrics(y_sorted, group_starts, n_above, n_boot, seed, chunk_size)
+        for name, values in boot.items():
+            metrics[f'{name}_lower'], metrics[f'{name}_upper'] = np.nanquantile(values, [alpha / 2, 1 - alpha / 2])
+
+    return metrics
+
+
+def bootstrap_metrics(y_sorted, group_starts, n_above, n_boot, seed=0, chunk_size=100):
+    """ Bootstraps all metrics, the replicates are sample counts so the scores never have to be resorted """
+
+    rng = np.random.default_rng(seed)
+    n_samples = len(y_sorted)
+    res = {metric: [] for metric in METRICS}
+
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        weights = rng.multinomial(n_samples, np.full(n_samples, 1 / n_samples), size=size)
+
+        pos, neg = get_group_counts(y_sorted, group_starts, weights)
+        res['AUC'].append(get_auc(pos, neg))
+        for name, values in get_threshold_metrics(*get_confusion_counts(pos, neg, [n_above])).items():
+            res[name].append(values.ravel())
+
+    return {metric: np.concatenate(values) for metric, values in res.items()}
+
+
+def threshold_sweep(y_true, y_score, thresholds=np.linspace(0, 1, 101)):
+    """ Calculates the threshold metrics for all given thresholds from one sort """
+
+    unique_scores, y_sorted, group_starts = get_score_groups(y_true, y_score)
+    pos, neg = get_group_counts(y_sorted, group_starts)
+    n_above = np.searchsorted(-unique_scores, -np.asarray(thresholds), side='left')
+
+    tp, fp, tn, fn = get_confusion_counts(pos, neg, n_above)
+    df = pd.DataFrame(get_threshold_metrics(tp[0], fp[0], tn[0], fn[0]))
+    df.insert(0, 'Threshold', thresholds)
+    df['TP'], df['FP'], df['TN'], df['FN'] = tp[0], fp[0], tn[0], fn[0]
+
+    return df
+
+
+def calibration_curve(y_true, y_score, n_bins=10):
+    """ Calculates the mean predicted and observed admission rate per (uniform) probability bin """
+
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_score = np.asarray(y_score, dtype=np.float64)
+    bins = np.clip((y_score * n_bins).astype(int), 0, n_bins - 1)
+
+    counts = np.bincount(bins, minlength=n_bins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_pred = np.bincount(bins, weights=y_score, minlength=n_bins) / counts
+        observed = np.bincount(bins, weights=y_true, minlength=n_bins) / counts
+
+    return pd.DataFrame({'Bin_lower': np.arange(n_bins) / n_bins, 'Bin_upper': np.arange(1, n_bins + 1) / n_bins,
+                         'Count': counts, 'Mean_prediction': mean_pred, 'Observed_rate': observed})
+
+
+#########################
+# evaluation over time  #
+#########################
+
+def _evaluate_job(job):
+    """ Evaluates one (model, time) combination, used by the process pool """
+
+    model_name, time, y_true, y_score, threshold, n_boot, seed = job
+    metrics = get_metrics(y_true, y_score, threshold, n_boot, seed=seed)
+
+    return {'Model': model_name, 'Time': time, **metrics}
+
+
+def evaluate_models_over_time(results, threshold=0.5, n_boot=1000, seed=0, workers=None):
+    """
+        Evaluates the results of train_and_evaluate_model_over_time for one or more models.
+        results is either {time: {'y_test', 'y_pred_proba', ...}} or {model_name: {time: {...}}}
+        Returns one row per model and time with the metrics (and their CI bounds if n_boot > 0)
+    """
+
+    if all(isinstance(key, (int, np.integer)) for key in results.keys()):
+        results = {'model': results}
+
+    jobs = [(model_name, time, np.asarray(data['y_test'], dtype=np.float64), np.asarray(data['y_pred_proba']),
+             threshold, n_boot, seed)
+            for model_name, model_results in results.items() for time, data in model_results.items()]
+
+    if n_boot > 0 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(_evaluate_job, jobs))
+    else:
+        rows = [_evaluate_job(job) for job in jobs]
+
+    return pd.DataFrame(rows)
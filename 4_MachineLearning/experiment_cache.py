@@ -0,0 +1,230 @@
+"""
+    Content-addressed cache for the experiments of TIME_ML.ipynb.
+
+    An entry is stored under a hash of everything it depends on: the input data files
+    (hashed on their content), the source of the code that computed it and its parameters
+    (ids, estimator settings, simulation time, ...). A rerun with the same inputs loads the
+    entry instead of recomputing it, and a change in the data, code or parameters gives a
+    new key, so an entry is never stale. The entries are joblib files in one directory per
+    kind (text_preds, features, fits, evaluations). A hit touches the file, and the least
+    recently used entries are removed when the cache grows over its disk budget.
+
+    usage (from the 4_MachineLearning directory):
+    python3 experiment_cache.py [--cache-dir ./.experiment_cache] [--clear]
+"""
+import argparse
+import hashlib
+import inspect
+import marshal
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR = './.experiment_cache'
+MAX_GB = 20
+
+file_hashes = {}  # (path, size, mtime) -> content hash, a data file is read once per session
+
+
+#####################
+# hashing functions #
+#####################
+
+def hash_file(path, block_size=1 << 20):
+    """ Hash of the content of a file """
+
+    stat = os.stat(path)
+    stamp = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if stamp not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as stream:
+            for block in iter(lambda: stream.read(block_size), b''):
+                digest.update(block)
+        file_hashes[stamp] = digest.hexdigest()
+
+    return file_hashes[stamp]
+
+
+def get_source(obj):
+    """ Source code of a module, class or function (the compiled code if the source is not available) """
+
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        code = getattr(obj, '__code__', None)
+        return marshal.dumps(code) if code is not None else repr(obj)
+
+
+def update_hash(digest, value):
+    """ Adds a value to the hash: arrays and pandas objects on their content, estimators on their parameters """
+
+    digest.update(type(value).__name__.encode())
+
+    if isinstance(value, (pd.Series, pd.DataFrame, pd.Index)):
+        digest.update(pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index)).to_numpy().tobytes())
+        update_hash(digest, list(value.columns) if isinstance(value, pd.DataFrame) else value.name)
+    elif isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype}{value.shape}'.encode())
+        data = pd.util.hash_array(value.ravel()) if value.dtype == object else np.ascontiguousarray(value)
+        digest.update(data.tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            update_hash(digest, key)
+            update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in (sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value):
+            update_hash(digest, item)
+    elif hasattr(value, 'get_params'):  # scikit-learn style estimator
+        update_hash(digest, type(value).__qualname__)
+        update_hash(digest, value.get_params(deep=False))
+    else:
+        digest.update(repr(value).encode())
+
+
+def get_key(*parts):
+    """ Content key of the parts """
+
+    digest = hashlib.sha256()
+    for part in parts:
+        update_hash(digest, part)
+
+    return digest.hexdigest()[:32]
+
+
+def get_data_version(*paths):
+    """ Version of the input data: the content hash of every file """
+    return get_key({str(path): hash_file(path) for path in paths})
+
+
+def get_code_version(*objects):
+    """ Version of the code: the source of the given modules and functions """
+    return get_key([get_source(obj) for obj in objects])
+
+
+def remove_file(path):
+    """ Removes a file, a file that is already removed (by another process) is ignored """
+
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+#####################
+# cache             #
+#####################
+
+class ExperimentCache:
+    """ On-disk cache of kind/key -> object with least recently used eviction under a disk budget """
+
+    def __init__(self, root=CACHE_DIR, max_gb=MAX_GB):
+        self.root = Path(root)
+        self.max_bytes = max_gb * 1e9
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def get_path(self, kind, key):
+        return self.root / kind / f'{key}.joblib'
+
+    def count(self, kind, counter):
+        with self.lock:
+            counts = self.counters.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts[counter] += 1
+
+    def get(self, kind, key, mmap_mode=None):
+        """ Loads an entry, returns (found, value), a hit marks the entry as recently used """
+
+        path = self.get_path(kind, key)
+        try:
+            value = joblib.load(path, mmap_mode=mmap_mode)
+        except FileNotFoundError:
+            self.count(kind, 'misses')
+            return False, None
+
+        path.touch()
+        self.count(kind, 'hits')
+        return True, value
+
+    def put(self, kind, key, value):
+        """ Stores an entry (written to a temporary file and renamed, so a reader never sees half an entry) """
+
+        path = self.get_path(kind, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+
+        self.evict(keep=path)
+
+    def memoize(self, kind, key, compute):
+        """ Loads the entry, or computes and stores it when it is not in the cache """
+
+        found, value = self.get(kind, key)
+        if not found:
+            value = compute()
+            self.put(kind, key, value)
+
+        return value
+
+    def get_entries(self):
+        """ All entries as (last used, size, path), least recently used first """
+
+        entries = []
+        for path in self.root.glob('*/*.joblib'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """ Removes the least recently used entries until the cache fits the disk budget """
+
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                remove_file(path)
+                total -= size
+
+    def clear(self):
+        """ Removes all entries """
+
+        for _, _, path in self.get_entries():
+            remove_file(path)
+
+    def stats(self):
+        """ Hits and misses per kind of this session, the number of entries and size per kind on disk """
+
+        on_disk = {}
+        for _, size, path in self.get_entries():
+            kind = on_disk.setdefault(path.parent.name, {'entries': 0, 'MB': 0})
+            kind['entries'] += 1
+            kind['MB'] += size / 1e6
+
+        with self.lock:
+            return {'counters': {kind: dict(counts) for kind, counts in self.counters.items()}, 'on_disk': on_disk,
+                    'max_GB': self.max_bytes / 1e9}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shows or clears the experiment cache of TIME_ML.ipynb')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--clear', action='store_true', help='remove all entries')
+    args = parser.parse_args()
+
+    cache = ExperimentCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    for kind, counts in cache.stats()['on_disk'].items():
+        print(f'{kind:12} {counts["entries"]:6} entries {counts["MB"]:10.1f} MB')
@@ -0,0 +1,160 @@
+"""
+    Preallocated feature matrix for the time simulation.
+
+    The features of all visits are kept in one float32 (visits x features) array,
+    optionally memory-mapped to a .npy file. The static (arrival) columns are written
+    once. The lab, vital, report and triage rows are converted once to event arrays with an
+    integer (row, column) key and their offset in seconds after arrival, so filling the
+    matrix for a simulation time is a mask, a "last event per key" selection and one
+    in-place assignment per stream. The rows follow the given order, so a train/test
+    split that puts the train ids first gives both sets as views without copies.
+"""
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+
+CHUNK_ROWS = 65536  # rows per chunk when replacing missing or negative values
+
+
+####################
+# helper functions #
+####################
+
+def get_offsets(times, arrival):
+    """ Seconds between arrival and the given times, inf if the time is missing (never available) """
+
+    offsets = (pd.to_datetime(times) - pd.to_datetime(arrival)).dt.total_seconds().to_numpy(dtype=np.float64)
+    return np.where(np.isnan(offsets), np.inf, offsets)
+
+
+def create_events(rows, cols, offsets, values, n_cols):
+    """ Creates an event array sorted on (row, column) key, the original order is kept within a key """
+
+    keep = (rows >= 0) & (cols >= 0)
+    keys = rows[keep].astype(np.int64) * n_cols + cols[keep]
+    order = np.argsort(keys, kind='mergesort')
+
+    return {'keys': keys[order], 'offsets': offsets[keep][order],
+            'values': np.asarray(values, dtype=np.float32)[keep][order]}
+
+
+def write_last_events(X, events, time):
+    """ Writes the value of the last available event per (row, column), like groupby('SEHID').last() """
+
+    available = events['offsets'] < time * 60
+    keys, values = events['keys'][available], events['values'][available]
+    if len(keys) == 0:
+        return
+
+    last = np.r_[keys[1:] != keys[:-1], True]
+    rows, cols = np.divmod(keys[last], X.shape[1])
+    X[rows, cols] = values[last]
+
+
+###########################
+# feature matrix creation #
+###########################
+
+def create_feature_matrix(df_seh, df_time, df_lab, df_vitals, feature_cols, triage_cols, row_order=None, path=None, df_rad=None):
+    """
+        Creates the feature matrix and the event arrays of the time dependent data.
+        feature_cols are the model inputs in order, triage_cols the columns that are only known after triage.
+        If a path is given the matrix is memory-mapped to that .npy file instead of kept in memory.
+        df_rad are the scored reports (AANKOMST, ACCORD and RAD_PRED, index SEHID, see rad_training.get_report_preds).
+    """
+
+    index = pd.Index(df_seh.index if row_order is None else row_order)
+    columns = pd.Index(feature_cols)
+    shape = (len(index), len(columns))
+
+    if path is None:
+        X = np.full(shape, np.nan, dtype=np.float32)
+    else:
+        X = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        X[:] = np.nan
+
+    # static columns (known at arrival)
+    seh_rows = df_seh.index.get_indexer(index)
+    time_dependent = {*triage_cols, *df_lab['DESC'].unique(), *df_vitals['LABEL'].unique()}
+    for col in columns:
+        if col in df_seh.columns and col not in time_dependent:
+            X[:, columns.get_loc(col)] = df_seh[col].to_numpy(dtype=np.float32)[seh_rows]
+
+    # triage: the values are copied in once the visit is triaged
+    df_time = df_time.reindex(index)
+    triage = {'cols': columns.get_indexer(triage_cols),
+              'offsets': get_offsets(df_time['TRIAGE'], df_time['AANKOMST']),
+              'values': df_seh[triage_cols].to_numpy(dtype=np.float32)[seh_rows]}
+
+    # lab: -1 once the sample is taken, the result once it is back (NaN if it has no numeric result)
+    lab_rows = index.get_indexer(df_lab.index)
+    lab_cols = columns.get_indexer(df_lab['DESC'])
+    taken = get_offsets(df_lab['AFNAME_TIJDSTIP'], df_lab['AANKOMST_TIJDSTIP'])
+    returned = get_offsets(df_lab['UITSLAG_TIJDSTIP'], df_lab['AANKOMST_TIJDSTIP'])
+    has_result = df_lab['UITSLAG'].notna().to_numpy()
+    lab_events = [create_events(lab_rows, lab_cols, taken, np.full(len(df_lab), -1), len(columns)),
+                  create_events(lab_rows, lab_cols, returned, np.full(len(df_lab), np.nan), len(columns)),
+                  create_events(lab_rows[has_result], lab_cols[has_result], returned[has_result],
+                                df_lab['UITSLAG'][has_result], len(columns))]
+
+    # vitals: the last measured value
+    has_value = df_vitals['Value1'].notna().to_numpy()
+    df_vitals = df_vitals[has_value]
+    vital_events = [create_events(index.get_indexer(df_vitals.index), columns.get_indexer(df_vitals['LABEL']),
+                                  get_offsets(df_vitals['DateTime'], df_vitals['AANKOMST']), df_vitals['Value1'],
+                                  len(columns))]
+
+    # reports: the score of the last accorded report, like the API (RAD_PRED stays missing without reports)
+    report_events = []
+    if df_rad is not None:
+        df_rad = df_rad.sort_values('ACCORD', kind='mergesort')
+        report_events.append(create_events(index.get_indexer(df_rad.index), np.full(len(df_rad), columns.get_indexer(['RAD_PRED'])[0]),
+                                           get_offsets(df_rad['ACCORD'], df_rad['AANKOMST']), df_rad['RAD_PRED'], len(columns)))
+
+    return {'X': X, 'index': index, 'columns': columns, 'triage': triage, 'events': lab_events + vital_events + report_events}
+
+
+def fill_features_at(fm, time, can_handle_na=True, can_handle_neg=True):
+    """ Fills the matrix in place with the data available `time` minutes after arrival """
+
+    X = fm['X']
+
+    triage = fm['triage']
+    triaged = np.flatnonzero(triage['offsets'] < time * 60)
+    X[np.ix_(triaged, triage['cols'])] = triage['values'][triaged]
+
+    for events in fm['events']:
+        write_last_events(X, events, time)
+
+    if not can_handle_na or not can_handle_neg:
+        for start in range(0, len(X), CHUNK_ROWS):
+            chunk = X[start:start + CHUNK_ROWS]
+            if not can_handle_na:
+                chunk[np.isnan(chunk)] = -1
+            if not can_handle_neg:
+                chunk[chunk < 0] = 0
+
+    return X
+
+
+def set_column(fm, col, values):
+    """ Sets a column of the matrix, values is a Series on SEHID or an array in row order """
+
+    if isinstance(values, pd.Series):
+        values = values.reindex(fm['index']).to_numpy()
+    fm['X'][:, fm['columns'].get_loc(col)] = values
+
+
+#################
+# model inputs  #
+#################
+
+def to_frame(fm, rows=slice(None)):
+    """ DataFrame on (a slice of) the matrix with the feature names, a slice of rows gives a view """
+    return pd.DataFrame(fm['X'][rows], index=fm['index'][rows], columns=fm['columns'], copy=False)
+
+
+def get_dmatrix(fm, rows=slice(None), label=None):
+    """ XGBoost DMatrix on (a slice of) the matrix, missing values are NaN """
+    return xgb.DMatrix(fm['X'][rows], label=label, missing=np.nan, feature_names=list(fm['columns']))
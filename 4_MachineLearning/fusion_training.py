@@ -0,0 +1,202 @@
+"""
+    Trains and exports the late fusion models of Fusion_Techniques_ML.ipynb for the flask API.
+
+    The SEH, LAB and VITALS models are trained on the feature matrix of the time simulation,
+    stacked over the simulation times, and each only on the rows that have data for the
+    modality. The TEXT modality is the complaint text model (KLACHT_PRED) and the RAD modality
+    the report text model (RAD_PRED, the last accorded report at the time). The meta-models
+    (one per combination of available modalities) are trained on out-of-fold predictions,
+    grouped per visit so the rows of one visit at different times stay in one fold.
+    The AUC of the modalities and the fusion on the test split is printed per time.
+
+    usage (from the 4_MachineLearning directory):
+    python3 fusion_training.py [--config ml_config.yaml] [--out ../5_Deployment/flask/models/fusion.joblib]
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+import yaml
+from nltk.corpus import stopwords
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import GroupKFold, cross_val_predict, train_test_split
+from sklearn.pipeline import make_pipeline
+
+import feature_matrix
+import rad_training
+
+# the combination of the modalities is shared with the API
+sys.path.append(str(Path(__file__).resolve().parents[1] / '5_Deployment/flask'))
+import fusion
+
+
+MODEL_TIMES = list(range(0, 190, 10))
+MODALITY_MODELS = {
+    'SEH': lambda: xgb.XGBClassifier(objective='binary:logistic', random_state=0, eval_metric='logloss'),
+    'LAB': lambda: xgb.XGBClassifier(objective='binary:logistic', random_state=0, eval_metric='logloss', booster='dart'),
+    'VITALS': lambda: xgb.XGBClassifier(objective='binary:logistic', random_state=0, eval_metric='logloss')}
+
+
+#####################
+# loading functions #
+#####################
+
+def load_data(config, before='2022'):
+    """ Loads the processed data of the time simulation (visits before the given date) """
+
+    df_seh    = pd.read_csv(config['seh_data'], sep=';', index_col='SEHID')
+    df_time   = pd.read_csv(config['time_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST', 'TRIAGE', 'EIND'])
+    df_lab    = pd.read_csv(config['lab_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST_TIJDSTIP', 'AFNAME_TIJDSTIP', 'UITSLAG_TIJDSTIP'])
+    df_vitals = pd.read_csv(config['vital_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST', 'DateTime'])
+    df_rad    = rad_training.load_reports(config['rad_data'], before)
+
+    df_time = df_time[df_time['AANKOMST'] < before]
+    df_seh = df_seh[df_seh.index.isin(df_time.index)].drop('PATIENTNR', axis=1)
+    df_lab = df_lab[df_lab.index.isin(df_time.index)]
+    df_vitals = df_vitals[df_vitals.index.isin(df_time.index)]
+    df_rad = df_rad[df_rad['SEHID'].isin(df_time.index)]
+
+    return df_seh, df_time, df_lab, df_vitals, df_rad
+
+
+def get_modality_columns(df_seh, df_lab, df_vitals):
+    """ Gets the columns of every modality and the triage columns, in the order of the time models """
+
+    triage_cols = [col for col in df_seh.columns if col.startswith('klacht_')] + ['TRIANIVCOD']
+    lab_vals = df_lab['DESC'].unique().tolist()
+    vitals = df_vitals['LABEL'].unique().tolist()
+    seh_cols = [col for col in [*df_seh.columns[~df_seh.columns.isin(triage_cols)], *triage_cols]
+                if col not in ('OPNAME', 'KLACHT')]
+
+    return {'SEH': seh_cols, 'TEXT': ['KLACHT_PRED'], 'LAB': lab_vals, 'VITALS': vitals, 'RAD': ['RAD_PRED']}, triage_cols
+
+
+#####################
+# training          #
+#####################
+
+def get_text_preds(df_seh, ids_train, ids_test, cv=5):
+    """ Out-of-fold text predictions for the train visits and predictions of the full text model for the test visits """
+
+    text_model = make_pipeline(TfidfVectorizer(ngram_range=(1, 6), stop_words=list(stopwords.words('dutch'))),
+                               LogisticRegression(max_iter=1000))
+    text_train, y_train = df_seh.loc[ids_train, 'KLACHT'].astype(str), df_seh.loc[ids_train, 'OPNAME']
+
+    preds = pd.Series(np.nan, index=df_seh.index)
+    preds[ids_train] = cross_val_predict(text_model, text_train, y_train, cv=cv, method='predict_proba')[:, 1]
+    preds[ids_test] = text_model.fit(text_train, y_train).predict_proba(df_seh.loc[ids_test, 'KLACHT'].astype(str))[:, 1]
+
+    return preds
+
+
+def stack_times(fm, n_train, times):
+    """ Fills the matrix at every time and stacks the train and test rows, with the visit position and time per row """
+
+    X_train, X_test = [], []
+    for time in times:
+        feature_matrix.fill_features_at(fm, time)
+        X_train.append(fm['X'][:n_train].copy())
+        X_test.append(fm['X'][n_train:].copy())
+
+    n_test = len(fm['X']) - n_train
+    return (np.concatenate(X_train), np.tile(np.arange(n_train), len(times)),
+            np.concatenate(X_test), np.repeat(times, n_test))
+
+
+def train_fusion(X, y, groups, columns, modality_columns, method='meta', cv=5):
+    """ Trains the modality models and the meta-models (on out-of-fold modality predictions) """
+
+    modalities = [{'name': name, 'columns': cols, 'model': None} for name, cols in modality_columns.items()]
+    available = fusion.get_availability(modalities, X, columns)
+    oof = np.full((len(X), len(modalities)), np.nan)
+
+    for m, modality in enumerate(modalities):
+        rows = np.flatnonzero(available[:, m])
+        if modality['name'] not in MODALITY_MODELS:
+            oof[:, m] = fusion.score_modality(modality, X, columns, rows)
+            continue
+
+        X_modality = pd.DataFrame(X[np.ix_(rows, columns.get_indexer(modality['columns']))], columns=modality['columns'])
+        oof[rows, m] = cross_val_predict(MODALITY_MODELS[modality['name']](), X_modality, y[rows], groups=groups[rows],
+                                         cv=GroupKFold(cv), method='predict_proba')[:, 1]
+        modality['model'] = MODALITY_MODELS[modality['name']]().fit(X_modality, y[rows])
+        print(f'{modality["name"]} model trained on {len(rows)} rows')
+
+    # one meta-model per combination of available modalities (that has both outcomes)
+    names = [modality['name'] for modality in modalities]
+    patterns = np.array([fusion.get_pattern_key([name for name, has in zip(names, row) if has]) for row in available])
+    meta_models = {}
+    for pattern in np.unique(patterns):
+        rows = np.flatnonzero(patterns == pattern)
+        if pattern and len(np.unique(y[rows])) == 2:
+            cols = [names.index(name) for name in pattern.split('+')]
+            meta_models[pattern] = LogisticRegression().fit(fusion.get_logits(oof[np.ix_(rows, cols)]), y[rows])
+            print(f'meta-model {pattern} trained on {len(rows)} rows')
+
+    return {'modalities': modalities, 'meta_models': meta_models, 'weights': dict(fusion.WEIGHTS), 'method': method}
+
+
+def evaluate_fusion(fusion_model, X, y, row_times, columns):
+    """ AUC per time of every modality (on the visits that have it) and of both fusion methods """
+
+    available = fusion.get_availability(fusion_model['modalities'], X, columns)
+    probas = np.column_stack([fusion.score_modality(modality, X, columns, np.flatnonzero(available[:, m]))
+                              for m, modality in enumerate(fusion_model['modalities'])])
+    scores = {'META': fusion.combine(fusion_model, probas, available, 'meta'),
+              'WEIGHTED_AVERAGE': fusion.combine(fusion_model, probas, available, 'weighted_average')}
+
+    results = []
+    for time in np.unique(row_times):
+        at_time = row_times == time
+        result = {'Time': time}
+        for m, modality in enumerate(fusion_model['modalities']):
+            rows = at_time & available[:, m]
+            result[modality['name']] = roc_auc_score(y[rows], probas[rows, m]) if len(np.unique(y[rows])) == 2 else np.nan
+        for name, score in scores.items():
+            result[name] = roc_auc_score(y[at_time], score[at_time])
+        results.append(result)
+
+    return pd.DataFrame(results).round(3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trains the late fusion models and exports them for the flask API')
+    parser.add_argument('--config', default='./ml_config.yaml')
+    parser.add_argument('--out', default='../5_Deployment/flask/models/fusion.joblib')
+    parser.add_argument('--method', choices=['meta', 'weighted_average'], default='meta')
+    parser.add_argument('--times', default=','.join(map(str, MODEL_TIMES)), help='simulation times to train on (minutes)')
+    parser.add_argument('--before', default='2022', help='only visits that arrived before this date')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+    times = [int(time) for time in args.times.split(',')]
+
+    df_seh, df_time, df_lab, df_vitals, df_rad = load_data(config, args.before)
+    modality_columns, triage_cols = get_modality_columns(df_seh, df_lab, df_vitals)
+    feature_cols = [col for cols in modality_columns.values() for col in cols]
+
+    ids_train, ids_test, _, _ = train_test_split(df_seh.index, df_seh['OPNAME'], test_size=0.2, random_state=999,
+                                                 stratify=df_seh['OPNAME'])
+
+    fm = feature_matrix.create_feature_matrix(df_seh, df_time, df_lab, df_vitals, feature_cols, triage_cols,
+                                              [*ids_train, *ids_test], df_rad=rad_training.get_report_preds(df_rad, ids_train, ids_test))
+    feature_matrix.set_column(fm, 'KLACHT_PRED', get_text_preds(df_seh, ids_train, ids_test))
+
+    X_train, visits_train, X_test, times_test = stack_times(fm, len(ids_train), times)
+    y_train = np.tile(df_seh.loc[ids_train, 'OPNAME'].to_numpy(), len(times))
+    y_test = np.tile(df_seh.loc[ids_test, 'OPNAME'].to_numpy(), len(times))
+
+    fusion_model = train_fusion(X_train, y_train, visits_train, fm['columns'], modality_columns, args.method)
+    print(evaluate_fusion(fusion_model, X_test, y_test, times_test, fm['columns']).to_string(index=False))
+
+    fusion_model.update({'created': datetime.now().isoformat(timespec='seconds'), 'times': times})
+    joblib.dump(fusion_model, args.out)
+    print(f'{args.out} written')
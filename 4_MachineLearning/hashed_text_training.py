@@ -0,0 +1,173 @@
+"""
+    Trains the hashed complaint text model out-of-core and compares it with the tfidf vectorizer.
+
+    The SEH export is read in chunks: the first pass counts the documents per hash bucket
+    (idf), the next passes train the logistic regression with SGD, so memory does not grow
+    with the number of complaints. The visits are split like TIME_ML.ipynb.
+
+    With --compare both text pipelines (the tfidf vectorizer of train_nlp_vec and the hashed
+    model) give the KLACHT_PRED feature of an xgboost model per time of the simulation, and
+    the test AUC of both is printed per time, with the text-only AUC and the model sizes.
+
+    usage (from the 4_MachineLearning directory):
+    python3 hashed_text_training.py [--config ml_config.yaml] [--out ../5_Deployment/flask/models/klacht_hashed.joblib] [--compare]
+"""
+import argparse
+import pickle
+import sys
+from pathlib import Path
+
+import joblib
+import pandas as pd
+import xgboost as xgb
+import yaml
+from nltk.corpus import stopwords
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+import feature_matrix
+
+# the hashed text model is shared with the API
+sys.path.append(str(Path(__file__).resolve().parents[1] / '5_Deployment/flask'))
+import hashed_text
+
+
+MODEL_TIMES = list(range(0, 190, 10))
+
+
+#####################
+# loading functions #
+#####################
+
+def get_split(config, before='2022'):
+    """ Splits the visits before the given date like TIME_ML.ipynb, only the id and outcome columns are loaded """
+
+    df_time = pd.read_csv(config['time_data'], sep=';', usecols=['SEHID', 'AANKOMST'], parse_dates=['AANKOMST'])
+    df_seh = pd.read_csv(config['seh_data'], sep=';', usecols=['SEHID', 'OPNAME'], index_col='SEHID')
+    df_seh = df_seh[df_seh.index.isin(df_time.loc[df_time['AANKOMST'] < before, 'SEHID'])]
+
+    ids_train, ids_test, _, _ = train_test_split(df_seh.index, df_seh['OPNAME'], test_size=0.2, random_state=999,
+                                                 stratify=df_seh['OPNAME'])
+    return ids_train, ids_test
+
+
+def iter_chunks(seh_path, ids, chunksize):
+    """ Yields the complaints and outcomes of the given visits, one chunk of the SEH export at a time """
+
+    ids = set(ids)
+    for chunk in pd.read_csv(seh_path, sep=';', usecols=['SEHID', 'KLACHT', 'OPNAME'], chunksize=chunksize):
+        chunk = chunk[chunk['SEHID'].isin(ids)]
+        if len(chunk):
+            yield chunk['KLACHT'].astype(str), chunk['OPNAME'].astype(int).to_numpy()
+
+
+#####################
+# training          #
+#####################
+
+def train_hashed_model(seh_path, ids_train, chunksize=20000, epochs=5, n_features=hashed_text.N_FEATURES):
+    """ Trains the hashed model in streaming passes over the SEH export """
+
+    model = hashed_text.create_model(stopwords.words('dutch'), n_features)
+    for texts, _ in iter_chunks(seh_path, ids_train, chunksize):
+        hashed_text.update_doc_counts(model, texts)
+    hashed_text.finish_idf(model)
+
+    classifier = hashed_text.create_classifier()
+    for epoch in range(epochs):
+        for texts, y in iter_chunks(seh_path, ids_train, chunksize):
+            hashed_text.partial_fit(model, classifier, texts, y)
+        print(f'epoch {epoch + 1}/{epochs} done')
+
+    return hashed_text.finish_model(model, classifier)
+
+
+def predict_hashed(model, seh_path, chunksize=20000):
+    """ Predictions of the hashed model for all visits of the export, streamed over the chunks """
+
+    preds = [pd.Series(hashed_text.predict_proba(model, chunk['KLACHT'].astype(str)), index=chunk['SEHID'])
+             for chunk in pd.read_csv(seh_path, sep=';', usecols=['SEHID', 'KLACHT'], chunksize=chunksize)]
+    return pd.concat(preds)
+
+
+def train_tfidf_model(text_train, y_train):
+    """ The current text pipeline (train_nlp_vec in TIME_ML.ipynb with a logistic regression) """
+
+    vec = TfidfVectorizer(ngram_range=(1, 6), stop_words=list(stopwords.words('dutch')))
+    nlp_model = LogisticRegression(max_iter=1000).fit(vec.fit_transform(text_train.astype(str)), y_train)
+
+    return vec, nlp_model
+
+
+#####################
+# comparison        #
+#####################
+
+def compare_over_time(config, ids_train, ids_test, text_preds, times=MODEL_TIMES, before='2022'):
+    """ Test AUC of an xgboost model per simulation time for every set of KLACHT_PRED predictions """
+
+    df_seh    = pd.read_csv(config['seh_data'], sep=';', index_col='SEHID')
+    df_time   = pd.read_csv(config['time_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST', 'TRIAGE', 'EIND'])
+    df_lab    = pd.read_csv(config['lab_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST_TIJDSTIP', 'AFNAME_TIJDSTIP', 'UITSLAG_TIJDSTIP'])
+    df_vitals = pd.read_csv(config['vital_data'], sep=';', index_col='SEHID', parse_dates=['AANKOMST', 'DateTime'])
+
+    df_time = df_time[df_time['AANKOMST'] < before]
+    df_seh = df_seh[df_seh.index.isin(df_time.index)].drop('PATIENTNR', axis=1)
+    df_lab = df_lab[df_lab.index.isin(df_time.index)]
+    df_vitals = df_vitals[df_vitals.index.isin(df_time.index)]
+
+    triage_cols   = [col for col in df_seh.columns if col.startswith('klacht_')] + ['TRIANIVCOD']
+    aankomst_cols = [col for col in df_seh.columns if col not in triage_cols]
+    all_cols      = [*aankomst_cols, *triage_cols, *df_lab['DESC'].unique(), *df_vitals['LABEL'].unique()]
+    feature_cols  = [col for col in all_cols if col not in ('OPNAME', 'KLACHT')] + ['KLACHT_PRED']
+
+    fm = feature_matrix.create_feature_matrix(df_seh, df_time, df_lab, df_vitals, feature_cols, triage_cols,
+                                              [*ids_train, *ids_test])
+    y_train, y_test = df_seh.loc[ids_train, 'OPNAME'], df_seh.loc[ids_test, 'OPNAME']
+    n_train = len(ids_train)
+
+    results = [{'Time': 'text only', **{name: roc_auc_score(y_test, preds.reindex(ids_test))
+                                        for name, preds in text_preds.items()}}]
+    for time in times:
+        feature_matrix.fill_features_at(fm, time)
+        result = {'Time': time}
+        for name, preds in text_preds.items():
+            feature_matrix.set_column(fm, 'KLACHT_PRED', preds)
+            clf = xgb.XGBClassifier(eval_metric='auc').fit(feature_matrix.to_frame(fm, slice(0, n_train)), y_train)
+            result[name] = roc_auc_score(y_test, clf.predict_proba(feature_matrix.to_frame(fm, slice(n_train, None)))[:, 1])
+        results.append(result)
+        print(result)
+
+    return pd.DataFrame(results).round(4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trains the hashed complaint text model out-of-core')
+    parser.add_argument('--config', default='./ml_config.yaml')
+    parser.add_argument('--out', default='../5_Deployment/flask/models/klacht_hashed.joblib')
+    parser.add_argument('--chunksize', type=int, default=20000, help='complaints per chunk')
+    parser.add_argument('--epochs', type=int, default=5, help='SGD passes over the chunks')
+    parser.add_argument('--n-features', type=int, default=hashed_text.N_FEATURES, help='number of hash buckets')
+    parser.add_argument('--compare', action='store_true', help='compare with the tfidf vectorizer per time')
+    parser.add_argument('--before', default='2022', help='only visits that arrived before this date')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+
+    ids_train, ids_test = get_split(config, args.before)
+    model = train_hashed_model(config['seh_data'], ids_train, args.chunksize, args.epochs, args.n_features)
+    joblib.dump(model, args.out)
+    print(f'{args.out} written ({len(pickle.dumps(model)) / 1e6:.1f} MB)')
+
+    if args.compare:
+        df_text = pd.read_csv(config['seh_data'], sep=';', usecols=['SEHID', 'KLACHT', 'OPNAME'], index_col='SEHID')
+        vec, nlp_model = train_tfidf_model(df_text.loc[ids_train, 'KLACHT'], df_text.loc[ids_train, 'OPNAME'])
+        print(f'tfidf: {len(vec.vocabulary_)} n-grams, {len(pickle.dumps(vec)) / 1e6:.1f} MB')
+
+        text_preds = {'TFIDF': pd.Series(nlp_model.predict_proba(vec.transform(df_text['KLACHT'].astype(str)))[:, 1],
+                                         index=df_text.index),
+                      'HASHED': predict_hashed(model, config['seh_data'], args.chunksize)}
+        print(compare_over_time(config, ids_train, ids_test, text_preds, before=args.before).to_string(index=False))
@@ -0,0 +1,106 @@
+"""
+    Trains the radiology report text model for the flask API.
+
+    The reports are the RAD_REPORT column written by 3_PreProcessing/RAD_preprocessing.py
+    (tokenized, stop words removed and stemmed, the API processes the live reports the same
+    way). The model is a tfidf vectorizer with a logistic regression, like the complaint text
+    model. The visits are split like TIME_ML.ipynb, the test AUC is printed.
+
+    get_report_preds gives the RAD_PRED feature of the time and fusion models: out-of-fold
+    scores for the reports of the train visits and scores of a model on the train reports
+    for the test visits, per report with its accord moment.
+
+    usage (from the 4_MachineLearning directory):
+    python3 rad_training.py RAD_processed.csv [--out-dir ../5_Deployment/flask/models]
+"""
+import argparse
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import GroupKFold, cross_val_predict, train_test_split
+from sklearn.pipeline import make_pipeline
+
+
+MODEL_DIR = '../5_Deployment/flask/models'  # rad_vec and rad_pred_model of the flask config.yaml
+
+
+def load_reports(file_path, before='2022'):
+    """ Loads the processed reports of the visits before the given date """
+
+    df_rad = pd.read_csv(file_path, sep=';', parse_dates=['AANKOMST', 'ACCORD'])
+    df_rad = df_rad[df_rad['AANKOMST'] < before]
+
+    return df_rad[df_rad['RAD_REPORT'].notna()]
+
+
+def create_rad_model():
+    """ Vectorizer and logistic regression of the report text model """
+    return TfidfVectorizer(ngram_range=(1, 3), min_df=2), LogisticRegression(max_iter=1000)
+
+
+def get_model_paths(model_dir=MODEL_DIR):
+    """ Paths of the vectorizer and the report model written by this script """
+    return f'{model_dir}/rad_vec.joblib', f'{model_dir}/rad_lr_model.joblib'
+
+
+def load_rad_model(model_dir=MODEL_DIR):
+    """ Loads the vectorizer and the report model written by this script """
+
+    vec_path, model_path = get_model_paths(model_dir)
+    return joblib.load(vec_path), joblib.load(model_path)
+
+
+def train_rad_model(reports, y):
+    """ Trains the vectorizer and the logistic regression on the processed reports """
+
+    vec, rad_model = create_rad_model()
+    rad_model.fit(vec.fit_transform(reports), y)
+
+    return vec, rad_model
+
+
+def get_report_preds(df_rad, ids_train, ids_test, cv=5):
+    """ Out-of-fold scores of the train reports and scores of a model on the train reports for the test reports (RAD_PRED, index SEHID) """
+
+    df_rad = df_rad.set_index('SEHID')
+    in_train, in_test = df_rad.index.isin(ids_train), df_rad.index.isin(ids_test)
+    reports, y = df_rad.loc[in_train, 'RAD_REPORT'], df_rad.loc[in_train, 'OPNAME'].astype(int)
+    text_model = make_pipeline(*create_rad_model())
+
+    # grouped per visit, so a report is never scored by a model trained on another report of its visit
+    preds = np.full(len(df_rad), np.nan)
+    preds[in_train] = cross_val_predict(text_model, reports, y, groups=reports.index, cv=GroupKFold(cv), method='predict_proba')[:, 1]
+    preds[in_test] = text_model.fit(reports, y).predict_proba(df_rad.loc[in_test, 'RAD_REPORT'])[:, 1]
+
+    scored = in_train | in_test
+    return df_rad.loc[scored, ['AANKOMST', 'ACCORD']].assign(RAD_PRED=preds[scored])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trains the radiology report text model')
+    parser.add_argument('rad_file', help='RAD_processed.csv written by 3_PreProcessing/RAD_preprocessing.py')
+    parser.add_argument('--out-dir', default=MODEL_DIR)
+    parser.add_argument('--before', default='2022', help='only visits that arrived before this date')
+    args = parser.parse_args()
+
+    df_rad = load_reports(args.rad_file, args.before)
+
+    # split on visits, so all reports of a visit are in the same set
+    visits = df_rad.groupby('SEHID')['OPNAME'].first()
+    ids_train, ids_test = train_test_split(visits.index, test_size=0.2, random_state=999, stratify=visits)
+    train, test = df_rad[df_rad['SEHID'].isin(ids_train)], df_rad[df_rad['SEHID'].isin(ids_test)]
+
+    vec, rad_model = train_rad_model(train['RAD_REPORT'], train['OPNAME'].astype(int))
+    test_preds = rad_model.predict_proba(vec.transform(test['RAD_REPORT']))[:, 1]
+    print(f'test AUC (reports): {roc_auc_score(test["OPNAME"].astype(int), test_preds):.3f}')
+
+    # the deployed model is trained on all reports
+    vec, rad_model = train_rad_model(df_rad['RAD_REPORT'], df_rad['OPNAME'].astype(int))
+    vec_path, model_path = get_model_paths(args.out_dir)
+    joblib.dump(vec, vec_path)
+    joblib.dump(rad_model, model_path)
+    print(f'{vec_path} and {model_path} written')
@@ -0,0 +1,404 @@
+"""
+    Incremental ETL from HiX to the reporting tables (SEH_REG, SEH_LAB, SEH_VITALS, SEH_RAD).
+
+    Replaces the DELETE-and-reload cycle of the SSIS package (CLEAN_TABLES, GET_SEH_DATA,
+    GET_LAB_DATA and GET_VITAL_DATA). Every table keeps a high-water mark in ETL_WATERMARKS,
+    each run only fetches the rows at or after that mark and upserts them on the table key.
+    Visits that left the ED are removed with one bounded delete, and every run writes its
+    row counts and timings to ETL_RUNS.
+
+    With a board_url the ETL is the only writer of the board: after every run it posts the
+    reporting tables to the /board endpoint of the API, which scores the changed visits and
+    pushes them to the dashboards (/stream), and it writes the predictions that changed to
+    SEH_PREDICTIONS.
+
+    usage: python3 incremental_etl.py [--config config.yaml] [--interval]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.request
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+import pandas as pd
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../flask/preprocessing/scripts'))
+import patient_history
+
+
+META_TABLES = {
+    'ETL_WATERMARKS': ['TABLE_NAME VARCHAR(32)', 'WATERMARK VARCHAR(32)'],
+    'ETL_RUNS': ['RUN_START VARCHAR(32)', 'TABLE_NAME VARCHAR(32)', 'ROWS_UPSERTED INTEGER', 'ROWS_DELETED INTEGER',
+                 'SECONDS FLOAT'],
+}
+MAX_PARAMS = 1000  # SQL Server allows 2100 parameters per statement
+
+# the board posted to the API (the /get_predictions payload), per stream the reporting table and its columns
+SEH_COLUMNS = ['SEHID', 'PATIENTNR', 'LEEFTIJD', 'GESLACHT', 'VVCODE', 'SPECIALISM', 'PreviousVisits',
+               'PrevAdmissionPercentage', 'AANKSDATUM', 'AANKSTIJD', 'TRIANIVCOD', 'TRIADATUM', 'TRIAGETIJD', 'KLACHT']
+BOARD_QUERIES = {'seh_data': ('SEH_REG', f'SELECT {", ".join(SEH_COLUMNS)} FROM SEH_REG'),
+                 'lab_data': ('SEH_LAB', 'SELECT * FROM SEH_LAB'),
+                 'vital_data': ('SEH_VITALS', 'SELECT * FROM SEH_VITALS'),
+                 'rad_data': ('SEH_RAD', 'SELECT PATIENTNR, VERSLAGNR, ACCDATUM, ACCTIJD, TRANSTEXT FROM SEH_RAD')}
+PREDICTION_COLUMNS = ['SEHID', 'PATIENTNR', 'AANKSDATUM', 'AANKSTIJD', 'LEEFTIJD', 'GESLACHT', 'VVCODE', 'KLACHT',
+                      'SPECIALISM', 'PreviousVisits', 'PrevAdmissionPercentage', 'TRIANIVCOD', 'TRIADATUM', 'TRIAGETIJD']
+
+
+########################
+# database functions   #
+########################
+
+def connect(db_config):
+    """ Connects to the database (odbc, or sqlite when a sqlite file is given, the queries in ./queries need sql server) """
+
+    if db_config.get('sqlite'):
+        return sqlite3.connect(db_config['sqlite'])
+
+    import pyodbc  # only needed for the odbc connections
+    return pyodbc.connect(DRIVER=db_config['driver'], SERVER=db_config['server'], DATABASE=db_config['database'],
+                          UID=db_config['uid'], PWD=db_config['pwd'])
+
+
+def fetch(con, query, params=()):
+    """ Executes the query, returns the column names and the rows """
+
+    cursor = con.cursor()
+    cursor.execute(query, list(params))
+    columns = [col[0] for col in cursor.description]
+
+    return columns, [tuple(row) for row in cursor.fetchall()]
+
+
+def table_exists(con, table):
+    """ Checks if the table exists (works for both sqlite and sql server) """
+
+    try:
+        con.cursor().execute(f'SELECT 1 FROM {table} WHERE 1 = 0')
+        return True
+    except Exception:
+        con.rollback()
+        return False
+
+
+def ensure_table(con, table, columns):
+    """ Creates the table if it does not exist yet (the reporting tables already exist on sql server) """
+
+    if not table_exists(con, table):
+        con.cursor().execute(f'CREATE TABLE {table} ({", ".join(columns)})')
+        con.commit()
+
+
+def placeholders(n):
+    """ Returns n comma separated parameter placeholders """
+    return ', '.join(['?'] * n)
+
+
+def chunks(items, size=MAX_PARAMS):
+    """ Splits the items in lists of at most size items """
+
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+#######################
+# watermark functions #
+#######################
+
+def get_watermarks(con):
+    """ Gets the high-water mark per table """
+
+    _, rows = fetch(con, 'SELECT TABLE_NAME, WATERMARK FROM ETL_WATERMARKS')
+    return dict(rows)
+
+
+def set_watermark(con, table, watermark):
+    """ Saves the high-water mark of the table """
+
+    cursor = con.cursor()
+    cursor.execute('DELETE FROM ETL_WATERMARKS WHERE TABLE_NAME = ?', [table])
+    cursor.execute('INSERT INTO ETL_WATERMARKS (TABLE_NAME, WATERMARK) VALUES (?, ?)', [table, watermark])
+
+
+def log_run(con, run_start, table, n_upserted, n_deleted, seconds):
+    """ Writes the row counts and timing of a table to the run log """
+
+    con.cursor().execute('INSERT INTO ETL_RUNS (RUN_START, TABLE_NAME, ROWS_UPSERTED, ROWS_DELETED, SECONDS) '
+                         'VALUES (?, ?, ?, ?, ?)', [run_start, table, n_upserted, n_deleted, round(seconds, 3)])
+    print(f'{run_start} {table}: {n_upserted} upserted, {n_deleted} deleted ({seconds:.2f}s)')
+
+
+#################
+# ETL functions #
+#################
+
+def upsert_rows(con, table, key, columns, rows):
+    """ Upserts the rows on the key columns (delete + insert, supported by both sqlite and sql server) """
+
+    if not rows:
+        return 0
+
+    # the last row wins if the source returns the same key more than once
+    key_idx = [columns.index(col) for col in key]
+    rows = list({tuple(row[i] for i in key_idx): row for row in rows}.values())
+
+    cursor = con.cursor()
+    where = ' AND '.join(f'{col} = ?' for col in key)
+    cursor.executemany(f'DELETE FROM {table} WHERE {where}', [[row[i] for i in key_idx] for row in rows])
+    cursor.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders(len(columns))})', rows)
+
+    return len(rows)
+
+
+def delete_rows(con, table, column, values):
+    """ Deletes the rows where column is in values in one statement """
+
+    values = sorted(values)
+    if not values:
+        return 0
+
+    cursor = con.cursor()
+    cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders(len(values))})', values)
+
+    return cursor.rowcount
+
+
+def split_watermark(columns, rows):
+    """ Removes the WATERMARK column from the rows, returns the columns, rows and highest watermark """
+
+    wm_idx = columns.index('WATERMARK')
+    watermark = max((row[wm_idx] for row in rows if row[wm_idx] is not None), default=None)
+    columns = [col for i, col in enumerate(columns) if i != wm_idx]
+    rows = [tuple(val for i, val in enumerate(row) if i != wm_idx) for row in rows]
+
+    return columns, rows, watermark
+
+
+def fetch_changed_rows(source, query, watermark, patients=None):
+    """ Fetches the rows at or after the watermark, for the given patients if the query has a patient filter """
+
+    if patients is None:
+        return fetch(source, query, [watermark])
+
+    columns, rows = None, []
+    for patient_chunk in chunks(patients):
+        columns, chunk_rows = fetch(source, query.format(patients=placeholders(len(patient_chunk))),
+                                    [watermark, *patient_chunk])
+        rows.extend(chunk_rows)
+
+    return columns, rows
+
+
+def add_history_columns(columns, rows, store):
+    """ Adds PreviousVisits and PrevAdmissionPercentage from the history store to the SEH_REG rows """
+
+    df = pd.DataFrame(rows, columns=columns)
+    df = patient_history.add_history_features(df, store)
+
+    return list(df.columns), list(df.itertuples(index=False, name=None))
+
+
+def update_patient_history(source, store_path, query_path, watermark):
+    """ Adds the visits that changed since the watermark to the history store, returns the store and new watermark """
+
+    with open(query_path) as query_file:
+        columns, rows = fetch(source, query_file.read(), [watermark])
+
+    store_con = patient_history.connect_store(store_path)
+    if rows:
+        columns, rows, new_watermark = split_watermark(columns, rows)
+        patient_history.update_store(store_con, patient_history.build_history(pd.DataFrame(rows, columns=columns)))
+        watermark = max(filter(None, [watermark, new_watermark]))
+
+    store = patient_history.load_store(store_con, since=patient_history.store_cutoff())
+    store_con.close()
+
+    return store, len(rows), watermark
+
+
+def load_table(source, destination, table, table_config, watermark, patients=None, history_store=None):
+    """ Fetches the changed rows of one table and upserts them, returns the number of rows and the new watermark """
+
+    with open(table_config['query']) as query_file:
+        query = query_file.read()
+
+    columns, rows = fetch_changed_rows(source, query, watermark, patients)
+    if columns is None or not rows:
+        return 0, watermark
+
+    columns, rows, new_watermark = split_watermark(columns, rows)
+    if history_store is not None:
+        columns, rows = add_history_columns(columns, rows, history_store)
+    ensure_table(destination, table, columns)
+    n_upserted = upsert_rows(destination, table, table_config['key'], columns, rows)
+
+    return n_upserted, max(filter(None, [watermark, new_watermark]))
+
+
+def run_etl(source, destination, config):
+    """ Runs one incremental ETL cycle """
+
+    run_start = datetime.now().isoformat(sep=' ', timespec='seconds')
+    tables = config['tables']
+    initial_watermark = config['initial_watermark']
+    max_delete = config['max_delete_rows']
+
+    for table, columns in META_TABLES.items():
+        ensure_table(destination, table, columns)
+    watermarks = get_watermarks(destination)
+
+    # visits on the ED now versus the visits in the reporting tables
+    with open(config['active_visits_query']) as query_file:
+        _, active = fetch(source, query_file.read())
+    current = fetch(destination, 'SELECT SEHID, PATIENTNR FROM SEH_REG')[1] if table_exists(destination, 'SEH_REG') else []
+
+    active_patients = {patient for _, patient in active}
+    current_patients = {patient for _, patient in current}
+    departed_visits = sorted({sehid for sehid, _ in current} - {sehid for sehid, _ in active})[:max_delete]
+    departed_patients = {patient for sehid, patient in current if sehid in departed_visits} - active_patients
+    new_patients = active_patients - current_patients
+    known_patients = active_patients & current_patients
+
+    # PATIENT_HISTORY: changed visits go to the history store, which gives the previous visits of the current visits
+    start = time.perf_counter()
+    history_store, n_closed, watermark = update_patient_history(source, config['patient_history_store'],
+                                                                config['closed_visits_query'],
+                                                                watermarks.get('PATIENT_HISTORY', initial_watermark))
+    set_watermark(destination, 'PATIENT_HISTORY', watermark)
+    log_run(destination, run_start, 'PATIENT_HISTORY', n_closed, 0, time.perf_counter() - start)
+    destination.commit()
+
+    # SEH_REG: changed visits and departed visits
+    start = time.perf_counter()
+    n_upserted, watermark = load_table(source, destination, 'SEH_REG', tables['SEH_REG'],
+                                       watermarks.get('SEH_REG', initial_watermark), history_store=history_store)
+    n_deleted = delete_rows(destination, 'SEH_REG', 'SEHID', departed_visits)
+    set_watermark(destination, 'SEH_REG', watermark)
+    log_run(destination, run_start, 'SEH_REG', n_upserted, n_deleted, time.perf_counter() - start)
+    destination.commit()
+
+    # SEH_LAB, SEH_VITALS and SEH_RAD: rows since the watermark, the whole window for patients new on the ED
+    for table in [table for table in ('SEH_LAB', 'SEH_VITALS', 'SEH_RAD') if table in tables]:
+        start = time.perf_counter()
+        table_watermark = watermarks.get(table, initial_watermark)
+
+        n_deleted = 0
+        if table_exists(destination, table):
+            n_deleted = delete_rows(destination, table, 'PATIENTNR', departed_patients)
+
+        n_known, watermark = load_table(source, destination, table, tables[table], table_watermark, known_patients)
+        n_new, new_watermark = load_table(source, destination, table, tables[table], initial_watermark, new_patients)
+        watermark = max(watermark, new_watermark)
+
+        set_watermark(destination, table, watermark)
+        log_run(destination, run_start, table, n_known + n_new, n_deleted, time.perf_counter() - start)
+        destination.commit()
+
+
+#####################
+# board functions   #
+#####################
+
+def to_json_value(value):
+    """ JSON value of the database types json does not know (dates, times and decimals) """
+
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def read_board(con):
+    """ The reporting tables as the /get_predictions payload (a list per column), None without visits """
+
+    board = {}
+    for stream, (table, query) in BOARD_QUERIES.items():
+        if not table_exists(con, table):
+            continue
+        columns, rows = fetch(con, query)
+        board[stream] = {col: [row[i] for row in rows] for i, col in enumerate(columns)}
+
+    return board if board.get('seh_data', {}).get('SEHID') else None
+
+
+def post_board(url, board, timeout):
+    """ Posts the board to the /board endpoint, returns the predictions of all visits on the board """
+
+    request = urllib.request.Request(url, data=json.dumps(board, default=to_json_value).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)['result']
+
+
+def write_predictions(con, board, results, previous):
+    """ Writes the predictions that changed since the previous board to SEH_PREDICTIONS, returns the written rows """
+
+    seh = board['seh_data']
+    visits = {sehid: row for row, sehid in enumerate(seh['SEHID'])}
+    changed = [result for result in results if result['PREDICTION'] != '' and result['SEHID'] in visits
+               and previous.get(result['SEHID']) != (result['PREDICTION'], result['TIMEDELTA'])]
+    if not changed:
+        return 0
+
+    columns = PREDICTION_COLUMNS + ['PREDICTION', 'MODEL_USED']
+    rows = [[seh[col][visits[result['SEHID']]] for col in PREDICTION_COLUMNS] + [result['PREDICTION'], result['TIMEDELTA']]
+            for result in changed]
+    ensure_table(con, 'SEH_PREDICTIONS', columns)
+    con.cursor().executemany(f'INSERT INTO SEH_PREDICTIONS ({", ".join(columns)}) VALUES ({placeholders(len(columns))})', rows)
+    con.commit()
+
+    return len(rows)
+
+
+def update_board(destination, config, previous):
+    """
+        Posts the board to the API and writes the changed predictions, returns the (PREDICTION, TIMEDELTA) per visit.
+        A failed post is logged and retried with the next run, the previous predictions are kept
+    """
+
+    board = read_board(destination)
+    if board is None:
+        return {}
+
+    start = time.perf_counter()
+    try:
+        results = post_board(config['board_url'], board, config.get('board_timeout', 60))
+    except Exception as e:
+        print(f'Failed to post the board to {config["board_url"]}: {e}')
+        return previous
+
+    n_written = write_predictions(destination, board, results, previous)
+    print(f'board: {len(board["seh_data"]["SEHID"])} visits posted, {n_written} changed predictions written '
+          f'({time.perf_counter() - start:.2f}s)')
+
+    return {result['SEHID']: (result['PREDICTION'], result['TIMEDELTA']) for result in results if result['PREDICTION'] != ''}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental ETL of the ED reporting tables')
+    parser.add_argument('--config', default='./config.yaml')
+    parser.add_argument('--interval', action='store_true', help='keep running every `interval` seconds')
+    args = parser.parse_args()
+
+    with open(args.config) as stream:
+        config = yaml.safe_load(stream)
+
+    source = connect(config['source'])
+    destination = connect(config['destination'])
+
+    predictions = {}  # last prediction per visit, only changed predictions are written
+    while True:
+        run_etl(source, destination, config)
+        if config.get('board_url'):
+            predictions = update_board(destination, config, predictions)
+        if not args.interval:
+            break
+        time.sleep(config['interval'])
@@ -0,0 +1,11 @@
+-- Visits that are currently on the ED (same window as GET_SEH_DATA, without the visits that have ended)
+SELECT
+
+SEHID,
+PATIENTNR
+
+FROM SEH_SEHREG
+
+WHERE DATEDIFF(DAY, AANKSDATUM, GETDATE()) <= 1
+AND VERVALL = 0
+AND EINDTIJD IS NULL
@@ -0,0 +1,14 @@
+-- ED visits that changed since the watermark (? = watermark), for the patient history store
+-- all visits count as previous visit, also the ones without BESTEMMING (the destination only counts for the admissions)
+SELECT
+
+SEHID,
+PATIENTNR,
+AANKSDATUM,
+BESTEMMING,
+CONVERT(VARCHAR(10), MUTDAT, 120) + ' ' + MUTTIJD AS WATERMARK
+
+FROM SEH_SEHREG
+
+WHERE VERVALL = 0
+AND CONVERT(VARCHAR(10), MUTDAT, 120) + ' ' + MUTTIJD >= ?
@@ -0,0 +1,32 @@
+-- New or changed lab results since the watermark (? = watermark) for the given patients ({patients} = ?, ?, ...)
+-- WATERMARK is the result moment, it is not written to SEH_LAB
+SELECT 
+
+LAB_L_AANVRG.PATIENTNR,
+LAB_L_AANVRG.AFDATUM,
+LAB_L_AANVRG.AFTIJD,
+
+LAB_HUIDIGE_UITSLAG.TIJD AS UITTIJD,
+LAB_HUIDIGE_UITSLAG.BEPCODE,
+LAB_HUIDIGE_UITSLAG.UITSLAG,
+LAB_HUIDIGE_UITSLAG.AANVRAAGNR,
+
+LAB_L_B_OMS.[DESC], 
+LAB_L_B_OMS.EENHEID,
+LAB_HUIDIGE_UITSLAG.DATUM AS UITDATUM,
+CONVERT(VARCHAR(10), LAB_HUIDIGE_UITSLAG.DATUM, 120) + ' ' + LAB_HUIDIGE_UITSLAG.TIJD AS WATERMARK
+
+FROM LAB_HUIDIGE_UITSLAG 
+
+INNER JOIN  LAB_L_AANVRG ON LAB_HUIDIGE_UITSLAG.AANVRAAGNR	= LAB_L_AANVRG.AANVRAAGNR  
+INNER JOIN  LAB_L_B_OMS  ON LAB_HUIDIGE_UITSLAG.BEPCODE		= LAB_L_B_OMS.BEP
+
+WHERE
+    DATEDIFF(DAY, GETDATE(), AFDATUM) >= -1  -- Alles van een dag geleden tot nu
+AND UITSLAG <> '<memo>' 
+AND UITSLAG <> '==='
+AND CONVERT(VARCHAR(10), LAB_HUIDIGE_UITSLAG.DATUM, 120) + ' ' + LAB_HUIDIGE_UITSLAG.TIJD >= ?
+AND PATIENTNR IN ({patients})
+AND [BEPCODE] IN ('CS000184', 'ZGT01761', 'ZGT01766', 'CS000187', 'ZGT01318', 'ZGT01321', 'CS000165', 'ZGT01448', 'ZGT01452', 'CS000168', 'ZGT01265', 'ZGT01264', 'CS000208', 'CS000211',
+                  'CS000211', 'CS000203', 'CS000205', 'CS000214', '@0002464', 'CS000251', 'CS000267', 'CS002485', 'CS003765', 'CS000009', 'CS000013', 'CS003762', 'CS000002', 'CS000001',
+                  'CS000277', 'CS000197', 'CS001401', '@0002710', 'ZGT01324', 'ZGT00324', 'ZGT00473') 
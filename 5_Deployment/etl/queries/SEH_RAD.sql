@@ -0,0 +1,22 @@
+-- New or changed radiology reports since the watermark (? = watermark) for the given patients ({patients} = ?, ?, ...)
+-- WATERMARK is the accord moment of the report, it is not written to SEH_RAD
+SELECT 
+
+RONTGEN_RONTGEN.PATIENTNR,
+RONTGEN_RONTVRVR.VERSLAGNR,
+RONTGEN_RONTVRSL.ACCDATUM,
+RONTGEN_RONTVRSL.ACCTIJD,
+WI_DOCUMENT.TRANSTEXT,
+CONVERT(VARCHAR(10), RONTGEN_RONTVRSL.ACCDATUM, 120) + ' ' + RONTGEN_RONTVRSL.ACCTIJD AS WATERMARK
+
+FROM RONTGEN_RONTVRVR
+
+INNER JOIN RONTGEN_RONTVRSL ON RONTGEN_RONTVRVR.VERSLAGNR = RONTGEN_RONTVRSL.RONTVSLID
+INNER JOIN WI_DOCUMENT      ON RONTGEN_RONTVRSL.DOCID    = WI_DOCUMENT.ID
+INNER JOIN RONTGEN_RONTGEN  ON RONTGEN_RONTVRSL.ONDERZNR = RONTGEN_RONTGEN.ONDERZNR
+
+WHERE
+    DATEDIFF(DAY, GETDATE(), RONTGEN_RONTVRSL.ACCDATUM) >= -1  -- Alles van een dag geleden tot nu
+AND RONTGEN_RONTGEN.FUNCTIEAFD = 'FUNC000001'
+AND CONVERT(VARCHAR(10), RONTGEN_RONTVRSL.ACCDATUM, 120) + ' ' + RONTGEN_RONTVRSL.ACCTIJD >= ?
+AND RONTGEN_RONTGEN.PATIENTNR IN ({patients})
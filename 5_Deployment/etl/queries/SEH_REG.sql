@@ -0,0 +1,63 @@
+-- New or changed ED visits since the watermark (? = watermark)
+-- WATERMARK is the last mutation moment of the registration or of its medication verification (VERIFIED),
+-- so a verification after the last change of the registration is fetched again; it is not written to SEH_REG
+WITH MED_VER_ALL AS (
+SELECT
+    PATCODE,
+    MUTDAT,
+    MUTTIJD,
+    VERIFIED,
+    ROW_NUMBER() OVER (PARTITION BY PATCODE ORDER BY MUTDAT DESC, MUTTIJD DESC, DATUM DESC) AS RowRank
+FROM
+    MEDICAT_RECEPT
+WHERE 
+    DATEDIFF(DAY, MUTDAT, GETDATE()) <= 1
+    AND VerificationTypeCode IN ('E', 'S')
+) 
+
+, MED_VER AS (
+    SELECT * FROM MED_VER_ALL WHERE RowRank = 1
+)
+
+
+SELECT
+
+SEHID, 
+SEH.PATIENTNR,
+KLACHT,
+VVCODE,
+SPECIALISM,
+TRIADATUM,
+TRIAGETIJD,
+AANKSDATUM,
+AANKSTIJD,
+TRIANIVCOD,
+VOORNAAM, 
+ACHTERNAAM,
+GESLACHT,
+DATEDIFF(YEAR, GEBDAT, AANKSDATUM) AS LEEFTIJD,
+
+-- PreviousVisits and PrevAdmissionPercentage are added by the ETL from the patient history store
+GEBDAT,
+VERIFIED,
+MUT.WATERMARK
+
+
+FROM SEH_SEHREG SEH
+
+
+INNER JOIN PATIENT_PATIENT PAT ON PAT.PATIENTNR = SEH.PATIENTNR
+LEFT JOIN MED_VER MED ON MED.PATCODE = SEH.PATIENTNR
+CROSS APPLY (
+    -- without a verification the comparison is NULL and the mutation moment of the registration is used
+    SELECT CASE
+        WHEN CONVERT(VARCHAR(10), MED.MUTDAT, 120) + ' ' + MED.MUTTIJD > CONVERT(VARCHAR(10), SEH.MUTDAT, 120) + ' ' + SEH.MUTTIJD
+        THEN CONVERT(VARCHAR(10), MED.MUTDAT, 120) + ' ' + MED.MUTTIJD
+        ELSE CONVERT(VARCHAR(10), SEH.MUTDAT, 120) + ' ' + SEH.MUTTIJD
+    END AS WATERMARK
+) MUT
+
+WHERE DATEDIFF(DAY, AANKSDATUM, GETDATE()) <= 1
+AND VERVALL = 0
+AND EINDTIJD IS NULL
+AND MUT.WATERMARK >= ?
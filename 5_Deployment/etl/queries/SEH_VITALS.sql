@@ -0,0 +1,21 @@
+-- New vital measurements since the watermark (? = watermark) for the given patients ({patients} = ?, ?, ...)
+-- WATERMARK is the measurement moment, it is not written to SEH_VITALS
+SELECT 
+
+ PatientId AS PATIENTNR
+,[DateTime]
+,[LABEL]
+,[Value1]
+,[Value2]
+,CONVERT(VARCHAR(19), [DateTime], 120) AS WATERMARK
+
+FROM METINGEN_PPDVALUE M
+
+INNER JOIN METINGEN_PPDVC P   ON M.[PatientParameterDataValueContextId] = P.[AutoID]
+INNER JOIN METINGEN_PARAMS PA ON PA.[PARAMID]                           = P.[ParameterCode]
+
+WHERE 
+     DATEDIFF(DAY, GETDATE() ,[DateTime]) >= -1
+AND [ParameterCode] IN ('CS00000001', 'CS00000286', 'CS00000005', 'CS00000002', 'CS00000003', 'CS00000857')
+AND CONVERT(VARCHAR(19), [DateTime], 120) >= ?
+AND PatientId IN ({patients})
@@ -0,0 +1,138 @@
+"""
+    The incremental ETL between two SQLite databases. The queries in ../queries are T-SQL for
+    HiX, so the source here is a small stand-in with queries of the same shape: a WATERMARK
+    column, the watermark as the first parameter and {patients} for the patient filter.
+"""
+import sqlite3
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('yaml')
+
+ETL_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ETL_DIR))
+
+import incremental_etl  # noqa: E402
+
+
+TODAY = date.today().isoformat()
+LAST_MONTH = (date.today() - timedelta(days=30)).isoformat()
+
+QUERIES = {
+    'active_visits_query': 'SELECT SEHID, PATIENTNR FROM SEHREG WHERE EINDTIJD IS NULL',
+    'closed_visits_query': 'SELECT SEHID, PATIENTNR, AANKSDATUM, BESTEMMING, MUTMOMENT AS WATERMARK FROM SEHREG '
+                           'WHERE MUTMOMENT >= ?',
+    'SEH_REG': 'SELECT SEHID, PATIENTNR, AANKSDATUM, KLACHT, MUTMOMENT AS WATERMARK FROM SEHREG '
+               'WHERE EINDTIJD IS NULL AND MUTMOMENT >= ?',
+    'SEH_LAB': 'SELECT PATIENTNR, AANVRAAGNR, BEPCODE, UITSLAG, MOMENT AS WATERMARK FROM LAB '
+               'WHERE MOMENT >= ? AND PATIENTNR IN ({patients})',
+}
+
+
+@pytest.fixture
+def source():
+    """ Stand-in of HiX: two visits on the ED, one earlier admitted visit of patient 100 and a lab result each """
+
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE SEHREG (SEHID INTEGER, PATIENTNR INTEGER, AANKSDATUM TEXT, KLACHT TEXT, BESTEMMING TEXT, '
+                'EINDTIJD TEXT, MUTMOMENT TEXT)')
+    con.executemany('INSERT INTO SEHREG VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(1, 100, TODAY, 'pijn', None, None, f'{TODAY} 10:00:00'),
+                     (2, 101, TODAY, 'val', None, None, f'{TODAY} 10:05:00'),
+                     (3, 100, LAST_MONTH, 'koorts', 'OPN', '12:00', f'{LAST_MONTH} 12:00:00')])
+    con.execute('CREATE TABLE LAB (PATIENTNR INTEGER, AANVRAAGNR INTEGER, BEPCODE TEXT, UITSLAG TEXT, MOMENT TEXT)')
+    con.executemany('INSERT INTO LAB VALUES (?, ?, ?, ?, ?)',
+                    [(100, 1, 'CRP', '10', f'{TODAY} 10:30:00'), (101, 2, 'CRP', '20', f'{TODAY} 10:35:00')])
+    con.commit()
+    return con
+
+
+@pytest.fixture
+def destination():
+    return sqlite3.connect(':memory:')
+
+
+@pytest.fixture
+def config(tmp_path):
+    """ ETL config with the stand-in queries written to files """
+
+    paths = {}
+    for name, query in QUERIES.items():
+        paths[name] = tmp_path / f'{name}.sql'
+        paths[name].write_text(query)
+
+    return {'initial_watermark': '1900-01-01 00:00:00', 'max_delete_rows': 1,
+            'patient_history_store': str(tmp_path / 'history.db'),
+            'active_visits_query': str(paths['active_visits_query']),
+            'closed_visits_query': str(paths['closed_visits_query']),
+            'tables': {'SEH_REG': {'query': str(paths['SEH_REG']), 'key': ['SEHID']},
+                       'SEH_LAB': {'query': str(paths['SEH_LAB']), 'key': ['AANVRAAGNR', 'BEPCODE']}}}
+
+
+def get_rows(con, query):
+    return con.execute(query).fetchall()
+
+
+def get_last_run(con, table):
+    """ (ROWS_UPSERTED, ROWS_DELETED) of the last run of the table in ETL_RUNS """
+    return get_rows(con, f"SELECT ROWS_UPSERTED, ROWS_DELETED FROM ETL_RUNS WHERE TABLE_NAME = '{table}' "
+                         'ORDER BY ROWID DESC LIMIT 1')[0]
+
+
+def test_first_run_loads_the_visits_with_their_history(source, destination, config):
+    incremental_etl.run_etl(source, destination, config)
+
+    assert get_rows(destination, 'SELECT SEHID, KLACHT, PreviousVisits, PrevAdmissionPercentage FROM SEH_REG '
+                                 'ORDER BY SEHID') == [(1, 'pijn', 1, 100.0), (2, 'val', 0, 0.0)]
+    assert get_rows(destination, 'SELECT PATIENTNR, UITSLAG FROM SEH_LAB ORDER BY PATIENTNR') == [(100, '10'), (101, '20')]
+    assert incremental_etl.get_watermarks(destination) == {'PATIENT_HISTORY': f'{TODAY} 10:05:00',
+                                                          'SEH_REG': f'{TODAY} 10:05:00',
+                                                          'SEH_LAB': f'{TODAY} 10:35:00'}
+    assert get_last_run(destination, 'SEH_REG') == (2, 0)
+    assert get_last_run(destination, 'SEH_LAB') == (2, 0)
+
+
+def test_next_runs_only_upsert_the_changed_rows(source, destination, config):
+    incremental_etl.run_etl(source, destination, config)
+
+    # the watermark is inclusive, so the rows at the watermark are fetched again but not duplicated
+    source.execute(f"UPDATE SEHREG SET KLACHT = 'hoofdpijn', MUTMOMENT = '{TODAY} 11:00:00' WHERE SEHID = 1")
+    source.execute(f"INSERT INTO LAB VALUES (100, 1, 'CRP', '15', '{TODAY} 11:30:00')")
+    source.commit()
+    incremental_etl.run_etl(source, destination, config)
+
+    assert get_rows(destination, 'SELECT SEHID, KLACHT FROM SEH_REG ORDER BY SEHID') == [(1, 'hoofdpijn'), (2, 'val')]
+    assert get_rows(destination, 'SELECT PATIENTNR, UITSLAG FROM SEH_LAB ORDER BY PATIENTNR') == [(100, '15'), (101, '20')]
+    # the changed row and the row at the old watermark (visit 2, lab result of patient 101)
+    assert get_last_run(destination, 'SEH_REG') == (2, 0)
+    assert get_last_run(destination, 'SEH_LAB') == (2, 0)
+    assert incremental_etl.get_watermarks(destination)['SEH_REG'] == f'{TODAY} 11:00:00'
+
+
+def test_departed_visits_are_deleted_in_bounded_runs(source, destination, config):
+    incremental_etl.run_etl(source, destination, config)
+
+    source.execute(f"UPDATE SEHREG SET EINDTIJD = '12:00', MUTMOMENT = '{TODAY} 12:00:00' WHERE SEHID IN (1, 2)")
+    source.commit()
+
+    # max_delete_rows is 1: one visit (and the lab rows of its patient) per run
+    incremental_etl.run_etl(source, destination, config)
+    assert get_rows(destination, 'SELECT SEHID FROM SEH_REG') == [(2,)]
+    assert get_rows(destination, 'SELECT PATIENTNR FROM SEH_LAB') == [(101,)]
+    assert get_last_run(destination, 'SEH_REG') == (0, 1)
+
+    incremental_etl.run_etl(source, destination, config)
+    assert get_rows(destination, 'SELECT SEHID FROM SEH_REG') == []
+    assert get_rows(destination, 'SELECT PATIENTNR FROM SEH_LAB') == []
+    assert len(get_rows(destination, "SELECT * FROM ETL_RUNS WHERE TABLE_NAME = 'SEH_REG'")) == 3
+
+
+def test_upsert_keeps_the_last_row_of_a_key(destination):
+    incremental_etl.ensure_table(destination, 'T', ['A INTEGER', 'B TEXT'])
+    assert incremental_etl.upsert_rows(destination, 'T', ['A'], ['A', 'B'], [(1, 'x'), (2, 'y'), (1, 'z')]) == 2
+    assert incremental_etl.upsert_rows(destination, 'T', ['A'], ['A', 'B'], [(2, 'w')]) == 1
+    assert get_rows(destination, 'SELECT A, B FROM T ORDER BY A') == [(1, 'z'), (2, 'w')]
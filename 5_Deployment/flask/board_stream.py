@@ -0,0 +1,301 @@
+"""
+    Push channel of the ED board predictions.
+
+    The board (the same payload as /get_predictions) is posted to the service by one writer,
+    the incremental ETL after every run, instead of every dashboard polling with it. The
+    service keeps a fingerprint of the rows of every visit (its SEH row and the lab, vital
+    and report rows of the patient) and only scores the visits that are new, whose rows
+    changed (a new lab result or vital) or that crossed a 10 minute model time boundary
+    since they were scored; a ticker thread scores the crossings between two posts. A visit
+    that could not be scored is scored again with the next board. Only predictions that
+    changed are sent, as server-sent events with a sequence number, to the subscribed clients.
+
+    Every client has a bounded queue: a client that falls that many events behind is not
+    waited for, its queue is dropped and it gets a new snapshot of the board instead. The
+    last events are kept, so a client that reconnects with the id of its last event
+    (Last-Event-ID) gets the events it missed, or a snapshot if they are no longer kept.
+
+    The Shiny dashboards subscribe to the stream from the browser (EventSource) and do not
+    post the board, so every board comes from the same source and the visits are not scored
+    again for boards that differ per dashboard.
+"""
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from single_flight import payload_key
+from bulk_jobs import STREAMS
+
+
+MODEL_TIME_STEP = 10  # minutes between the model times
+LAST_MODEL_TIME = 180
+RECONNECT_MS = 5000  # wait of the browser (EventSource) before it reconnects
+
+
+def get_arrivals(df_seh):
+    """ Arrival moment of every visit (AANKSDATUM and AANKSTIJD), NaT if missing """
+
+    dates = pd.to_datetime(df_seh['AANKSDATUM'], errors='coerce').dt.strftime('%Y-%m-%d')
+    return pd.to_datetime(dates + ' ' + df_seh['AANKSTIJD'].astype(str), errors='coerce')
+
+
+def get_fingerprints(df_seh, streams):
+    """ Hash of the SEH row of every visit and the stream rows of its patient, {SEHID: hash} """
+
+    patient_rows = {}
+    for stream, df in streams.items():
+        for patientnr, rows in df.groupby('PATIENTNR', sort=False):
+            patient_rows.setdefault(patientnr, {})[stream] = rows.to_dict('list')
+
+    return {row['SEHID']: payload_key({'seh': row, **patient_rows.get(row['PATIENTNR'], {})})
+            for row in df_seh.to_dict('records')}
+
+
+def get_payload(df_seh, streams, sehids):
+    """ Payload with the given visits and the stream rows of their patients """
+
+    visits = df_seh[df_seh['SEHID'].isin(sehids)]
+    payload = {'seh_data': visits.to_dict('list')}
+    for stream, df in streams.items():
+        payload[stream] = df[df['PATIENTNR'].isin(visits['PATIENTNR'])].to_dict('list')
+
+    return payload
+
+
+def get_next_model_time(arrival, model_time):
+    """ Moment the visit moves to the next model time, None after the last model time or without arrival """
+
+    if pd.isna(arrival) or model_time == '' or model_time >= LAST_MODEL_TIME:
+        return None
+    return arrival.to_pydatetime() + timedelta(minutes=model_time + MODEL_TIME_STEP)
+
+
+def format_event(event):
+    """ Server-sent event text of an event ({'id', 'event', 'data'}) """
+    return f'id: {event["id"]}\nevent: {event["event"]}\ndata: {json.dumps(event["data"])}\n\n'
+
+
+class BoardStream:
+    """ Scores the changed visits of the posted boards and pushes the changed predictions to the subscribed clients """
+
+    def __init__(self, score, queue_size=1000, log_size=10000, tick=30, max_clients=50, clock=datetime.now):
+        self.score = score  # score(payload, current_datetime) -> [{'SEHID', 'PREDICTION', 'TIMEDELTA'}]
+        self.queue_size = queue_size
+        self.tick = tick
+        self.max_clients = max_clients
+        self.clock = clock
+        self.epoch = uuid.uuid4().hex[:8]  # event ids of an earlier process are not resumed
+        self.lock = threading.Lock()  # state of the board, the log and the clients
+        self.update_lock = threading.Lock()  # one update of the board at a time
+        self.seq = 0
+        self.log = deque(maxlen=log_size)
+        self.clients = []
+        self.board = None  # (df_seh, streams) of the last posted board
+        self.visits = {}  # SEHID -> {'fingerprint', 'prediction', 'next_model_time'}
+        self.ticker = None  # started on the first board
+        self.counters = {'boards': 0, 'ticks': 0, 'scored': 0, 'unchanged': 0, 'events': 0, 'snapshots': 0,
+                         'resumed': 0, 'lagging_clients': 0, 'errors': 0, 'failed': 0}
+
+    ######################
+    # board updates      #
+    ######################
+
+    def update(self, data):
+        """ Replaces the board, scores its new, changed and due visits, returns the numbers of scored visits and events """
+
+        df_seh = pd.DataFrame(data['seh_data'])
+        streams = {stream: pd.DataFrame(data[stream]) for stream in STREAMS if data.get(stream)}
+        fingerprints = get_fingerprints(df_seh, streams)
+
+        with self.update_lock:
+            now = self.clock()
+            changed = [sehid for sehid, fingerprint in fingerprints.items()
+                       if sehid not in self.visits or self.visits[sehid]['fingerprint'] != fingerprint]
+            due = [sehid for sehid in fingerprints if sehid not in changed and self.is_due(sehid, now)]
+            removed = [sehid for sehid in self.visits if sehid not in fingerprints]
+
+            with self.lock:
+                self.board = (df_seh, streams)
+                self.counters['boards'] += 1
+                self.counters['unchanged'] += len(fingerprints) - len(changed) - len(due)
+                for sehid in removed:
+                    del self.visits[sehid]
+                    self.publish('removed', {'SEHID': sehid})
+
+            n_events = self.refresh(df_seh, streams, changed, due, fingerprints, now) + len(removed)
+
+        self.start_ticker()
+        return {'visits': len(fingerprints), 'scored': len(changed) + len(due), 'events': n_events}
+
+    def is_due(self, sehid, now):
+        next_model_time = self.visits[sehid]['next_model_time']
+        return next_model_time is not None and next_model_time <= now
+
+    def refresh(self, df_seh, streams, changed, due, fingerprints, now):
+        """ Scores the changed and due visits and publishes the changed predictions, returns the number of events """
+
+        sehids = changed + due
+        if not sehids:
+            return 0
+
+        try:
+            results = self.score(get_payload(df_seh, streams, sehids), now)
+        except Exception as e:
+            print(f'Failed to score the board for {sehids}: {e}')
+            with self.lock:
+                self.counters['errors'] += 1
+            return 0  # the fingerprints are not updated, the next board or tick scores these visits again
+
+        arrivals = dict(zip(df_seh['SEHID'], get_arrivals(df_seh)))
+        reasons = {**{sehid: 'data' for sehid in changed}, **{sehid: 'model_time' for sehid in due}}
+        n_events = 0
+        with self.lock:
+            self.counters['scored'] += len(sehids)
+            for result in results:
+                sehid = result['SEHID']
+                previous = self.visits.get(sehid, {}).get('prediction')
+                failed = result['TIMEDELTA'] == ''
+                self.counters['failed'] += failed
+                # a failed visit keeps no fingerprint, so the next board scores it again
+                self.visits[sehid] = {'fingerprint': None if failed else fingerprints[sehid], 'prediction': result,
+                                      'next_model_time': get_next_model_time(arrivals.get(sehid), result['TIMEDELTA'])}
+                if previous is None or (previous['PREDICTION'], previous['TIMEDELTA']) != (result['PREDICTION'], result['TIMEDELTA']):
+                    self.publish('prediction', {**result, 'REASON': reasons[sehid] if previous is not None else 'new'})
+                    n_events += 1
+
+        return n_events
+
+    def run_tick(self):
+        """ Scores the visits of the last board that crossed a model time boundary """
+
+        with self.update_lock:
+            now = self.clock()
+            with self.lock:
+                df_seh, streams = self.board
+                due = [sehid for sehid in self.visits if self.is_due(sehid, now)]
+                fingerprints = {sehid: self.visits[sehid]['fingerprint'] for sehid in due}
+                self.counters['ticks'] += 1
+            self.refresh(df_seh, streams, [], due, fingerprints, now)
+
+    def start_ticker(self):
+        with self.lock:
+            if self.ticker is not None or not self.tick:
+                return
+            self.ticker = threading.Thread(target=self.tick_loop, name='board-ticker', daemon=True)
+        self.ticker.start()
+
+    def tick_loop(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.run_tick()
+            except Exception as e:
+                print(f'Failed to check the model times of the board: {e}')
+
+    ######################
+    # events and clients #
+    ######################
+
+    def publish(self, event, data):
+        """ Adds an event to the log and the client queues, a client whose queue is full gets a snapshot instead (call with the lock held) """
+
+        self.seq += 1
+        entry = {'seq': self.seq, 'id': f'{self.epoch}:{self.seq}', 'event': event, 'data': data}
+        self.log.append(entry)
+        self.counters['events'] += 1
+
+        for client in self.clients:
+            if client['lagging']:
+                continue
+            try:
+                client['queue'].put_nowait(entry)
+            except queue.Full:
+                client['lagging'] = True  # the client is not waited for, it gets a new snapshot when it catches up
+                self.counters['lagging_clients'] += 1
+                self.drain(client)
+                client['queue'].put_nowait(None)  # wakes the client
+
+    def drain(self, client):
+        while True:
+            try:
+                client['queue'].get_nowait()
+            except queue.Empty:
+                return
+
+    def get_snapshot(self):
+        """ Snapshot event of all predictions of the board (call with the lock held) """
+
+        return {'id': f'{self.epoch}:{self.seq}', 'event': 'snapshot',
+                'data': {'result': [visit['prediction'] for visit in self.visits.values()]}}
+
+    def current(self):
+        """ Id of the last event and the predictions of all visits on the board """
+
+        with self.lock:
+            snapshot = self.get_snapshot()
+        return snapshot['id'], snapshot['data']['result']
+
+    def get_missed(self, last_event_id):
+        """ Events after last_event_id, None if the id is of another process or no longer kept (call with the lock held) """
+
+        epoch, _, seq = str(last_event_id or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit() or not self.seq - len(self.log) <= int(seq) <= self.seq:
+            return None
+        return [entry for entry in self.log if entry['seq'] > int(seq)]
+
+    def subscribe(self, last_event_id=None):
+        """ New client with its first events (the missed events or a snapshot), None if there are too many clients """
+
+        with self.lock:
+            if len(self.clients) >= self.max_clients:
+                return None
+            client = {'queue': queue.Queue(self.queue_size), 'lagging': False}
+            missed = self.get_missed(last_event_id) if last_event_id else None
+            self.counters['resumed' if missed is not None else 'snapshots'] += 1
+            self.clients.append(client)
+            return client, missed if missed is not None else [self.get_snapshot()]
+
+    def unsubscribe(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def iter_events(self, client, first_events, heartbeat=15):
+        """ Server-sent event texts of a client until it disconnects, a comment line every heartbeat seconds without events """
+
+        try:
+            yield f'retry: {RECONNECT_MS}\n\n'
+            for entry in first_events:
+                yield format_event(entry)
+
+            while True:
+                if client['lagging']:
+                    with self.lock:
+                        self.drain(client)
+                        client['lagging'] = False
+                        self.counters['snapshots'] += 1
+                        entry = self.get_snapshot()
+                    yield format_event(entry)
+                try:
+                    entry = client['queue'].get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'  # a closed connection is noticed on the next write
+                    continue
+                if entry is not None:
+                    yield format_event(entry)
+        finally:
+            self.unsubscribe(client)
+
+    def stats(self):
+        """ Counters, the visits on the board, the connected clients and the last sequence number """
+
+        with self.lock:
+            return {**self.counters, 'visits': len(self.visits), 'clients': len(self.clients),
+                    'lagging': sum(client['lagging'] for client in self.clients), 'seq': self.seq,
+                    'kept_events': len(self.log), 'epoch': self.epoch}
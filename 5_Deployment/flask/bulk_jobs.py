@@ -0,0 +1,198 @@
+"""
+    Asynchronous bulk scoring jobs.
+
+    A bulk payload (thousands of visits, for example for a what-if analysis of bed
+    management) is split into shards of visits with their own lab, vital and report rows.
+    The shards are scored by a process pool, so bulk work never runs on the threads that
+    serve the dashboards. The results of a job are kept per shard as they finish and can
+    be streamed as NDJSON while the job runs. The number of shards waiting in the pool is
+    bounded, a job that does not fit is refused instead of queued.
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+
+STREAMS = ['lab_data', 'vital_data', 'rad_data']  # streams with rows per patient, split along with the SEH rows
+
+
+def split_payload(data, shard_size):
+    """ Splits a payload into payloads of shard_size visits with the lab, vital and report rows of their patients """
+
+    df_seh = pd.DataFrame(data['seh_data'])
+    streams = {stream: pd.DataFrame(data[stream]) for stream in STREAMS if data.get(stream)}
+
+    shards = []
+    for start in range(0, len(df_seh), shard_size):
+        shard_seh = df_seh.iloc[start:start + shard_size]
+        shard = {'seh_data': shard_seh.to_dict('list')}
+        for stream, df in streams.items():
+            shard[stream] = df[df['PATIENTNR'].isin(shard_seh['PATIENTNR'])].to_dict('list')
+        shards.append(shard)
+
+    return shards
+
+
+class BulkJobs:
+    """ Bulk jobs scored in shards by a process pool, with progress, cancellation and a bound on the queued shards """
+
+    def __init__(self, score_shard, shard_args=(), workers=2, max_queued_shards=200, job_ttl=3600):
+        self.score_shard = score_shard
+        self.shard_args = shard_args  # passed before every shard, for example the config the workers load the models with
+        self.workers = workers
+        self.max_queued_shards = max_queued_shards
+        self.job_ttl = job_ttl
+        self.executor = None  # started on the first job, so processes that never run a job have no pool
+        self.changed = threading.Condition()
+        self.jobs = {}
+
+    def get_executor(self):
+        if self.executor is None:
+            # spawn: a forked worker would inherit the locks of the API threads (and the loaded models) mid use
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def discard_executor(self, executor):
+        """ Drops a broken pool (a worker died, for example out of memory), the next job starts a new one (call with the lock held) """
+
+        if self.executor is executor:
+            self.executor = None
+            executor.shutdown(wait=False)
+
+    def get_queued_shards(self):
+        """ Shards submitted to the pool that have not finished, also the running shards of a cancelled or failed job (call with the lock held) """
+        return sum(not future.done() for job in self.jobs.values() for future in job['futures'])
+
+    def purge(self, now):
+        """ Removes the jobs that finished more than job_ttl seconds ago (call with the lock held) """
+
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job['finished'] is not None and job['finished'] + self.job_ttl <= now
+                   and all(future.done() for future in job['futures'])]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def submit(self, shards, *args):
+        """ Submits the shards as one job, returns the job id, None if the queue has no room for the shards """
+
+        with self.changed:
+            self.purge(time.time())
+            if self.get_queued_shards() + len(shards) > self.max_queued_shards:
+                return None
+
+            job_id = uuid.uuid4().hex
+            job = {'status': 'running', 'n_shards': len(shards), 'shards_done': 0, 'n_rows': 0, 'results': [],
+                   'error': None, 'created': time.time(), 'finished': None, 'futures': []}
+            self.jobs[job_id] = job
+            if not shards:
+                job['status'], job['finished'] = 'done', time.time()
+                return job_id
+
+            executor = self.get_executor()
+            try:
+                for shard in shards:
+                    future = executor.submit(self.score_shard, *self.shard_args, shard, *args)
+                    job['futures'].append(future)
+                    future.add_done_callback(lambda future, job=job: self.shard_done(job, future, executor))
+            except BrokenProcessPool as e:
+                self.discard_executor(executor)
+                self.fail(job, f'bulk worker pool broken: {e}')
+
+        return job_id
+
+    def fail(self, job, error):
+        """ Fails a running job and cancels its shards that have not started (call with the lock held) """
+
+        if job['status'] == 'running':
+            job['status'], job['error'], job['finished'] = 'failed', error, time.time()
+            for other in job['futures']:
+                other.cancel()
+        self.changed.notify_all()
+
+    def shard_done(self, job, future, executor):
+        """ Keeps the results of a finished shard, the first failed shard fails the job """
+
+        try:
+            rows = future.result()
+        except CancelledError:
+            return
+        except Exception as e:
+            with self.changed:
+                if isinstance(e, BrokenProcessPool):
+                    self.discard_executor(executor)
+                self.fail(job, str(e))
+            return
+
+        with self.changed:
+            if job['status'] == 'running':  # results of shards that finish after a cancel are dropped
+                job['results'].append(rows)
+                job['shards_done'] += 1
+                job['n_rows'] += len(rows)
+                if job['shards_done'] == job['n_shards']:
+                    job['status'], job['finished'] = 'done', time.time()
+            self.changed.notify_all()
+
+    def cancel(self, job_id):
+        """ Cancels the shards of a job that have not started, False if the job does not exist """
+
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job['status'] == 'running':
+                job['status'], job['finished'] = 'cancelled', time.time()
+                for future in job['futures']:
+                    future.cancel()
+            self.changed.notify_all()
+
+        return True
+
+    def progress(self, job_id):
+        """ Status and progress of a job, None if the job does not exist """
+
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {'job_id': job_id, 'status': job['status'], 'shards_done': job['shards_done'],
+                    'n_shards': job['n_shards'], 'n_rows': job['n_rows'], 'error': job['error'],
+                    'seconds': round((job['finished'] or time.time()) - job['created'], 1)}
+
+    def iter_results(self, job_id, timeout=30):
+        """ Yields the result rows of a job as the shards finish, then the final progress (None while waiting) """
+
+        n_sent = 0
+        while True:
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                if n_sent == len(job['results']) and job['status'] == 'running':
+                    self.changed.wait(timeout)
+                new_results = job['results'][n_sent:]
+                finished = job['status'] != 'running'
+
+            if not new_results and not finished:
+                yield None  # keeps the connection alive while no shard finishes
+            for rows in new_results:
+                yield from rows
+            n_sent += len(new_results)
+
+            if finished and n_sent == len(job['results']):
+                yield self.progress(job_id)
+                return
+
+    def stats(self):
+        """ Number of jobs per status and the shards waiting in the pool """
+
+        with self.changed:
+            statuses = {}
+            for job in self.jobs.values():
+                statuses[job['status']] = statuses.get(job['status'], 0) + 1
+            return {'jobs': statuses, 'queued_shards': self.get_queued_shards(),
+                    'max_queued_shards': self.max_queued_shards, 'workers': self.workers}
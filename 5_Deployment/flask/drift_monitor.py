@@ -0,0 +1,204 @@
+"""
+    Input drift monitor of the deployed models.
+
+    Every feature gets fixed bins (the quantiles of the reference data), and the monitor keeps
+    a (model times x features x bins) count array plus the missing counts. A scored batch adds
+    its rows to the counts of its model time, after the old counts are decayed with a half-life
+    in rows, so the update is one pass over the batch and the memory never grows. The counts
+    are compared to the reference counts written at training time with the population
+    stability index (PSI) and the missing rate; a changed bepcode for example shows up as a
+    lab feature that is suddenly always missing.
+
+    The reference is built by replaying the training exports with the deployed preprocessing.
+
+    usage (from the flask directory):
+    python3 drift_monitor.py SEH.csv LAB.csv VITALS.csv models/drift_reference.npz [--rad-file RAD.csv] [--config config.yaml]
+"""
+import argparse
+import threading
+
+import numpy as np
+
+
+MODEL_TIMES = list(range(0, 190, 10))
+N_BINS = 10
+EPSILON = 1e-4
+
+
+####################
+# helper functions #
+####################
+
+def get_bin_edges(X, n_bins=N_BINS):
+    """ Quantile bin edges per feature (padded with inf, so every feature has n_bins - 1 edges) """
+
+    edges = np.full((X.shape[1], n_bins - 1), np.inf)
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    for feature in range(X.shape[1]):
+        values = X[:, feature][~np.isnan(X[:, feature])]
+        if len(values):
+            feature_edges = np.unique(np.quantile(values, quantiles))
+            edges[feature, :len(feature_edges)] = feature_edges
+
+    return edges
+
+
+def count_bins(X, edges):
+    """ Counts per (feature, bin) and missing counts per feature of the rows of X """
+
+    n_features, n_bins = edges.shape[0], edges.shape[1] + 1
+    missing = np.isnan(X)
+    bins = (X[:, :, None] >= edges[None]).sum(axis=2) + np.arange(n_features) * n_bins
+
+    counts = np.bincount(bins[~missing], minlength=n_features * n_bins).reshape(n_features, n_bins)
+    return counts, missing.sum(axis=0)
+
+
+def get_psi(counts, reference_counts):
+    """ Population stability index per feature of two (features x bins) count arrays """
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        actual = counts / counts.sum(axis=1, keepdims=True)
+        expected = reference_counts / reference_counts.sum(axis=1, keepdims=True)
+        return ((actual - expected) * np.log((actual + EPSILON) / (expected + EPSILON))).sum(axis=1)
+
+
+#####################
+# reference         #
+#####################
+
+def create_reference(matrices, feature_names, n_bins=N_BINS):
+    """ Creates the reference from the feature matrices per model time ({time: [X, ...]}) """
+
+    X_all = np.concatenate([X for time_matrices in matrices.values() for X in time_matrices])
+    edges = get_bin_edges(X_all, n_bins)
+
+    reference = {'feature_names': np.array(feature_names, dtype=str), 'edges': edges,
+                 'counts': np.zeros((len(MODEL_TIMES), len(feature_names), n_bins)),
+                 'missing': np.zeros((len(MODEL_TIMES), len(feature_names))), 'rows': np.zeros(len(MODEL_TIMES))}
+    for time, time_matrices in matrices.items():
+        for X in time_matrices:
+            counts, missing = count_bins(X, edges)
+            reference['counts'][MODEL_TIMES.index(time)] += counts
+            reference['missing'][MODEL_TIMES.index(time)] += missing
+            reference['rows'][MODEL_TIMES.index(time)] += len(X)
+
+    return reference
+
+
+def save_reference(reference, path):
+    """ Saves the reference as a .npz file """
+    np.savez(path, **reference)
+
+
+def load_reference(path, columns):
+    """ Loads the reference and the slot of every reference feature in the feature layout (-1 if not in the layout) """
+
+    with np.load(path) as data:
+        reference = {name: data[name] for name in data.files}
+    reference['slots'] = columns.get_indexer(reference['feature_names'].tolist())
+
+    return reference
+
+
+#####################
+# monitor           #
+#####################
+
+class DriftMonitor:
+    """ Decayed bin counts per model time and feature of the scored rows, compared to the reference """
+
+    def __init__(self, reference, halflife=5000):
+        self.reference = reference
+        self.halflife = halflife
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clears the counts """
+
+        shape = self.reference['counts'].shape
+        with self.lock:
+            self.counts = np.zeros(shape)
+            self.missing = np.zeros(shape[:2])
+            self.rows = np.zeros(shape[0])
+
+    def update(self, time, X):
+        """ Adds the scored rows (of the feature layout) of one model time """
+
+        slots = self.reference['slots']
+        X_ref = np.where(slots >= 0, X[:, np.maximum(slots, 0)], np.nan)
+        counts, missing = count_bins(X_ref, self.reference['edges'])
+
+        t = MODEL_TIMES.index(time)
+        decay = 0.5 ** (len(X) / self.halflife)
+        with self.lock:
+            self.counts[t] = self.counts[t] * decay + counts
+            self.missing[t] = self.missing[t] * decay + missing
+            self.rows[t] = self.rows[t] * decay + len(X)
+
+    def report(self, min_rows=200, psi_alert=0.25, missing_alert=0.2):
+        """ PSI and missing rate per model time and feature, with the alerts of the model times with min_rows rows """
+
+        with self.lock:
+            counts, missing, rows = self.counts.copy(), self.missing.copy(), self.rows.copy()
+
+        names = self.reference['feature_names'].tolist()
+        # a feature that is always missing in the reference (no export for it) is reported but never alerted on
+        covered = self.reference['missing'].sum(axis=0) < self.reference['rows'].sum()
+        features, alerts = [], []
+        for t, time in enumerate(MODEL_TIMES):
+            if rows[t] < min_rows or self.reference['rows'][t] == 0:
+                continue
+
+            psi = get_psi(counts[t], self.reference['counts'][t])
+            missing_rate = missing[t] / rows[t]
+            reference_missing_rate = self.reference['missing'][t] / self.reference['rows'][t]
+
+            for f, name in enumerate(names):
+                entry = {'TIMEDELTA': time, 'FEATURE': name, 'PSI': None if np.isnan(psi[f]) else round(float(psi[f]), 4),
+                         'MISSING_RATE': round(float(missing_rate[f]), 4),
+                         'REFERENCE_MISSING_RATE': round(float(reference_missing_rate[f]), 4)}
+                features.append(entry)
+                if not covered[f]:
+                    continue
+
+                if entry['PSI'] is not None and entry['PSI'] > psi_alert:
+                    alerts.append({**entry, 'ALERT': 'psi'})
+                if abs(missing_rate[f] - reference_missing_rate[f]) > missing_alert:
+                    alerts.append({**entry, 'ALERT': 'missing_rate'})
+
+        return {'rows': {time: round(float(n), 1) for time, n in zip(MODEL_TIMES, rows)}, 'alerts': alerts,
+                'features': features}
+
+
+if __name__ == '__main__':
+    # builds the reference by replaying the training exports (a sample of the visits) with the deployed preprocessing
+    import flask_API
+    import replay
+
+    parser = argparse.ArgumentParser(description='Builds the drift reference from the training exports')
+    parser.add_argument('seh_file')
+    parser.add_argument('lab_file')
+    parser.add_argument('vital_file')
+    parser.add_argument('out_file', help='npz file to write the reference to')
+    parser.add_argument('--rad-file', default=None, help='RAD export (needed for a reference of RAD_PRED)')
+    parser.add_argument('--config', default='./config.yaml')
+    parser.add_argument('--max-visits', type=int, default=20000, help='number of visits sampled from the exports')
+    args = parser.parse_args()
+
+    flask_API.load_models(args.config)
+    df_seh = replay.prepare_seh_export(replay.load_data(args.seh_file))
+    if len(df_seh) > args.max_visits:
+        df_seh = df_seh.sample(args.max_visits, random_state=0)
+    df_lab = replay.prepare_lab_export(replay.load_data(args.lab_file), df_seh)
+    df_vitals = replay.prepare_vital_export(replay.load_data(args.vital_file), df_seh)
+    df_rad = replay.prepare_rad_export(replay.load_data(args.rad_file), df_seh) if args.rad_file else None
+
+    matrices = {time: [] for time in MODEL_TIMES}
+    for shard in replay.iter_shards(df_seh, df_lab, df_vitals, 500, df_rad):
+        for offset, _, X in replay.iter_feature_matrices(*shard, MODEL_TIMES):
+            matrices[flask_API.get_model_time(offset)].append(X)
+
+    save_reference(create_reference(matrices, flask_API.layout['columns'].tolist()), args.out_file)
+    print(f'{args.out_file} written ({sum(len(X) for Xs in matrices.values() for X in Xs)} rows)')
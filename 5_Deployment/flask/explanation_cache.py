@@ -0,0 +1,29 @@
+"""
+    Cache of the feature contributions (explanations) per visit.
+
+    A visit is explained again only when its feature row or its model time changes: the
+    key is the SEHID, the model time, top_k and a fingerprint of the feature row, so the
+    refreshes of an unchanged visit look the explanation up instead of running TreeSHAP.
+    Like the report cache it keeps the most recently used entries up to max_size.
+"""
+import hashlib
+
+from report_cache import ReportCache
+
+
+def get_row_key(sehid, time, top_k, row):
+    """ Cache key of the explanation of one feature row """
+    return sehid, int(time), int(top_k), hashlib.blake2b(row.tobytes(), digest_size=16).digest()
+
+
+class ExplanationCache(ReportCache):
+    """ Least recently used cache of row key -> top contributions """
+
+    def __init__(self, max_size=20000):
+        super().__init__(max_size)
+
+    def stats(self):
+        """ Counters and the number of cached explanations """
+
+        with self.lock:
+            return {**self.counters, 'cached_explanations': len(self.entries), 'max_size': self.max_size}
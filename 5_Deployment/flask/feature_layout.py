@@ -0,0 +1,178 @@
+"""
+    Feature layout of the deployed models.
+
+    The layout is compiled once from the feature names the models were trained with:
+    every feature gets a fixed column slot, the label and one-hot encoders become lookup
+    tables from category position to slot, and the lab and vital names map straight to
+    their slots. The data streams of a request are written into one preallocated
+    (visits x features) float32 matrix, so no pivot, merge, drop or sort is needed and
+    the column order is always the order the models expect. Features of other models (the
+    fusion modalities) can be added after the model features, the time models only see
+    their own first slots.
+"""
+import joblib
+import numpy as np
+import pandas as pd
+
+
+# feature order of the models, used when a model has no feature names stored
+FEATURE_COLUMNS = [
+    'AANKSTIJD', 'GESLACHT', 'AGE', 'PreviousVisits', 'PrevAdmissionPercentage', 'WEEKEND', 'VVCODE_AMB', 'VVCODE_EV',
+    'VVCODE_nan', 'SPECIALISM_CAR', 'SPECIALISM_CHI', 'SPECIALISM_GER', 'SPECIALISM_GYN', 'SPECIALISM_INT',
+    'SPECIALISM_KIN', 'SPECIALISM_KNO', 'SPECIALISM_LON', 'SPECIALISM_MDL', 'SPECIALISM_NEU', 'SPECIALISM_ORT',
+    'SPECIALISM_PLA', 'SPECIALISM_URO', 'TRIANIVCOD', 'Glucose', 'Trombocyten', 'Hematocriet', 'Kalium', 'CRP',
+    'Leucocyten', 'Kreatinine', 'Hemoglobine', 'Natrium', 'Bilirubine Totaal', 'Alkalische Fosfatase (AF)', 'ASAT',
+    'ALAT', 'LD', 'GGT', 'Ureum', 'Glucose (POC)', 'Leukocyten', 'Lactaat', 'NT-proBNP', 'hsTroponine T',
+    'kalium (POC)', 'Natrium (POC)', 'Lactaat (POC)', 'Ureum (POC)', 'Kreat (POC)', 'Temp', 'Resp', 'NIBP',
+    'MEWS score', 'HR', 'KLACHT_PRED']
+LABEL_ENCODED = ['GESLACHT']
+ONE_HOT_ENCODED = ['VVCODE', 'SPECIALISM']
+
+# readable names of the SEH features for the explanations (lab and vital names are already readable)
+FEATURE_LABELS = {
+    'AANKSTIJD': 'Aankomsttijd', 'GESLACHT': 'Geslacht', 'AGE': 'Leeftijd', 'PreviousVisits': 'SEH bezoeken afgelopen jaar',
+    'PrevAdmissionPercentage': 'Opnamepercentage afgelopen jaar', 'WEEKEND': 'Weekend', 'TRIANIVCOD': 'Triage niveau',
+    'KLACHT_PRED': 'Klacht (tekstmodel)', 'RAD_PRED': 'Radiologieverslag (tekstmodel)', 'VVCODE': 'Vervoer', 'SPECIALISM': 'Specialisme',
+    'HOLIDAY': 'Feestdag', 'BRIDGE_DAY': 'Brugdag', 'SCHOOL_HOLIDAY': 'Schoolvakantie'}
+
+
+#####################
+# layout compiling  #
+#####################
+
+def get_feature_names(models):
+    """ Gets the feature names of the models (xgboost or compiled trees), they must be the same for all models """
+
+    names = {time: model['feature_names'] if isinstance(model, dict) else model.get_booster().feature_names
+             for time, model in models.items()}
+    if all(feature_names is None for feature_names in names.values()):
+        return FEATURE_COLUMNS
+
+    feature_names = next(iter(names.values()))
+    for time, model_names in names.items():
+        if model_names != feature_names:
+            raise ValueError(f'The features of the {time} min model differ from the other models')
+
+    return feature_names
+
+
+def load_encoders(encoder_dir):
+    """ Loads the categories of the label and one-hot encoders """
+
+    encoders = {'labels': {}, 'one_hot': {}}
+    for column in LABEL_ENCODED:
+        encoder = joblib.load(f'{encoder_dir}/{column}_label_encoder.pk1')
+        encoders['labels'][column] = encoder.classes_.tolist()
+    for column in ONE_HOT_ENCODED:
+        encoder = joblib.load(f'{encoder_dir}/{column}_one_hot_encoder.pk1')
+        encoders['one_hot'][column] = encoder.categories_[0].tolist()
+
+    return encoders
+
+
+def compile_layout(models, encoders, extra_columns=()):
+    """
+        Compiles the feature layout from the models and the encoder categories (see load_encoders).
+        The extra columns (features of other models, like the fusion modalities) get the slots after the model features
+    """
+
+    model_columns = pd.Index(get_feature_names(models))
+    columns = model_columns.append(pd.Index(extra_columns).difference(model_columns, sort=False))
+    label_tables = {column: pd.Index(classes) for column, classes in encoders['labels'].items()}
+
+    # category position -> column slot (-1 if the model does not use that category)
+    one_hot_tables = {}
+    for column, categories in encoders['one_hot'].items():
+        slots = columns.get_indexer([f'{column}_{category}' for category in categories])
+        one_hot_tables[column] = (pd.Index(categories), slots)
+
+    # the remaining features come as they are from the SEH stream
+    encoded = {column for _, slots in one_hot_tables.values() for column in columns[slots[slots >= 0]]}
+    direct = [column for column in columns if column not in encoded and column not in label_tables]
+
+    return {'columns': columns, 'model_columns': model_columns, 'labels': label_tables, 'one_hot': one_hot_tables, 'direct': direct,
+            'readable': get_readable_names(columns, one_hot_tables)}
+
+
+def get_readable_names(columns, one_hot_tables):
+    """ Readable name per column, one-hot slots become 'Specialisme: CAR' """
+
+    readable = [FEATURE_LABELS.get(column, column) for column in columns]
+    for column, (categories, slots) in one_hot_tables.items():
+        for category, slot in zip(categories, slots):
+            if slot >= 0:
+                readable[slot] = f'{FEATURE_LABELS.get(column, column)}: {category}'
+
+    return readable
+
+
+#####################
+# matrix functions  #
+#####################
+
+def create_matrix(layout, n_rows):
+    """ Creates an empty (all missing) feature matrix """
+    return np.full((n_rows, len(layout['columns'])), np.nan, dtype=np.float32)
+
+
+def write_column(X, layout, column, values):
+    """ Writes the values to the slot of the column """
+    X[:, layout['columns'].get_loc(column)] = values
+
+
+def write_seh_data(X, layout, df_seh):
+    """ Writes the SEH stream: direct columns, label codes and one-hot slots """
+
+    for column in layout['direct']:
+        if column in df_seh.columns:
+            write_column(X, layout, column, np.asarray(df_seh[column], dtype=np.float32))
+
+    for column, classes in layout['labels'].items():
+        codes = classes.get_indexer(df_seh[column]).astype(np.float32)
+        codes[codes < 0] = np.nan
+        write_column(X, layout, column, codes)
+
+    rows = np.arange(len(X))
+    for column, (categories, slots) in layout['one_hot'].items():
+        X[:, slots[slots >= 0]] = 0
+        # missing is the 'nan' category, as the encoders were fitted on astype(str) (which keeps NaN in pandas 3)
+        values = df_seh[column].astype(object).fillna('nan').astype(str)
+        slot = np.r_[slots, -1][categories.get_indexer(values)]  # unknown categories are all zero
+        X[rows[slot >= 0], slot[slot >= 0]] = 1
+
+
+def match_rows(keys, targets):
+    """ Matches every target to all rows with the same key, returns the target and row positions """
+
+    codes = pd.factorize(pd.Series([*keys, *targets], dtype=object).astype(str))[0]
+    key_codes, target_codes = codes[:len(keys)], codes[len(keys):]
+
+    order = np.argsort(key_codes, kind='mergesort')
+    lower = np.searchsorted(key_codes[order], target_codes, side='left')
+    counts = np.searchsorted(key_codes[order], target_codes, side='right') - lower
+
+    target_pos = np.repeat(np.arange(len(target_codes)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return target_pos, order[np.repeat(lower, counts) + within]
+
+
+def write_long_data(X, layout, patients, df_long, name_col, value_col):
+    """ Writes long format data (one row per patient and name) to the rows of the patient """
+
+    slots = layout['columns'].get_indexer(df_long[name_col])
+    values = pd.to_numeric(df_long[value_col], errors='coerce').to_numpy(dtype=np.float32)
+
+    long_pos, rows = match_rows(patients, df_long['PATIENTNR'])
+    keep = slots[long_pos] >= 0
+    X[rows[keep], slots[long_pos][keep]] = values[long_pos][keep]
+
+
+def get_model_matrix(layout, X):
+    """ Columns of the time models (the first slots of the layout, no copy) """
+    return X[:, :len(layout['model_columns'])]
+
+
+def to_frame(layout, X):
+    """ DataFrame on the model columns of the matrix with the feature names (no copy) """
+    return pd.DataFrame(get_model_matrix(layout, X), columns=layout['model_columns'], copy=False)
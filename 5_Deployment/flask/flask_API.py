@@ -1,9 +1,167 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import hmac
+import json
+import os
+import threading
 import yaml
+import numpy as np
 import pandas as pd
 import joblib
 from datetime import datetime
-from preprocessing.scripts import SEH_preprocessing, LAB_preprocessing, VITALS_preprocessing
+from preprocessing.scripts import SEH_preprocessing, LAB_preprocessing, VITALS_preprocessing, RAD_preprocessing, patient_history, text_resources
+import feature_layout
+import model_bundle
+import tree_engine
+import drift_monitor
+import fusion
+import hashed_text
+from single_flight import SingleFlight, payload_key
+from report_cache import ReportCache
+from explanation_cache import ExplanationCache, get_row_key
+from bulk_jobs import BulkJobs, split_payload
+from request_profiler import SamplingProfiler
+from board_stream import BoardStream
+
+
+MODEL_TIMES = range(0, 190, 10)
+bundle = None
+history_store = None
+history_lock = threading.Lock()  # swaps the reloaded history store in
+drift = None
+fusion_model = None
+rad_vec, rad_model = None, None
+hashed_model = None
+bulk = None
+board_stream = None
+bulk_worker_config = None  # config the models of a bulk worker process were loaded with
+coalescer = SingleFlight()
+report_cache = ReportCache()
+explanation_cache = ExplanationCache()
+profiler = SamplingProfiler()
+
+# functions of the pipeline stages in the profile report (a stage counts the samples with one of them on the stack)
+PROFILE_STAGES = {'preprocessing': ['flask_API.py:create_feature_matrix', 'flask_API.py:create_trajectory_matrix'],
+                  'text': ['flask_API.py:get_text_preds', 'flask_API.py:get_rad_preds'],
+                  'scoring': ['flask_API.py:predict_admissions', 'flask_API.py:predict_trajectories']}
+
+
+def load_models(config_path):
+    """ Loads the config and all models in memory (sets the module globals used by the endpoints) """
+    global config, vec, nlp_model, models, layout, bundle, history_store, drift, fusion_model, rad_vec, rad_model, hashed_model, bulk, board_stream
+
+    with open(config_path) as stream:
+        config = yaml.safe_load(stream)
+
+    # nltk is only imported when the text is first preprocessed, load it with the models instead of on the first request
+    text_resources.warm_up()
+
+    # the hashed complaint text model (fixed size, written by 4_MachineLearning/hashed_text_training.py) replaces the tfidf one
+    hashed_model = joblib.load(config['nlp_hashed_model']) if config.get('nlp_hashed_model') else None
+
+    # one memory-mapped file with all models, scalers and encoders (built with model_bundle.py)
+    if config.get('model_bundle'):
+        bundle = model_bundle.load_bundle(config['model_bundle'])
+        vec, nlp_model = None, None
+        models = bundle['models']
+        encoders = bundle['encoders']
+    else:
+        bundle = None
+        vec, nlp_model = None, None
+        if hashed_model is None:
+            vec = joblib.load(config['nlp_vec'])
+            nlp_model = joblib.load(config['nlp_pred_model'])
+        if config.get('tree_models'):  # compiled with tree_engine.py, scored with NumPy only
+            models = {time: tree_engine.load_engine(f'{config["model_dir"]}/{time}_min_trees.npz') for time in MODEL_TIMES}
+        else:
+            models = {time: joblib.load(f'{config["model_dir"]}/{time}_min_xgboost.joblib') for time in MODEL_TIMES}
+        encoders = feature_layout.load_encoders(config['feature_encoders_dir'])
+
+    # radiology report text model (written by 4_MachineLearning/rad_training.py), leave empty to ignore rad_data
+    rad_vec, rad_model = None, None
+    if config.get('rad_pred_model'):
+        rad_vec = joblib.load(config['rad_vec'])
+        rad_model = joblib.load(config['rad_pred_model'])
+        report_cache.max_size = config.get('rad_cache_size', 10000)
+
+    # late fusion of the per-modality models (written by 4_MachineLearning/fusion_training.py) replaces the time models
+    fusion_model = None
+    if config.get('fusion_model'):
+        fusion_model = fusion.load_fusion(config['fusion_model'], config.get('fusion_method'))
+
+    # the layout has the features of the time models and of the fusion modalities (for example RAD_PRED)
+    layout = feature_layout.compile_layout(models, encoders, fusion.get_columns(fusion_model) if fusion_model else ())
+
+    # identical requests within the window share one computation
+    coalescer.window = config.get('coalesce_window', 10)
+
+    # explanations are kept per visit until its feature row or model time changes
+    explanation_cache.max_size = config.get('explain_cache_size', 20000)
+
+    # a profiling session (/debug/profile) never runs longer than this
+    profiler.max_seconds = config.get('profile_max_seconds', 300)
+
+    # the scored rows are compared to the training data if a drift reference is configured
+    drift = None
+    if config.get('drift_reference'):
+        reference = drift_monitor.load_reference(config['drift_reference'], layout['columns'])
+        drift = drift_monitor.DriftMonitor(reference, config.get('drift_halflife', 5000))
+
+    # previous visits are taken from the history store if one is configured, else from the request
+    history_store = None
+    if config.get('patient_history_store'):
+        history_store = load_history_store(config['patient_history_store'])
+
+    # bulk jobs are scored by their own process pool, the workers load the models with the same config
+    bulk = BulkJobs(score_bulk_shard, (config_path,), config.get('bulk_workers', 2),
+                    config.get('bulk_max_queued_shards', 200), config.get('bulk_job_ttl', 3600))
+
+    # posted boards (/board) are scored per changed visit and pushed to the /stream clients
+    board_stream = BoardStream(score_board, config.get('stream_queue_size', 1000), config.get('stream_log_size', 10000),
+                               config.get('stream_tick', 30), config.get('stream_max_clients', 50))
+
+    return config
+
+
+def load_history_store(path):
+    """ Loads the last year of the patient history store in memory """
+
+    mtime = os.path.getmtime(path)  # before loading, a write during the load is loaded the next time
+    store_con = patient_history.connect_store(path)
+    store = patient_history.load_store(store_con, since=patient_history.store_cutoff())
+    store_con.close()
+
+    return {'mtime': mtime, 'visits': store, 'reloading': False}
+
+
+def reload_history_store(path):
+    """ Loads the history store again and swaps it in (runs in a background thread) """
+    global history_store
+
+    try:
+        store = load_history_store(path)
+    except Exception as e:
+        print(f'Failed to reload the patient history store, using the previous one: {e}')
+        with history_lock:
+            history_store['reloading'] = False
+        return
+
+    with history_lock:
+        history_store = store
+
+
+def get_history_store():
+    """
+        Gets the in memory history store. When the ETL has updated the store file it is reloaded in a
+        background thread, the requests use the previous store until the new one is loaded
+    """
+
+    path = config['patient_history_store']
+    mtime = os.path.getmtime(path)
+    with history_lock:
+        if mtime != history_store['mtime'] and not history_store['reloading']:
+            history_store['reloading'] = True
+            threading.Thread(target=reload_history_store, args=(path,), name='history-reload', daemon=True).start()
+        return history_store['visits']
 
 
 def get_arrival_datetimes(data):
@@ -11,75 +169,392 @@ def get_arrival_datetimes(data):
     df = df[['SEHID', 'AANKSDATUM', 'AANKSTIJD']]
 
 
-def preprocess_all_data(data):
+def create_feature_matrix(data):
+    """ Preprocesses the data streams and writes them in the feature matrix, returns the SEH data and the matrix """
 
-    seh_data    = data.get('seh_data')
-    processed_seh = SEH_preprocessing.preprocess_seh_data(seh_data, config)
+    processed_seh = prepare_seh(data)
 
     lab_data    = data.get('lab_data')  
-    processed_lab = LAB_preprocessing.preprocess_lab_data(lab_data, config)
-
+    processed_lab = LAB_preprocessing.get_latest_lab_data(lab_data, config, get_scalers('lab'))
 
     vital_data  = data.get('vital_data') 
-    processed_vitals = VITALS_preprocessing.preprocess_vital_data(vital_data, config)
+    processed_vitals = VITALS_preprocessing.get_latest_vital_data(vital_data, config, get_scalers('vitals'))
+
+    X = create_seh_matrix(processed_seh)
+    feature_layout.write_long_data(X, layout, processed_seh['PATIENTNR'], processed_lab, 'DESC', 'UITSLAG')
+    feature_layout.write_long_data(X, layout, processed_seh['PATIENTNR'], processed_vitals, 'LABEL', 'Value1')
+
+    # the report score is a feature for the models trained with RAD_PRED
+    if rad_model is not None and data.get('rad_data') and 'RAD_PRED' in layout['columns']:
+        rad_preds = get_rad_preds(data['rad_data'])
+        feature_layout.write_column(X, layout, 'RAD_PRED', processed_seh['PATIENTNR'].map(rad_preds).to_numpy(dtype=np.float32))
+
+    return processed_seh, X
+
+
+def prepare_seh(data):
+    """ Preprocesses the SEH stream, the previous visits are taken from the history store if one is configured """
+
+    processed_seh = SEH_preprocessing.prepare_seh_data(data.get('seh_data'))
+    if history_store is not None:
+        processed_seh = patient_history.add_history_features(processed_seh, get_history_store(), 'AANKOMST')
+
+    return processed_seh
+
+
+def create_seh_matrix(processed_seh):
+    """ Creates the feature matrix with the SEH stream and the complaint text predictions written """
+
+    X = feature_layout.create_matrix(layout, len(processed_seh))
+    feature_layout.write_seh_data(X, layout, processed_seh)
+    feature_layout.write_column(X, layout, 'KLACHT_PRED', get_text_preds(processed_seh['KLACHT']))
+
+    return X
+
+
+def get_scalers(stream):
+    """ Gets the (scale, min) tables of the stream from the bundle, None means the scaler files are used """
+    return bundle['scalers'][stream] if bundle is not None else None
 
-    df_all = pd.merge(processed_seh, processed_lab, on='PATIENTNR', how='left')
-    df_all = pd.merge(df_all, processed_vitals, on='PATIENTNR', how='left')
-    df_all['naam'] = ''
-    
-    return df_all
 
+def get_text_preds(text):
 
-def add_text_preds(df):
+    if hashed_model is not None:
+        return hashed_text.predict_proba(hashed_model, list(text))
 
-    text_transformed = vec.transform(df['KLACHT'])
-    df['KLACHT_PRED'] = nlp_model.predict_proba(text_transformed)[:, 1]
+    if bundle is not None:
+        return model_bundle.predict_text(bundle['text'], list(text))
 
-    return df.drop(['KLACHT'], axis=1)
+    text_transformed = vec.transform(text)
+    return nlp_model.predict_proba(text_transformed)[:, 1]
 
 
-def select_model_based_on_time(arrival_datetime, current_datetime):
-    time_diff = current_datetime - arrival_datetime
-    time_diff_min = time_diff.total_seconds() / 60
+def get_rad_preds(rad_data):
+    """ Score of the last accorded report per patient """
+
+    df_rad = RAD_preprocessing.load_data(rad_data)
+    return RAD_preprocessing.get_latest_reports(df_rad, get_report_scores(df_rad))
+
+
+def get_report_scores(df_rad):
+    """ Score of every report, every report is processed and scored once (report cache) """
+
+    keys = RAD_preprocessing.get_report_keys(df_rad)
+    cached = report_cache.get_many(keys)
+
+    new = {key: text for key, text in zip(keys, df_rad['TRANSTEXT']) if key not in cached}
+    if new:
+        processed = [RAD_preprocessing.process_report(text) for text in new.values()]
+        scores = rad_model.predict_proba(rad_vec.transform(processed))[:, 1]
+        new_entries = dict(zip(new, zip(processed, scores.tolist())))
+        report_cache.put_many(new_entries)
+        cached.update(new_entries)
+
+    return [cached[key][1] for key in keys]
+
+
+def get_model_time(time_diff_min):
+    """ Gets the model time (10 minute bucket) for the minutes since arrival """
 
-    # gets the right model time
     # for example: 8 min becomes 0 min, 22 min becomes 20 min, etc...
     time_diff_10min = int(time_diff_min / 10) * 10  
     if time_diff_10min > 180:
         time_diff_10min = 180
-    model = models[time_diff_10min]
-    return model, time_diff_10min
+    return time_diff_10min
 
 
-def predict_admission(seh_entry):
-    sehid = seh_entry['SEHID']
-    try:
-        model, timedelta = select_model_based_on_time(seh_entry['AANKOMST'], datetime.now())
-        seh_entry = seh_entry.drop(['SEHID', 'PATIENTNR', 'VOORNAAM', 'ACHTERNAAM', 'AANKOMST'])
-        seh_entry = seh_entry.to_frame().T
-        seh_entry = seh_entry.apply(pd.to_numeric)
+def predict_proba(model, X):
+    """ Admission probabilities of the feature rows, for a compiled tree model or an xgboost model """
+
+    if isinstance(model, dict):
+        return tree_engine.predict_proba(model, feature_layout.get_model_matrix(layout, X))
+    return model.predict_proba(feature_layout.to_frame(layout, X))[:, 1]
 
-        pred = model.predict_proba(seh_entry)[:,1][0]
-        return [sehid, float(pred), int(timedelta)]
+
+def get_fusion_probas(X, model_times):
+    """ Fusion probabilities of all rows with a model time in one batch, None if the fusion failed """
+
+    valid = np.flatnonzero(model_times >= 0)
+    probas = np.full(len(X), np.nan)
+    try:
+        probas[valid] = fusion.predict_proba(fusion_model, X[valid], layout['columns'])
     except Exception as e:
-        print(f"Failed to obtaine prediction for {sehid}: {e}")
-        return [sehid, '', '']
+        print(f"Failed to obtaine fusion predictions, using the time models: {e}")
+        return None
+
+    return probas
+
+
+def predict_contributions(model, X):
+    """
+        Feature contributions to the raw score (last column is the bias) of the feature rows in one call:
+        TreeSHAP (pred_contribs) for an xgboost model, path contributions for a compiled tree model
+    """
+
+    X = feature_layout.get_model_matrix(layout, X)
+    if isinstance(model, dict):
+        return tree_engine.predict_contributions(model, X)
+
+    import xgboost as xgb
+    booster = model.get_booster()
+    best_iteration = booster.attr('best_iteration')
+    iteration_range = (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+    dmatrix = xgb.DMatrix(X, missing=np.nan, feature_names=list(layout['model_columns']))
+    return booster.predict(dmatrix, pred_contribs=True, iteration_range=iteration_range)
+
+
+def get_top_contributions(contribs, top_k):
+    """ The top_k features with the largest absolute contribution per row, as readable name and contribution """
+
+    contribs = contribs[:, :-1]
+    top_k = min(top_k, contribs.shape[1])
+    top = np.argpartition(-np.abs(contribs), top_k - 1, axis=1)[:, :top_k]
+    top_values = np.take_along_axis(contribs, top, axis=1)
+    order = np.argsort(-np.abs(top_values), axis=1)
+    top, top_values = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_values, order, axis=1)
+
+    return [[{'FEATURE': layout['readable'][slot], 'CONTRIBUTION': float(value)} for slot, value in zip(slots, values)]
+            for slots, values in zip(top, top_values)]
+
+
+def get_explanations(sehids, X, rows, time, top_k):
+    """ Top contributions of the rows of one model time, only the rows that are not cached yet are explained """
+
+    keys = [get_row_key(sehids[row], time, top_k, X[row]) for row in rows]
+    cached = explanation_cache.get_many(keys)
+    new = [i for i, key in enumerate(keys) if key not in cached]
+    if new:
+        top_contribs = get_top_contributions(predict_contributions(models[time], X[rows[new]]), top_k)
+        new_entries = {keys[i]: top for i, top in zip(new, top_contribs)}
+        explanation_cache.put_many(new_entries)
+        cached.update(new_entries)
+
+    return [cached[key] for key in keys]
+
+
+def predict_admissions(processed_seh, X, current_datetime=None, explain_top_k=0):
+    """
+        Predicts all rows of the feature matrix, the rows of one model time are predicted in one batch.
+        With explain_top_k the top feature contributions of every row are added (also one batch per model time).
+        With a fusion model all rows are predicted in one batch by the fusion (no explanations)
+    """
+
+    current_datetime = current_datetime or datetime.now()
+    time_diff_min = ((current_datetime - processed_seh['AANKOMST']).dt.total_seconds() / 60).to_numpy()
+    sehids = processed_seh['SEHID'].tolist()
+
+    preds = [[sehid, '', ''] for sehid in sehids]
+    explanations = [[] for _ in sehids]
+    model_times = np.array([get_model_time(minutes) if pd.notna(minutes) else -1 for minutes in time_diff_min])
+    fused = get_fusion_probas(X, model_times) if fusion_model is not None else None
+
+    for time in np.unique(model_times[model_times >= 0]):
+        rows = np.flatnonzero(model_times == time)
+        try:
+            probas = fused[rows] if fused is not None else predict_proba(models[time], X[rows])
+            for row, pred in zip(rows, probas):
+                preds[row] = [sehids[row], float(pred), int(time)]
+        except Exception as e:
+            print(f"Failed to obtaine predictions for {[sehids[row] for row in rows]}: {e}")
+            continue
+
+        if drift is not None:
+            drift.update(int(time), X[rows])
+
+        if explain_top_k and fused is None:
+            try:
+                for row, top in zip(rows, get_explanations(sehids, X, rows, time, explain_top_k)):
+                    explanations[row] = top
+            except Exception as e:
+                print(f"Failed to obtaine explanations for {[sehids[row] for row in rows]}: {e}")
+
+    for row in np.flatnonzero(model_times < 0):
+        print(f"Failed to obtaine prediction for {sehids[row]}: no arrival time")
+
+    if explain_top_k:
+        return preds, explanations
+    return preds
+
+
+def get_prediction_results(data, explain_top_k=0, current_datetime=None):
+    """ Runs the full pipeline for a request payload, with the top feature contributions if explain_top_k is set """
+
+    processed_seh, X = create_feature_matrix(data)
+    if not explain_top_k:
+        preds = predict_admissions(processed_seh, X, current_datetime)
+        return [{'SEHID': id, 'PREDICTION': pred, 'TIMEDELTA': time}for id, pred, time in preds]
+
+    preds, explanations = predict_admissions(processed_seh, X, current_datetime, explain_top_k=explain_top_k)
+    return [{'SEHID': id, 'PREDICTION': pred, 'TIMEDELTA': time, 'EXPLANATION': explanation}
+            for (id, pred, time), explanation in zip(preds, explanations)]
+
+
+def get_minutes_after(times, arrivals):
+    """ Minutes between arrival and the given moments, NaN if the moment is missing """
+    return ((pd.to_datetime(times).to_numpy() - pd.to_datetime(arrivals).to_numpy()) / np.timedelta64(1, 'm')).astype(np.float64)
+
+
+def get_triage_times(seh_data):
+    """ Triage moment of every visit, NaT if the visit is not triaged yet """
+
+    df = pd.DataFrame(seh_data)
+    dates = pd.to_datetime(df['TRIADATUM'], errors='coerce').dt.strftime('%Y-%m-%d')
+    return pd.to_datetime(dates + ' ' + df['TRIAGETIJD'].astype(str), format='%Y-%m-%d %H:%M:%S', errors='coerce')
+
+
+def get_known_rows(df, known_after, offset, key_cols):
+    """ The last row per key (df is sorted on time) of the rows known `offset` minutes after arrival """
+
+    df = df[known_after < offset]
+    return df.drop_duplicates(key_cols, keep='last')
+
+
+def create_trajectory_matrix(data, current_datetime=None):
+    """
+        Rebuilds the features of every visit at every 10 minute offset after arrival up to the current one, like the
+        replay: triage after the triage moment, lab results once the sample is taken (-1 until the result is back),
+        vitals and reports once measured or accorded. The lab, vital and report rows are preprocessed once, only the
+        selection is repeated per offset. Returns the SEH data, the visit and offset of every row and the matrix
+    """
+
+    current_datetime = current_datetime or datetime.now()
+    processed_seh = prepare_seh(data)
+    X_seh = create_seh_matrix(processed_seh)
+    patients = processed_seh['PATIENTNR']
+    arrivals = pd.Series(processed_seh['AANKOMST'].values, index=patients.values)
+    arrivals = arrivals[~arrivals.index.duplicated()]
 
+    time_diff_min = ((current_datetime - processed_seh['AANKOMST']).dt.total_seconds() / 60).to_numpy()
+    last_offsets = np.array([get_model_time(minutes) if minutes >= 0 else -1 for minutes in time_diff_min])
 
-def drop_feature_columns(df):
-    return df.drop(['VVCODE_AMBG', 'VVCODE_AMBH', 'VVCODE_AND', 'VVCODE_HELI', 'SPECIALISM_ALL', 'SPECIALISM_ANE', 'SPECIALISM_DER', 'SPECIALISM_GGZ', 'SPECIALISM_ICA', 'SPECIALISM_KAA', 'SPECIALISM_ONC', 'SPECIALISM_OOG', 'SPECIALISM_PSY', 'SPECIALISM_PYN', 'SPECIALISM_RAD', 'SPECIALISM_REU', 'SPECIALISM_SEH', 'SPECIALISM_TRAU', 'SPECIALISM_ZA', 'SPECIALISM_nan', 'naam'], axis=1)
+    # triage codes are only known after triage
+    triage_slot = layout['columns'].get_loc('TRIANIVCOD')
+    triage_codes = X_seh[:, triage_slot].copy()
+    triaged_after = get_minutes_after(get_triage_times(data.get('seh_data')), processed_seh['AANKOMST'])
 
+    df_lab = LAB_preprocessing.get_timed_lab_data(data.get('lab_data'), config, get_scalers('lab'))
+    df_lab = df_lab.sort_values('UITSLAG_TIJDSTIP', kind='mergesort')
+    lab_arrivals = df_lab['PATIENTNR'].map(arrivals)
+    taken_after = get_minutes_after(df_lab['AFNAME_TIJDSTIP'], lab_arrivals)
+    returned_after = get_minutes_after(df_lab['UITSLAG_TIJDSTIP'], lab_arrivals)
+
+    df_vitals = VITALS_preprocessing.get_clean_vital_data(data.get('vital_data'), config, get_scalers('vitals'))
+    df_vitals = df_vitals.sort_values('DateTime', kind='mergesort')
+    measured_after = get_minutes_after(df_vitals['DateTime'], df_vitals['PATIENTNR'].map(arrivals))
+
+    df_rad = None
+    if rad_model is not None and data.get('rad_data') and 'RAD_PRED' in layout['columns']:
+        df_rad = RAD_preprocessing.load_data(data['rad_data'])
+        rad_scores = np.asarray(get_report_scores(df_rad))
+        accorded_after = get_minutes_after(RAD_preprocessing.merge_datetime(df_rad['ACCDATUM'], df_rad['ACCTIJD']),
+                                           df_rad['PATIENTNR'].map(arrivals))
+
+    visit_rows, offsets, matrices = [], [], []
+    for offset in MODEL_TIMES:
+        rows = np.flatnonzero(last_offsets >= offset)
+        if not len(rows):
+            break
+
+        X = X_seh[rows]
+        X[:, triage_slot] = np.where(triaged_after[rows] < offset, triage_codes[rows], np.nan)
+
+        df_lab_known = get_known_rows(df_lab.assign(UITSLAG=np.where(returned_after >= offset, -1, df_lab['UITSLAG'])),
+                                      taken_after, offset, ['PATIENTNR', 'DESC'])
+        df_vitals_known = get_known_rows(df_vitals, measured_after, offset, ['PATIENTNR', 'LABEL'])
+        feature_layout.write_long_data(X, layout, patients.iloc[rows], df_lab_known, 'DESC', 'UITSLAG')
+        feature_layout.write_long_data(X, layout, patients.iloc[rows], df_vitals_known, 'LABEL', 'Value1')
+
+        if df_rad is not None:
+            accorded = accorded_after < offset
+            rad_preds = RAD_preprocessing.get_latest_reports(df_rad[accorded], rad_scores[accorded])
+            feature_layout.write_column(X, layout, 'RAD_PRED', patients.iloc[rows].map(rad_preds).to_numpy(dtype=np.float32))
+
+        visit_rows.append(rows)
+        offsets.append(np.full(len(rows), offset))
+        matrices.append(X)
+
+    if not matrices:
+        return processed_seh, np.array([], dtype=int), np.array([], dtype=int), X_seh[:0]
+    return processed_seh, np.concatenate(visit_rows), np.concatenate(offsets), np.vstack(matrices)
+
+
+def predict_trajectories(X, offsets):
+    """ Admission probability of every trajectory row, the rows of one model time are predicted in one batch """
+
+    probas = np.full(len(X), np.nan)
+    fused = get_fusion_probas(X, offsets) if fusion_model is not None else None
+
+    for time in np.unique(offsets):
+        rows = np.flatnonzero(offsets == time)
+        try:
+            probas[rows] = fused[rows] if fused is not None else predict_proba(models[time], X[rows])
+        except Exception as e:
+            print(f"Failed to obtaine trajectory predictions of the {time} min model: {e}")
+
+    return probas
+
+
+def get_trajectory_results(data, current_datetime=None):
+    """ Runs the trajectory pipeline for a request payload: the prediction at every passed 10 minute offset per visit """
+
+    processed_seh, visit_rows, offsets, X = create_trajectory_matrix(data, current_datetime)
+    probas = predict_trajectories(X, offsets)
+
+    trajectories = [[] for _ in range(len(processed_seh))]
+    for row, offset, proba in zip(visit_rows, offsets, probas):
+        trajectories[row].append({'TIMEDELTA': int(offset), 'PREDICTION': float(proba) if not np.isnan(proba) else ''})
+
+    return [{'SEHID': sehid, 'TRAJECTORY': trajectory}
+            for sehid, trajectory in zip(processed_seh['SEHID'].tolist(), trajectories)]
+
+
+def init_bulk_worker(config_path):
+    """ Loads the config and models on the first shard of a bulk worker process (the pool initializer needs python 3.7) """
+    global bulk_worker_config
+
+    if bulk_worker_config != config_path:
+        load_models(config_path)
+        bulk_worker_config = config_path
+
+
+def score_bulk_shard(config_path, data, current_datetime=None):
+    """ Scores one shard of a bulk job (runs in a bulk worker process) """
+
+    init_bulk_worker(config_path)
+    return get_prediction_results(data, current_datetime=current_datetime)
+
+
+def score_board(data, current_datetime):
+    """ Scores the changed visits of a posted board """
+    return get_prediction_results(data, current_datetime=current_datetime)
+
+
+def load_bulk_payload(path):
+    """ Loads a payload file from the bulk data directory, paths outside that directory are refused """
+
+    data_dir = os.path.realpath(config.get('bulk_data_dir', './bulk'))
+    file_path = os.path.realpath(os.path.join(data_dir, path))
+    if os.path.commonpath([data_dir, file_path]) != data_dir:
+        raise ValueError(f'{path} is not in the bulk data directory')
+
+    with open(file_path) as stream:
+        return json.load(stream)
+
+
+def is_admin(headers):
+    """ True if the X-Debug-Token header matches the debug_token of the config (no token configured: never) """
+
+    token = config.get('debug_token')
+    return bool(token) and hmac.compare_digest(str(token).encode(), headers.get('X-Debug-Token', '').encode())
+
+
+def get_explain_top_k(args):
+    """ Number of contributions to explain from the query string (?explain=true&top_k=5), 0 means no explanation (ValueError if top_k is not a number) """
+
+    if args.get('explain', 'false').lower() not in ('true', '1'):
+        return 0
+    return max(int(args.get('top_k', config.get('explain_top_k', 5))), 1)
 
-def sort_columns(df):
-    sorter = [
-        'SEHID', 'PATIENTNR', 'VOORNAAM', 'ACHTERNAAM', 'AANKOMST','AANKSTIJD', 'GESLACHT',
-        'AGE','PreviousVisits','PrevAdmissionPercentage', 'WEEKEND','VVCODE_AMB','VVCODE_EV','VVCODE_nan','SPECIALISM_CAR','SPECIALISM_CHI',
-        'SPECIALISM_GER','SPECIALISM_GYN','SPECIALISM_INT','SPECIALISM_KIN','SPECIALISM_KNO','SPECIALISM_LON','SPECIALISM_MDL',
-        'SPECIALISM_NEU','SPECIALISM_ORT','SPECIALISM_PLA','SPECIALISM_URO','TRIANIVCOD',
-        'Glucose','Trombocyten','Hematocriet','Kalium','CRP','Leucocyten','Kreatinine','Hemoglobine','Natrium','Bilirubine Totaal',
-        'Alkalische Fosfatase (AF)','ASAT','ALAT','LD','GGT','Ureum','Glucose (POC)','Leukocyten','Lactaat','NT-proBNP','hsTroponine T',
-        'kalium (POC)','Natrium (POC)','Lactaat (POC)','Ureum (POC)','Kreat (POC)','Temp','Resp','NIBP','MEWS score','HR','KLACHT_PRED']
-    return df[sorter]
 
 app = Flask(__name__)
 
@@ -87,24 +562,200 @@ app = Flask(__name__)
 def get_predictions():
 
     data = request.json
-    processed_data = preprocess_all_data(data)
-    processed_data = add_text_preds(processed_data)
-    processed_data = drop_feature_columns(processed_data)
-    processed_data = sort_columns(processed_data)
-    preds = processed_data.apply(lambda row: predict_admission(row), axis=1)
-    preds = [{'SEHID': id, 'PREDICTION': pred, 'TIMEDELTA': time}for id, pred, time in preds]
+    try:
+        explain_top_k = get_explain_top_k(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'invalid top_k: {e}'}), 400
+
+    # explanations are cached with their predictions under their own key
+    key = payload_key(data) if not explain_top_k else f'{payload_key(data)}:explain:{explain_top_k}'
+    with profiler.track():
+        preds = coalescer.run(key, lambda: get_prediction_results(data, explain_top_k))
     return jsonify({'result': preds})
 
+
+@app.route('/get_predictions/trajectory', methods=['POST'])
+def get_trajectories():
+
+    data = request.json
+    with profiler.track():
+        trajectories = coalescer.run(f'{payload_key(data)}:trajectory', lambda: get_trajectory_results(data))
+    return jsonify({'result': trajectories})
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """ Starts a bulk job for a payload or a payload file in the bulk data directory ({"payload_path": ...}) """
+
+    body = request.json
+    try:
+        data = load_bulk_payload(body['payload_path']) if 'payload_path' in body else body
+        current_datetime = pd.to_datetime(body['current_datetime']).to_pydatetime() if body.get('current_datetime') else None
+        shards = split_payload(data, config.get('bulk_shard_size', 500))
+    except (KeyError, ValueError, OSError) as e:
+        return jsonify({'error': f'invalid bulk payload: {e}'}), 400
+
+    job_id = bulk.submit(shards, current_datetime)
+    if job_id is None:
+        return jsonify({'error': 'too many bulk shards queued, try again later', **bulk.stats()}), 429
+
+    progress = bulk.progress(job_id)
+    if progress['status'] == 'failed':  # the worker pool was broken, the next job starts a new one
+        return jsonify(progress), 503
+    return jsonify(progress), 202
+
+
+@app.route('/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify(bulk.stats())
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+
+    progress = bulk.progress(job_id)
+    if progress is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(progress)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+
+    if not bulk.cancel(job_id):
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(bulk.progress(job_id))
+
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def stream_job_results(job_id):
+    """ Streams the predictions as NDJSON while the shards finish, the last line is the progress of the job """
+
+    if bulk.progress(job_id) is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    lines = ('\n' if row is None else json.dumps(row) + '\n' for row in bulk.iter_results(job_id))
+    return Response(lines, mimetype='application/x-ndjson')
+
+
+@app.route('/board', methods=['POST'])
+def post_board():
+    """ Replaces the board (the /get_predictions payload, posted by the ETL), returns the predictions of all visits on the board """
+
+    with profiler.track():
+        update = board_stream.update(request.json)
+    last_event_id, predictions = board_stream.current()
+    return jsonify({**update, 'result': predictions, 'last_event_id': last_event_id})
+
+
+@app.route('/stream', methods=['GET'])
+def stream_predictions():
+    """ Server-sent events of the changed predictions, resumes after the Last-Event-ID header (or ?last_event_id=) """
+
+    subscription = board_stream.subscribe(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if subscription is None:
+        return jsonify({'error': 'too many stream clients, try again later'}), 503
+
+    client, first_events = subscription
+    events = board_stream.iter_events(client, first_events, config.get('stream_heartbeat', 15))
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if config.get('stream_allow_origin'):  # the dashboards subscribe from the browser (EventSource) on another origin
+        headers['Access-Control-Allow-Origin'] = config['stream_allow_origin']
+    return Response(events, mimetype='text/event-stream', headers=headers)
+
+
+@app.route('/stream_stats', methods=['GET'])
+def get_stream_stats():
+    return jsonify(board_stream.stats())
+
+
+@app.route('/debug/profile', methods=['POST'])
+def start_profile():
+    """ Profiles the next requests ({"requests": N} and/or {"seconds": S}, optional "interval_ms") """
+
+    if not is_admin(request.headers):
+        return jsonify({'error': 'not found'}), 404
+
+    body = request.get_json(silent=True) or {}
+    try:
+        requests = int(body['requests']) if body.get('requests') else None
+        seconds = float(body['seconds']) if body.get('seconds') else None
+        interval = max(float(body.get('interval_ms', 5)), 1) / 1000
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'invalid profile settings: {e}'}), 400
+
+    if not profiler.start(requests, seconds, interval):
+        return jsonify({'error': 'a profiling session is running', **profiler.status()}), 409
+    return jsonify(profiler.status()), 202
+
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """ Samples per function and per pipeline stage of the last profiling session """
+
+    if not is_admin(request.headers):
+        return jsonify({'error': 'not found'}), 404
+    if profiler.status() is None:
+        return jsonify({'error': 'no profiling session started'}), 404
+
+    try:
+        top = int(request.args.get('top', 30))
+    except ValueError as e:
+        return jsonify({'error': f'invalid top: {e}'}), 400
+    return jsonify(profiler.report(PROFILE_STAGES, top))
+
+
+@app.route('/debug/profile', methods=['DELETE'])
+def stop_profile():
+
+    if not is_admin(request.headers):
+        return jsonify({'error': 'not found'}), 404
+    profiler.stop()
+    return jsonify(profiler.status())
+
+
+@app.route('/debug/profile/collapsed', methods=['GET'])
+def get_profile_stacks():
+    """ Collapsed stacks of the last profiling session, for flame graph tools (flamegraph.pl, speedscope) """
+
+    if not is_admin(request.headers):
+        return jsonify({'error': 'not found'}), 404
+    return Response(profiler.collapsed(), mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=profile.collapsed'})
+
+
+@app.route('/coalescing_stats', methods=['GET'])
+def get_coalescing_stats():
+    return jsonify(coalescer.stats())
+
+
+@app.route('/report_cache_stats', methods=['GET'])
+def get_report_cache_stats():
+    return jsonify(report_cache.stats())
+
+
+@app.route('/explain_cache_stats', methods=['GET'])
+def get_explain_cache_stats():
+    return jsonify(explanation_cache.stats())
+
+
+@app.route('/drift', methods=['GET'])
+def get_drift():
+
+    if drift is None:
+        return jsonify({'error': 'no drift_reference configured'}), 404
+
+    report = drift.report(config.get('drift_min_rows', 200), config.get('drift_psi_alert', 0.25),
+                          config.get('drift_missing_alert', 0.2))
+    if request.args.get('details', 'false').lower() not in ('true', '1'):
+        del report['features']
+    return jsonify(report)
+
+
 if __name__ == '__main__':
-    # load config 
+    # load config and models in memory
     config_path = './config.yaml' 
-    with open(config_path) as stream:
-        config = yaml.safe_load(stream)
-    
-    # load models in memory
-    vec = joblib.load(config['nlp_vec'])
-    nlp_model = joblib.load(config['nlp_pred_model'])
-    models = {time: joblib.load(f'{config["model_dir"]}/{time}_min_xgboost.joblib') for time in range(0, 190, 10)}
+    load_models(config_path)
     
     # start flask app
     app.run(host='0.0.0.0', port=5555)  # Run the Flask application
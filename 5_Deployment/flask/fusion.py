@@ -0,0 +1,121 @@
+"""
+    Late fusion of per-modality models (SEH, TEXT, LAB, VITALS and RAD), as in Fusion_Techniques_ML.ipynb.
+
+    Every modality has its own model on its own columns of the feature layout (the TEXT
+    modality is the KLACHT_PRED column of the complaint text model, the RAD modality the
+    RAD_PRED column of the report text model). A modality is only
+    scored for the visits that have data for it, the modalities are scored in parallel
+    for the whole batch, and the probabilities are combined with the meta-model of the
+    modalities the visit has (stacking on the logits), or with a weighted average over
+    the available modalities.
+
+    The fusion artifact is written by 4_MachineLearning/fusion_training.py, this module is
+    shared by the training script and the API so both combine the modalities the same way.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+MODALITIES = ['SEH', 'TEXT', 'LAB', 'VITALS', 'RAD']
+WEIGHTS = {'SEH': 1.2, 'TEXT': 0.8, 'LAB': 1.5, 'VITALS': 1.0, 'RAD': 0.8}  # get_weighted_average of the notebook, RAD like TEXT
+LOGIT_CLIP = 1e-6
+
+
+####################
+# helper functions #
+####################
+
+def get_logits(probas):
+    """ Logits of the probabilities (clipped, so 0 and 1 stay finite) """
+
+    probas = np.clip(probas, LOGIT_CLIP, 1 - LOGIT_CLIP)
+    return np.log(probas / (1 - probas))
+
+
+def get_pattern_key(names):
+    """ Key of a set of modalities, in the order of MODALITIES """
+    return '+'.join(name for name in MODALITIES if name in names)
+
+
+def get_availability(modalities, X, columns):
+    """ (visits x modalities) mask of the modalities a visit has data for (any of its columns is not missing) """
+
+    return np.column_stack([~np.isnan(X[:, columns.get_indexer(modality['columns'])]).all(axis=1)
+                            for modality in modalities])
+
+
+def score_modality(modality, X, columns, rows):
+    """ Probabilities of one modality for the given rows (NaN for the other rows) """
+
+    probas = np.full(len(X), np.nan)
+    if len(rows) == 0:
+        return probas
+
+    X_modality = X[np.ix_(rows, columns.get_indexer(modality['columns']))]
+    if modality['model'] is None:  # the column already is a probability (KLACHT_PRED, RAD_PRED)
+        probas[rows] = X_modality[:, 0]
+    else:
+        probas[rows] = modality['model'].predict_proba(pd.DataFrame(X_modality, columns=modality['columns']))[:, 1]
+
+    return probas
+
+
+def combine(fusion, probas, available, method=None):
+    """ Combines the (visits x modalities) probabilities of the available modalities per visit """
+
+    names = [modality['name'] for modality in fusion['modalities']]
+    method = method or fusion['method']
+    combined = np.full(len(probas), np.nan)
+
+    # weighted average over the available modalities (also used for a combination without a meta-model)
+    weights = np.array([fusion['weights'][name] for name in names]) * available
+    with np.errstate(invalid='ignore'):
+        average = (np.nan_to_num(probas) * weights).sum(axis=1) / weights.sum(axis=1)
+    if method == 'weighted_average':
+        return average
+
+    patterns = np.array([get_pattern_key([name for name, has in zip(names, row) if has]) for row in available])
+    for pattern in np.unique(patterns):
+        rows = np.flatnonzero(patterns == pattern)
+        meta_model = fusion['meta_models'].get(pattern)
+        if meta_model is None:
+            combined[rows] = average[rows]
+        else:
+            cols = [names.index(name) for name in pattern.split('+')]
+            combined[rows] = meta_model.predict_proba(get_logits(probas[np.ix_(rows, cols)]))[:, 1]
+
+    return combined
+
+
+#####################
+# serving           #
+#####################
+
+def load_fusion(path, method=None):
+    """ Loads the fusion artifact and starts one thread per modality """
+
+    import joblib
+
+    fusion = joblib.load(path)
+    fusion['method'] = method or fusion['method']
+    fusion['executor'] = ThreadPoolExecutor(max_workers=len(fusion['modalities']), thread_name_prefix='fusion')
+
+    return fusion
+
+
+def get_columns(fusion):
+    """ Columns of all modalities (in modality order), the feature layout must have a slot for each of them """
+    return list(dict.fromkeys(column for modality in fusion['modalities'] for column in modality['columns']))
+
+
+def predict_proba(fusion, X, columns):
+    """ Admission probabilities of the feature rows, the modalities are scored in parallel """
+
+    available = get_availability(fusion['modalities'], X, columns)
+    futures = [fusion['executor'].submit(score_modality, modality, X, columns, np.flatnonzero(available[:, m]))
+               for m, modality in enumerate(fusion['modalities'])]
+    probas = np.column_stack([future.result() for future in futures])
+
+    return combine(fusion, probas, available)
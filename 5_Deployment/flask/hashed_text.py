@@ -0,0 +1,103 @@
+"""
+    Hashed complaint text model: a bounded-memory alternative to the tfidf vectorizer.
+
+    The n-grams are hashed into a fixed number of buckets (HashingVectorizer, no vocabulary),
+    the idf weights are learned in one streaming pass that counts the documents per bucket,
+    and the logistic regression is trained with SGD over the same chunks. Training therefore
+    never holds more than one chunk of complaints, and the served model is three fixed-size
+    arrays (idf, weights and intercept) whatever the number of complaints it was trained on.
+
+    The model is trained by 4_MachineLearning/hashed_text_training.py, this module is shared
+    by the training script and the API.
+"""
+import numpy as np
+
+
+N_FEATURES = 2 ** 20
+NGRAM_RANGE = (1, 6)
+
+
+#####################
+# vectorizing       #
+#####################
+
+def create_vectorizer(model):
+    """ Stateless hashing vectorizer with the settings of the model (raw counts, the idf is applied separately) """
+
+    from sklearn.feature_extraction.text import HashingVectorizer  # imported on first use, keeps the API import fast
+    return HashingVectorizer(n_features=model['n_features'], ngram_range=tuple(model['ngram_range']),
+                             stop_words=model['stop_words'] or None, alternate_sign=False, norm=None)
+
+
+def transform(model, texts, vectorizer=None):
+    """ l2 normalized tfidf rows of the texts, like TfidfVectorizer """
+
+    X = (vectorizer or create_vectorizer(model)).transform(texts)
+    X.sum_duplicates()
+    X.data *= model['idf'][X.indices]
+
+    norms = np.sqrt(np.bincount(np.repeat(np.arange(X.shape[0]), np.diff(X.indptr)), weights=X.data ** 2,
+                                minlength=X.shape[0]))
+    norms[norms == 0] = 1
+    X.data /= np.repeat(norms, np.diff(X.indptr))
+
+    return X
+
+
+#####################
+# training          #
+#####################
+
+def create_model(stop_words=None, n_features=N_FEATURES, ngram_range=NGRAM_RANGE):
+    """ Untrained model: the settings and the document counts per bucket """
+
+    return {'n_features': n_features, 'ngram_range': list(ngram_range), 'stop_words': sorted(stop_words or []),
+            'n_docs': 0, 'doc_counts': np.zeros(n_features, dtype=np.int64)}
+
+
+def update_doc_counts(model, texts):
+    """ Adds the documents of a chunk to the document counts per bucket (first streaming pass) """
+
+    X = create_vectorizer(model).transform(texts)
+    X.sum_duplicates()
+    model['doc_counts'] += np.bincount(X.indices, minlength=model['n_features'])
+    model['n_docs'] += X.shape[0]
+
+
+def finish_idf(model):
+    """ Smoothed idf from the document counts (like TfidfVectorizer(smooth_idf=True)) """
+
+    model['idf'] = (np.log((1 + model['n_docs']) / (1 + model.pop('doc_counts'))) + 1).astype(np.float32)
+
+
+def create_classifier(alpha=1e-4, random_state=0):
+    """ Logistic regression trained with SGD, one partial_fit per chunk """
+
+    from sklearn.linear_model import SGDClassifier
+    loss = 'log_loss' if 'log_loss' in SGDClassifier.loss_functions else 'log'  # renamed in scikit-learn 1.1
+    return SGDClassifier(loss=loss, alpha=alpha, random_state=random_state)
+
+
+def partial_fit(model, classifier, texts, y):
+    """ Trains the classifier on one chunk (second streaming pass) """
+    classifier.partial_fit(transform(model, texts), y, classes=[0, 1])
+
+
+def finish_model(model, classifier):
+    """ Keeps the weights of the trained classifier in the model """
+
+    model['weights'] = classifier.coef_[0].astype(np.float32)
+    model['intercept'] = float(classifier.intercept_[0])
+
+    return model
+
+
+#####################
+# serving           #
+#####################
+
+def predict_proba(model, texts):
+    """ Admission probability of the complaint texts """
+
+    scores = transform(model, texts) @ model['weights'] + model['intercept']
+    return 1 / (1 + np.exp(-scores))
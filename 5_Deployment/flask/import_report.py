@@ -0,0 +1,81 @@
+"""
+    Import time report of the API.
+
+    Imports the API in a fresh interpreter with `python -X importtime` and sums the import
+    time per top-level package. The heavy packages (nltk, scikit-learn, xgboost, ...) are
+    imported by the functions that need them or by the model loading, so they must not show
+    up here. With --budget the report fails (exit code 1) when the import takes longer than
+    the budget or imports one of the deferred packages, so a new module level import of a
+    heavy package is caught before a release (tests/test_import_report.py checks the deferred
+    packages, the time depends on the machine).
+    `-X importtime` needs python 3.7 or later, on an older interpreter (the python 3.6
+    image) the report is skipped.
+
+    usage:
+    python3 import_report.py [--module flask_API] [--top 10] [--budget 1.0]
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+
+DEFERRED = ['nltk', 'sklearn', 'scipy', 'xgboost', 'workalendar']  # imported on first use or by load_models
+MIN_VERSION = (3, 7)  # first python with -X importtime, older versions ignore the option
+
+
+def get_import_times(module):
+    """ (package, self seconds, cumulative seconds) of every import of the module, in import order """
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=Path(__file__).resolve().parent, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+
+    return times
+
+
+def summarize(times, module):
+    """ Total import time of the module and the self time per top-level package, slowest first """
+
+    total = next((cumulative for name, _, cumulative in times if name == module), None)
+    if total is None:
+        raise ValueError(f'No import time of {module} reported, is python {".".join(map(str, MIN_VERSION))} or later used?')
+
+    packages = {}
+    for name, self_time, _ in times:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_time
+
+    return total, sorted(packages.items(), key=lambda item: -item[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time report of the API')
+    parser.add_argument('--module', default='flask_API')
+    parser.add_argument('--top', type=int, default=10, help='number of packages to show')
+    parser.add_argument('--budget', type=float, help='maximum import time in seconds')
+    args = parser.parse_args()
+
+    if sys.version_info < MIN_VERSION:
+        print(f'import time report skipped: -X importtime needs python {".".join(map(str, MIN_VERSION))} or later '
+              f'(running {sys.version.split()[0]})')
+        sys.exit(0)
+
+    total, packages = summarize(get_import_times(args.module), args.module)
+    print(f'import {args.module}: {total:.3f} s')
+    for package, seconds in packages[:args.top]:
+        print(f'{package:24} {seconds:8.3f} s {100 * seconds / total:6.1f} %')
+
+    imported = [package for package, _ in packages if package in DEFERRED]
+    if imported:
+        print(f'deferred packages imported at module level: {", ".join(imported)}')
+    if args.budget is not None and (total > args.budget or imported):
+        print(f'import time budget of {args.budget:.3f} s not met')
+        sys.exit(1)
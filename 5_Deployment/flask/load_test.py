@@ -0,0 +1,257 @@
+"""
+    Load test of the API with synthetic ED boards.
+
+    A board is the payload a dashboard sends: the patients on the ED with their arrival
+    spread over the last 0-200 minutes (so every model time is used), a lab panel for most
+    patients with pending and finished results, and a round of vitals about every half
+    hour. The categories are taken from the feature encoders of the config, so the boards
+    use the codes the models know. The API is started locally with the given config (or
+    --url points to a running one) and every concurrency level sends boards from that many
+    threads for --duration seconds. Per level the throughput, the p50/p95/p99 latency and
+    the error rate are printed as a table and written as JSON.
+
+    The boards are sent in turn from a pool of --boards boards. Every send gets its own
+    send number in the payload, so the coalescer of the API never answers it from an
+    earlier send and every request loads the full pipeline. With --coalesce the boards are
+    sent unchanged: a board sent again within the coalesce_window of the config is answered
+    from the coalescer, like the dashboards that poll the same board.
+
+    usage (from the flask directory, so the relative paths in config.yaml resolve):
+    python3 load_test.py [--config ./config.yaml] [--concurrency 1,2,4,8,16] [--duration 20] [--patients 60] [--coalesce] [--out load_test.json]
+"""
+import argparse
+import itertools
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time as timer
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import feature_layout
+from preprocessing.scripts.LAB_preprocessing import bepcodes
+
+
+COMPLAINT_WORDS = ['pijn', 'borst', 'buik', 'dyspnoe', 'val', 'koorts', 'wond', 'hoofd', 'collaps', 'heup', 'fractuur',
+                   'braken', 'duizelig', 'rug', 'been', 'arm', 'benauwd', 'hartkloppingen', 'verward', 'HET']
+TRIAGE_CODES = ['U1', 'U2', 'U3', 'U4', 'U5']
+TRIAGE_WEIGHTS = [0.01, 0.12, 0.45, 0.35, 0.07]
+
+# typical value (mean, standard deviation) of every lab result
+LAB_VALUES = {'Glucose': (6.5, 2), 'Trombocyten': (250, 70), 'Hematocriet': (0.4, 0.05), 'Kalium': (4.2, 0.5),
+              'CRP': (30, 40), 'Leucocyten': (9, 3), 'Kreatinine': (90, 30), 'Hemoglobine': (8.5, 1.2),
+              'Natrium': (139, 4), 'Bilirubine Totaal': (10, 6), 'Alkalische Fosfatase (AF)': (90, 30),
+              'ASAT': (30, 15), 'ALAT': (30, 15), 'LD': (220, 60), 'GGT': (40, 30), 'Ureum': (7, 3),
+              'Glucose (POC)': (6.5, 2), 'Leukocyten': (9, 3), 'Lactaat': (1.6, 0.8), 'NT-proBNP': (600, 800),
+              'hsTroponine T': (15, 20), 'kalium (POC)': (4.2, 0.5), 'Natrium (POC)': (139, 4),
+              'Lactaat (POC)': (1.6, 0.8), 'Ureum (POC)': (7, 3), 'Kreat (POC)': (90, 30)}
+VITAL_VALUES = {'HR': (85, 15), 'Temp': (37, 0.7), 'Resp': (17, 4), 'NIBP': (130, 20), 'MEWS score': (1, 1)}
+
+
+#####################
+# synthetic boards  #
+#####################
+
+def create_board(rng, n_patients, now, encoders, max_minutes=200, lab_share=0.7, panel_size=(6, 16)):
+    """ Payload of an ED board with n_patients patients that arrived in the last max_minutes minutes """
+
+    arrivals = [now - timedelta(minutes=int(minutes)) for minutes in rng.integers(0, max_minutes, n_patients)]
+    patients = rng.choice(10 ** 7, n_patients, replace=False) + 10 ** 7
+    codes = {desc: code if isinstance(code, str) else code[0] for desc, code in bepcodes.items()}
+
+    seh, lab, vitals = [], [], []
+    for patient, arrival in zip(patients.tolist(), arrivals):
+        triage = min(arrival + timedelta(minutes=int(rng.integers(2, 30))), now)
+        seh.append({'SEHID': patient + 10 ** 8, 'PATIENTNR': patient, 'KLACHT': ' '.join(rng.choice(COMPLAINT_WORDS, rng.integers(1, 5))),
+                    'VVCODE': str(rng.choice(encoders['one_hot']['VVCODE'])), 'SPECIALISM': str(rng.choice(encoders['one_hot']['SPECIALISM'])),
+                    'TRIADATUM': f'{triage:%Y-%m-%d}', 'TRIAGETIJD': f'{triage:%H:%M:%S}', 'AANKSDATUM': f'{arrival:%Y-%m-%d}',
+                    'AANKSTIJD': f'{arrival:%H:%M}', 'TRIANIVCOD': str(rng.choice(TRIAGE_CODES, p=TRIAGE_WEIGHTS)),
+                    'VOORNAAM': '', 'ACHTERNAAM': '', 'GESLACHT': str(rng.choice(encoders['labels']['GESLACHT'])),
+                    'LEEFTIJD': int(rng.integers(0, 100)), 'PreviousVisits': int(rng.poisson(0.8)),
+                    'PrevAdmissionPercentage': float(rng.uniform(0, 100))})
+
+        # one lab panel, drawn some time after arrival, the results that are not back yet are pending
+        sampled = arrival + timedelta(minutes=int(rng.integers(5, 45)))
+        if rng.random() < lab_share and sampled < now:
+            for desc in rng.choice(list(LAB_VALUES), rng.integers(*panel_size), replace=False):
+                mean, std = LAB_VALUES[desc]
+                result = sampled + timedelta(minutes=int(rng.integers(20, 90)))
+                value = f'{abs(rng.normal(mean, std)):.1f}' if result <= now else '-volgt-'
+                result = min(result, now)
+                lab.append({'PATIENTNR': patient, 'AFDATUM': f'{sampled:%Y-%m-%d}', 'AFTIJD': f'{sampled:%H:%M:%S}',
+                            'UITTIJD': f'{result:%H:%M:%S}', 'BEPCODE': codes[desc], 'UITSLAG': value, 'DESC': desc,
+                            'UITDATUM': f'{result:%Y-%m-%d}'})
+
+        # a round of vitals at arrival and about every half hour after
+        measured = arrival + timedelta(minutes=int(rng.integers(0, 15)))
+        while measured < now:
+            for label, (mean, std) in VITAL_VALUES.items():
+                value = rng.normal(mean, std) if label != 'MEWS score' else rng.integers(0, 4)
+                vitals.append({'PATIENTNR': patient, 'DateTime': f'{measured:%Y-%m-%d %H:%M:%S}', 'LABEL': label,
+                               'Value1': f'{value:.1f}'.replace('.', ',')})
+            measured += timedelta(minutes=int(rng.integers(20, 45)))
+
+    return {'seh_data': pd.DataFrame(seh).to_dict('list'), 'lab_data': pd.DataFrame(lab).to_dict('list'),
+            'vital_data': pd.DataFrame(vitals).to_dict('list')}
+
+
+#####################
+# service           #
+#####################
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_service(config_path, port, timeout=120):
+    """ Starts the API with the config in a separate process and waits until it answers """
+
+    code = (f'import logging, flask_API; logging.getLogger("werkzeug").setLevel(logging.ERROR); '
+            f'flask_API.load_models({config_path!r}); flask_API.app.run(host="127.0.0.1", port={port}, threaded=True)')
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = timer.monotonic() + timeout
+    while timer.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'the API stopped while starting (exit code {process.returncode})')
+        try:
+            urllib.request.urlopen(f'{url}/coalescing_stats', timeout=1).read()
+            return process, url
+        except OSError:
+            timer.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f'the API did not answer within {timeout} seconds')
+
+
+#####################
+# load test         #
+#####################
+
+def make_unique(body, send):
+    """ Board body with the send number added, so its payload key differs from every other send """
+    return b'{"load_test_send":%d,' % send + body[1:]
+
+
+def post(url, body, timeout):
+    """ Posts a json body, returns the latency in seconds and whether the request succeeded """
+
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = timer.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+
+    return timer.perf_counter() - start, ok
+
+
+def run_level(url, bodies, concurrency, duration, sends, coalesce=False, timeout=60):
+    """
+        Sends the boards from `concurrency` threads for `duration` seconds, returns the latencies and errors.
+        sends gives the send numbers, it is shared by the levels so no send repeats one of an earlier level.
+    """
+
+    results = []
+    lock = threading.Lock()
+    stop_at = timer.perf_counter() + duration
+
+    def worker():
+        while timer.perf_counter() < stop_at:
+            with lock:
+                send = next(sends)
+            body = bodies[send % len(bodies)] if coalesce else make_unique(bodies[send % len(bodies)], send)
+            latency, ok = post(url, body, timeout)
+            with lock:
+                results.append((latency, ok))
+
+    start = timer.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer.perf_counter() - start
+
+    return results, elapsed
+
+
+def summarize_level(concurrency, results, elapsed, n_patients):
+    """ Throughput, latency percentiles and error rate of one concurrency level """
+
+    latencies = np.array([latency for latency, ok in results if ok]) * 1000
+    n_errors = sum(not ok for _, ok in results)
+    percentiles = np.percentile(latencies, [50, 95, 99]) if len(latencies) else [np.nan] * 3
+
+    return {'concurrency': concurrency, 'requests': len(results), 'errors': n_errors,
+            'error_rate': round(n_errors / max(len(results), 1), 4),
+            'requests_per_s': round(len(latencies) / elapsed, 2),
+            'patients_per_s': round(len(latencies) * n_patients / elapsed, 1),
+            'p50_ms': round(float(percentiles[0]), 1), 'p95_ms': round(float(percentiles[1]), 1),
+            'p99_ms': round(float(percentiles[2]), 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the API with synthetic ED boards')
+    parser.add_argument('--config', default='./config.yaml', help='config of the API that is started')
+    parser.add_argument('--url', help='test a running API instead of starting one (http://127.0.0.1:5555)')
+    parser.add_argument('--endpoint', default='/get_predictions')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per level')
+    parser.add_argument('--patients', type=int, default=60, help='patients per board')
+    parser.add_argument('--boards', type=int, default=100, help='number of different boards sent in turn')
+    parser.add_argument('--refresh-interval', type=float, default=30, help='seconds between dashboard refreshes')
+    parser.add_argument('--coalesce', action='store_true', help='send the boards unchanged, so repeated boards can be served by the coalescer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='load_test.json')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+    encoders = feature_layout.load_encoders(config['feature_encoders_dir'])
+
+    rng = np.random.default_rng(args.seed)
+    now = datetime.now()
+    bodies = [json.dumps(create_board(rng, args.patients, now, encoders)).encode()
+              for _ in range(args.boards)]
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_service(args.config, get_free_port())
+
+    levels = []
+    sends = itertools.count()
+    try:
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            results, elapsed = run_level(url.rstrip('/') + args.endpoint, bodies, concurrency, args.duration, sends, args.coalesce)
+            levels.append(summarize_level(concurrency, results, elapsed, args.patients))
+            print(levels[-1])
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    df_levels = pd.DataFrame(levels)
+    within = df_levels[(df_levels['p95_ms'] <= args.refresh_interval * 1000) & (df_levels['error_rate'] == 0)]
+    max_concurrency = int(within['concurrency'].max()) if len(within) else 0
+
+    print(df_levels.to_string(index=False))
+    print(f'highest concurrency with p95 under the refresh interval of {args.refresh_interval:g} s and no errors: {max_concurrency}')
+
+    with open(args.out, 'w') as out_file:
+        json.dump({'endpoint': args.endpoint, 'patients': args.patients, 'boards': args.boards, 'coalesce': args.coalesce,
+                   'duration': args.duration, 'refresh_interval': args.refresh_interval,
+                   'max_concurrency_within_refresh': max_concurrency, 'levels': levels}, out_file, indent=2)
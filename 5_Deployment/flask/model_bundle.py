@@ -0,0 +1,268 @@
+"""
+    Model bundle: all numeric state of the deployed models in one file.
+
+    The bundle holds the compiled trees of every time model, the lab and vital scalers as
+    (scale, min) tables, the complaint text model as a sorted term table with the idf and
+    logistic regression weight per term, and the encoder categories. The file starts with
+    a json manifest (version, checksum, array offsets and the small tables), followed by
+    the arrays, each aligned to 64 bytes. The loader memory-maps the file read-only and
+    the arrays are views on the map, so every worker process shares the same pages.
+
+    The bundle is written to a temporary file and renamed, so a deploy replaces it atomically.
+    The API does not check the checksum (that reads every page of the file), run `verify`
+    when building or deploying a bundle.
+
+    usage (from the flask directory):
+    python3 model_bundle.py build models/model_bundle.bin [--config config.yaml]
+    python3 model_bundle.py verify models/model_bundle.bin
+"""
+import argparse
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from datetime import datetime
+
+import numpy as np
+
+import tree_engine
+
+
+MAGIC = b'EDBUNDLE'
+VERSION = 1
+ALIGN = 64
+
+
+####################
+# helper functions #
+####################
+
+def padding(n_bytes):
+    """ Number of bytes needed to align n_bytes to ALIGN """
+    return -n_bytes % ALIGN
+
+
+def get_checksum(data):
+    """ sha256 of the data section """
+    return hashlib.sha256(data).hexdigest()
+
+
+#####################
+# bundle compiling  #
+#####################
+
+def compile_scalers(scaler_dir):
+    """ Converts the MinMaxScalers of a folder to (scale, min) tables, keyed like the scaler files """
+
+    import joblib
+
+    names, scales, mins = [], [], []
+    for path in sorted(glob.glob(f'{scaler_dir}/*_scaler.pk1')):
+        scaler = joblib.load(path)
+        if type(scaler).__name__ != 'MinMaxScaler' or scaler.clip:
+            raise ValueError(f'{path} is not a MinMaxScaler without clipping')
+        names.append(os.path.basename(path)[:-len('_scaler.pk1')])
+        scales.append(scaler.scale_[0])
+        mins.append(scaler.min_[0])
+
+    return names, np.array(scales, dtype=np.float64), np.array(mins, dtype=np.float64)
+
+
+def compile_text_model(vec, nlp_model):
+    """ Converts the tfidf vectorizer and logistic regression to a sorted term table and the analyzer settings """
+
+    params = vec.get_params()
+    if (params['analyzer'] != 'word' or params['tokenizer'] is not None or params['preprocessor'] is not None
+            or params['strip_accents'] is not None):
+        raise ValueError('Only word analyzers without a custom tokenizer, preprocessor or accent stripping are supported')
+
+    vocabulary = sorted(vec.vocabulary_.items(), key=lambda item: item[0].encode('utf-8'))
+    terms = np.array([term.encode('utf-8') for term, _ in vocabulary])
+    columns = np.array([column for _, column in vocabulary])
+
+    settings = {'lowercase': params['lowercase'], 'token_pattern': params['token_pattern'],
+                'ngram_range': list(params['ngram_range']), 'stop_words': sorted(vec.get_stop_words() or []),
+                'binary': params['binary'], 'sublinear_tf': params['sublinear_tf'], 'norm': params['norm'],
+                'intercept': float(nlp_model.intercept_[0])}
+    idf = vec.idf_[columns] if params['use_idf'] else np.ones(len(columns))
+    arrays = {'text/terms': terms, 'text/idf': idf.astype(np.float64),
+              'text/weights': nlp_model.coef_[0][columns].astype(np.float64)}
+
+    return settings, arrays
+
+
+def compile_bundle(config, model_times):
+    """ Compiles all models, scalers and encoders of the config, returns the manifest and the arrays """
+
+    import joblib
+    import feature_layout
+
+    manifest = {'format': 'ed-model-bundle', 'version': VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+                'model_times': list(model_times), 'feature_names': {}, 'scalers': {}}
+    arrays = {}
+
+    for time in model_times:
+        engine = tree_engine.compile_model(joblib.load(f'{config["model_dir"]}/{time}_min_xgboost.joblib'))
+        manifest['feature_names'][str(time)] = engine.pop('feature_names').tolist()
+        arrays.update({f'trees/{time}/{name}': np.asarray(values) for name, values in engine.items()})
+
+    for stream, scaler_dir in (('lab', config['lab_scalers_dir']), ('vitals', config['vitals_scaler_dir'])):
+        names, scales, mins = compile_scalers(scaler_dir)
+        manifest['scalers'][stream] = names
+        arrays[f'scalers/{stream}/scale'], arrays[f'scalers/{stream}/min'] = scales, mins
+
+    manifest['text'], text_arrays = compile_text_model(joblib.load(config['nlp_vec']),
+                                                       joblib.load(config['nlp_pred_model']))
+    arrays.update(text_arrays)
+    manifest['encoders'] = feature_layout.load_encoders(config['feature_encoders_dir'])
+
+    return manifest, arrays
+
+
+#####################
+# reading / writing #
+#####################
+
+def write_bundle(path, manifest, arrays):
+    """ Writes the manifest and the aligned arrays, the file is replaced atomically """
+
+    data, entries = bytearray(), {}
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        data += b'\0' * padding(len(data))
+        entries[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': len(data)}
+        data += values.tobytes()
+
+    manifest = {**manifest, 'arrays': entries, 'data_size': len(data), 'sha256': get_checksum(data)}
+    header = json.dumps(manifest).encode('utf-8')
+    header += b' ' * padding(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as bundle_file:
+        bundle_file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        bundle_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(buffer):
+    """ Reads the manifest, returns it with the start of the data section """
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a model bundle')
+    header_size, = struct.unpack('<Q', buffer[len(MAGIC):len(MAGIC) + 8])
+    data_start = len(MAGIC) + 8 + header_size
+    manifest = json.loads(bytes(buffer[len(MAGIC) + 8:data_start]).decode('utf-8'))
+
+    if manifest['version'] != VERSION:
+        raise ValueError(f'Bundle version {manifest["version"]} is not supported (expected {VERSION})')
+
+    return manifest, data_start
+
+
+def load_bundle(path, verify=False):
+    """
+        Memory-maps the bundle read-only, returns the manifest, models, scalers, text model and encoders.
+        The pages are only read when used; verify reads them all to check the checksum (done by `verify`, not by the API)
+    """
+
+    with open(path, 'rb') as bundle_file:
+        buffer = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    manifest, data_start = read_manifest(buffer)
+    data = memoryview(buffer)[data_start:data_start + manifest['data_size']]
+    if verify and get_checksum(data) != manifest['sha256']:
+        raise ValueError(f'Checksum of {path} does not match the manifest')
+
+    arrays = {name: np.frombuffer(data, dtype=entry['dtype'], count=int(np.prod(entry['shape'])),
+                                  offset=entry['offset']).reshape(entry['shape'])
+              for name, entry in manifest['arrays'].items()}
+
+    models = {}
+    for time in manifest['model_times']:
+        models[time] = {name: arrays[f'trees/{time}/{name}'] for name in [*tree_engine.ENGINE_ARRAYS, 'base_margin', 'depth']}
+        models[time]['feature_names'] = manifest['feature_names'][str(time)] or None
+
+    scalers = {stream: dict(zip(names, zip(arrays[f'scalers/{stream}/scale'], arrays[f'scalers/{stream}/min'])))
+               for stream, names in manifest['scalers'].items()}
+
+    text = {**manifest['text'], 'terms': arrays['text/terms'], 'idf': arrays['text/idf'],
+            'weights': arrays['text/weights'], 'stop_words': set(manifest['text']['stop_words'])}
+
+    return {'manifest': manifest, 'models': models, 'scalers': scalers, 'text': text,
+            'encoders': manifest['encoders'], 'mmap': buffer}
+
+
+#####################
+# text model        #
+#####################
+
+def analyze(doc, text):
+    """ Word n-grams of a document, like the analyzer of the sklearn vectorizer """
+
+    if text['lowercase']:
+        doc = doc.lower()
+    tokens = [token for token in re.findall(text['token_pattern'], doc) if token not in text['stop_words']]
+
+    min_n, max_n = text['ngram_range']
+    return [' '.join(tokens[i:i + n]) for n in range(min_n, max_n + 1) for i in range(len(tokens) - n + 1)]
+
+
+def predict_text(text, docs):
+    """ Admission probability of the complaint texts (tfidf + logistic regression on the term table) """
+
+    terms = text['terms']
+    doc_ids, keys = [], []
+    for doc_id, doc in enumerate(docs):
+        for term in analyze(str(doc), text):
+            doc_ids.append(doc_id)
+            keys.append(term.encode('utf-8'))
+
+    n_docs = len(docs)
+    doc_ids = np.array(doc_ids, dtype=np.int64)
+    # measured before the conversion, the dtype cuts longer terms to the itemsize (they are not in the table)
+    fits = np.array([len(key) <= terms.dtype.itemsize for key in keys], dtype=bool)
+    keys = np.array(keys, dtype=terms.dtype) if keys else np.array([], dtype=terms.dtype)
+
+    idx = np.minimum(np.searchsorted(terms, keys), len(terms) - 1)
+    found = fits & (terms[idx] == keys)
+    pairs, tf = np.unique(doc_ids[found] * len(terms) + idx[found], return_counts=True)
+    doc_ids, idx = np.divmod(pairs, len(terms))
+
+    tf = tf.astype(np.float64)
+    if text['binary']:
+        tf[:] = 1
+    elif text['sublinear_tf']:
+        tf = 1 + np.log(tf)
+    values = tf * text['idf'][idx]
+
+    norms = np.ones(n_docs)
+    if text['norm'] == 'l2':
+        norms = np.sqrt(np.bincount(doc_ids, weights=values ** 2, minlength=n_docs))
+    elif text['norm'] == 'l1':
+        norms = np.bincount(doc_ids, weights=np.abs(values), minlength=n_docs)
+    norms[norms == 0] = 1
+
+    scores = np.bincount(doc_ids, weights=values * text['weights'][idx], minlength=n_docs) / norms
+    return 1 / (1 + np.exp(-(text['intercept'] + scores)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds or verifies the model bundle')
+    parser.add_argument('action', choices=['build', 'verify'])
+    parser.add_argument('bundle')
+    parser.add_argument('--config', default='./config.yaml')
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        import yaml
+        with open(args.config) as stream:
+            config = yaml.safe_load(stream)
+        manifest, arrays = compile_bundle(config, range(0, 190, 10))
+        write_bundle(args.bundle, manifest, arrays)
+        print(f'{args.bundle} written ({len(arrays)} arrays)')
+    else:
+        manifest = load_bundle(args.bundle, verify=True)['manifest']
+        print(f'{args.bundle} ok: version {manifest["version"]}, created {manifest["created"]}, sha256 {manifest["sha256"]}')
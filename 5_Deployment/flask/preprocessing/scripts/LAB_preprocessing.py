@@ -46,7 +46,7 @@ def merge_datetime(date_col, time_col):
 def get_latest_lab_results(df):
     """ Gets the most recent lab results of a patient """
     # A patient can have multiple of the same lab results, we only want the most recent value
-    df = df.sort_values('UITSLAG_TIJDSTIP')
+    df = df.sort_values('UITSLAG_TIJDSTIP', kind='mergesort')  # stable: of the results with the same moment the last row of the payload is kept
     df = df.groupby(['PATIENTNR', 'DESC']).last().reset_index()
 
     return df
@@ -121,15 +121,21 @@ def clean_data(data):
     return data
 
 
-def scale_data(df, lab_scalers_folder):
+def scale_data(df, lab_scalers_folder, scalers=None):
+    """ Scales the lab results, with the (scale, min) tables of the model bundle if given, else with the scaler files """
 
     for desc in df['DESC'].unique():
 
-        # load right scaler 
-        scaler = joblib.load(f'{lab_scalers_folder}/{desc.replace(" ", "_")}_scaler.pk1')
-
         # scale/transform the data
         bool_lab_res = (df['DESC'] == desc) & (df['UITSLAG'] != -1)  # we want to scale all the lab results except -1 (indicator for '-volgt-')
+        if scalers is not None:
+            if sum(bool_lab_res) != 0:
+                scale, minimum = scalers[desc.replace(" ", "_")]
+                df.loc[bool_lab_res, 'UITSLAG'] = df.loc[bool_lab_res, 'UITSLAG'].astype(float) * scale + minimum
+            continue
+
+        # load right scaler 
+        scaler = joblib.load(f'{lab_scalers_folder}/{desc.replace(" ", "_")}_scaler.pk1')
         if sum(bool_lab_res) != 0:
             df_lab_val = df[bool_lab_res]
             df.loc[bool_lab_res, 'UITSLAG'] = scaler.transform(df_lab_val[['UITSLAG']])
@@ -141,15 +147,9 @@ def scale_data(df, lab_scalers_folder):
 # out functions #
 #################
 
-def to_tidy_format(df):
-    """ Converts wide format to tidy format """
-    df = df.pivot(index='PATIENTNR', columns='DESC', values='UITSLAG').reset_index()
-    missing_cols = [lab for lab in bepcodes.keys() if lab not in df.columns]
-    df[missing_cols] = np.nan
-    return df
-
+def prepare_lab_data(input_data):
+    """ Selects the lab results of the model and adds the sample and result moments """
 
-def preprocess_lab_data(input_data, config):
     # LOAD DATA
     df_lab = load_data(input_data)
 
@@ -167,7 +167,12 @@ def preprocess_lab_data(input_data, config):
     df_lab['AFNAME_TIJDSTIP']    = merge_datetime(df_lab['AFDATUM'], df_lab['AFTIJD'])
     df_lab['UITSLAG_TIJDSTIP']   = merge_datetime(df_lab['UITDATUM'], df_lab['UITTIJD'])
     df_lab = df_lab.drop(columns=['AFDATUM', 'AFTIJD', 'UITDATUM', 'UITTIJD'], axis=1)
-    df_lab = get_latest_lab_results(df_lab)
+
+    return df_lab
+
+
+def clean_lab_data(df_lab, config, scalers=None):
+    """ Cleans and scales the results (row by row, so before or after selecting the latest results) """
 
     # CLEAN NUMERIC VALUES
     for desc in bepcodes.keys():
@@ -175,13 +180,18 @@ def preprocess_lab_data(input_data, config):
         df_lab.loc[df_lab['DESC'] == desc, 'UITSLAG'] = clean_data(data)  # overwrite the non-cleaned data
 
     # SCALE DATA
-    df_lab = scale_data(df_lab, config['lab_scalers_dir'])
+    df_lab = scale_data(df_lab, config['lab_scalers_dir'], scalers)
 
-    # CONVERT TO TIDY FORMAT
-    df_lab = to_tidy_format(df_lab)
-  
     return df_lab
-    
 
 
-    
\ No newline at end of file
+def get_latest_lab_data(input_data, config, scalers=None):
+    """ Preprocesses the lab data to the latest scaled result per patient and lab value (long format) """
+
+    df_lab = get_latest_lab_results(prepare_lab_data(input_data))
+    return clean_lab_data(df_lab, config, scalers)
+
+
+def get_timed_lab_data(input_data, config, scalers=None):
+    """ Preprocesses all lab rows (cleaned and scaled) with their sample and result moments, for point in time selection """
+    return clean_lab_data(prepare_lab_data(input_data), config, scalers)
@@ -0,0 +1,84 @@
+import re
+import string
+
+import pandas as pd
+
+from preprocessing.scripts import text_resources  # nltk is imported on first use
+
+RAD_COLUMNS = ['PATIENTNR', 'VERSLAGNR', 'ACCDATUM', 'ACCTIJD', 'TRANSTEXT']
+
+
+#####################
+# loading function  #
+#####################
+
+def load_data(input_data):
+    """ Loads the reports, only the accorded reports with text are used """
+
+    df = pd.DataFrame(input_data, columns=RAD_COLUMNS)
+    df = df[df['TRANSTEXT'].notna() & df['ACCDATUM'].notna() & df['ACCTIJD'].notna()]
+
+    return df.reset_index(drop=True)
+
+
+#######################
+# date time functions #
+#######################
+
+def merge_datetime(date_col, time_col):
+    """ Merges date and time columns into one column """
+
+    date_col = pd.to_datetime(date_col).dt.strftime('%Y-%m-%d')
+
+    return pd.to_datetime(date_col + ' ' + time_col, format='%Y-%m-%d %H:%M:%S')
+
+
+def get_report_keys(df):
+    """ Key per report: the report number and the accord moment (a re-accorded report gets a new key) """
+    return (df['VERSLAGNR'].astype(str) + '|' + df['ACCDATUM'].astype(str) + '|' + df['ACCTIJD'].astype(str)).tolist()
+
+
+##########################
+# text and NLP functions #
+##########################
+
+def clean_text(tokens: list, stop_words: set):
+    """
+        Cleans text:
+        1. lowers the word
+        2. removes punctuation
+        3. removes stop words
+    """
+
+    words = [word.lower() if word != 'HET' else word for word in tokens]  # HET stands for Hoog-Energetisch Trauma and gets filtered out in the stopwords if set to lower
+    words = [re.sub(f'[{string.punctuation}]', '', word) for word in words if word not in {*stop_words, *string.punctuation}]  # remove stop words and punctuation
+    return words
+
+
+def process_report(text):
+    """
+        Preprocesses one report like 3_PreProcessing/RAD_preprocessing.py:
+        1. Tokenizes the sentence
+        2. Removes stop words
+        3. Stems the words
+        4. Removes digits and empty strings
+    """
+
+    stemmer = text_resources.get_stemmer()
+    words = clean_text(text_resources.tokenize(str(text)), text_resources.get_stop_words())
+    words = [stemmer.stem(word) for word in words]
+
+    return ' '.join(word for word in words if word != '' and not re.match(r'\d', word))
+
+
+##########################
+# aggregation functions  #
+##########################
+
+def get_latest_reports(df, scores):
+    """ Gets the score of the last accorded report per patient """
+
+    df = df.assign(ACCORD=merge_datetime(df['ACCDATUM'], df['ACCTIJD']), RAD_PRED=scores)
+    df = df.sort_values('ACCORD', kind='mergesort')  # stable: of the reports with the same moment the last row of the payload is kept
+
+    return df.groupby('PATIENTNR')['RAD_PRED'].last()
@@ -5,14 +5,9 @@ from datetime import timedelta
 
 import numpy as np
 import pandas as pd
-import joblib
 
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer  # supports Dutch langauge
-from nltk.tokenize import word_tokenize
-from workalendar.europe import NetherlandsWithSchoolHolidays
-
-dutch_stop_words = set(stopwords.words('dutch'))
+from preprocessing.scripts import text_resources  # nltk is imported on first use
+from preprocessing.scripts import calendar_features  # day table shared with the training
 
 
 #####################
@@ -70,7 +65,7 @@ def create_date_features(df):
     """ Creates features from the date and time information """
 
     df['AANKSTIJD'] = pd.to_datetime(df['AANKSTIJD'],format= '%H:%M').dt.hour
-    df['WEEKEND']   = df['AANKSDATUM'].apply(lambda date: 1 if date.weekday() > 4 else 0)
+    df[['WEEKEND', 'HOLIDAY', 'BRIDGE_DAY', 'SCHOOL_HOLIDAY']] = calendar_features.get_calendar_features(df['AANKSDATUM'])
 
     return df
 
@@ -79,15 +74,6 @@ def create_date_features(df):
 # feature encoding functions #
 ##############################
 
-def convert_to_label(df, column, path_to_encoder_dir):
-    """ Converts the colums to category codes """
-
-    label_encoder = joblib.load(f'{path_to_encoder_dir}/{column}_label_encoder.pk1')
-    df[column] = df[column].apply(lambda row: label_encoder.transform([row])[0] if row in label_encoder.classes_ else np.nan)
-
-    return df
-
-
 def create_triage_var(df, triage_col):
     """ Cleans and creates the triage code variable """
 
@@ -101,17 +87,6 @@ def create_triage_var(df, triage_col):
     return df
 
 
-def one_hot_encode_col(df, column, path_to_encoder_dir):
-    """ One hot encodes the given col, returns the whole dataframe """
-
-    one_hot_encoder = joblib.load(f'{path_to_encoder_dir}/{column}_one_hot_encoder.pk1')
-    encoded_data = one_hot_encoder.transform(df[[column]].astype(str))
-    encoded_df = pd.DataFrame(encoded_data, columns=one_hot_encoder.get_feature_names([column]), index=df.index)
-    df = pd.concat([df.drop(columns=[column], axis=1), encoded_df], axis=1)
-
-    return df
-
-
 def group_age(df, column):
     """ Converts age to the corresponding age group """
 
@@ -152,8 +127,7 @@ def clean_text(tokens: list, stop_words: set):
 def remove_stop_words(text):
     """ Removes dutch stop words from text """
 
-    dutch_stop_words = set(stopwords.words('dutch'))
-    text = text.apply(clean_text, stop_words = dutch_stop_words)
+    text = text.apply(clean_text, stop_words = text_resources.get_stop_words())
 
     return text
 
@@ -161,7 +135,7 @@ def remove_stop_words(text):
 def stem_text(text):
     """ Stems dutch text """
 
-    stemmer = SnowballStemmer('dutch')
+    stemmer = text_resources.get_stemmer()
     text = text.apply(lambda tokens: [stemmer.stem(token) for token in tokens])
     
     return text
@@ -176,7 +150,7 @@ def preprocess_text(df, text_column):
         4. Removes empty strings
     """
 
-    df['text'] = df[text_column].apply(word_tokenize, language='dutch')
+    df['text'] = df[text_column].apply(text_resources.tokenize)
     df['text'] = remove_stop_words(df['text'])
     df['text'] = stem_text(df['text'])
     df['text'] = df['text'].apply(lambda text: [word for word in text if not re.match(r'\d', word)])
@@ -187,7 +161,9 @@ def preprocess_text(df, text_column):
     return df.drop(columns=['text'], axis=1)
 
 
-def preprocess_seh_data(input_data, config):
+def prepare_seh_data(input_data):
+    """ Preprocesses the SEH data up to the category encoders (the feature layout applies those as lookup tables) """
+
     df_seh = load_data(input_data)
 
     # HANDLE TIME DATA
@@ -196,12 +172,6 @@ def preprocess_seh_data(input_data, config):
     # # CREATE DATE FEATURES
     df_seh = create_date_features(df_seh)
 
-    # CREATE CATEGORY CODES
-    encoder_dir = config['feature_encoders_dir']
-    df_seh = convert_to_label(df_seh, 'GESLACHT', encoder_dir)
-    df_seh = one_hot_encode_col(df_seh, 'VVCODE', encoder_dir)
-    df_seh = one_hot_encode_col(df_seh, 'SPECIALISM', encoder_dir)
-
     df_seh = create_triage_var(df_seh, 'TRIANIVCOD')
  
     # CREATE GROUPES 
@@ -210,4 +180,4 @@ def preprocess_seh_data(input_data, config):
 
     # CLEAN TEXT DATA
     df_seh = preprocess_text(df_seh, 'KLACHT')
-    return df_seh.drop(['AANKSDATUM', 'TRIAGETIJD', 'TRIADATUM'], axis=1).rename(columns={'LEEFTIJD': 'AGE'})
\ No newline at end of file
+    return df_seh.drop(['AANKSDATUM', 'TRIAGETIJD', 'TRIADATUM'], axis=1).rename(columns={'LEEFTIJD': 'AGE'})
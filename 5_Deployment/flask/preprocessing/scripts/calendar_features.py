@@ -0,0 +1,178 @@
+"""
+    Calendar features of the arrival date, from a precomputed day table.
+
+    The table (resources/calendar_2015_2035.csv) has one row per day from 2015 up to and
+    including 2035: day of the week, weekend, Dutch public holiday, bridge day (a working
+    day between two days off) and the school holidays of the three regions. It is built
+    once with workalendar, so the training and the API read the same file and workalendar
+    is not needed at runtime. A date is looked up by its day number since the first day of
+    the table (one array index per row). Dates outside the table get their day of the week
+    and weekend, the other features are missing (NaN). workalendar only knows the school
+    holidays of 2016 up to 2025, those of 2015, 2026 and 2027 are taken from the published
+    overviews (PUBLISHED_SCHOOL_HOLIDAYS). The school holidays of the later years are
+    missing, a warning is given when such a date is looked up: add the next school year to
+    PUBLISHED_SCHOOL_HOLIDAYS and rebuild the table once its dates are published.
+
+    usage (rebuilds the table, workalendar is installed with requirements-dev.txt):
+    python3 calendar_features.py --build
+"""
+import argparse
+import warnings
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+TABLE_PATH = Path(__file__).resolve().parents[1] / 'resources' / 'calendar_2015_2035.csv'
+FIRST_DAY = pd.Timestamp('2015-01-01')
+LAST_DAY = pd.Timestamp('2035-12-31')
+REGIONS = ['north', 'middle', 'south']
+REGION = 'north'  # the ZGT hospitals (Twente) are in the northern school holiday region
+COLUMNS = ['WEEKDAY', 'WEEKEND', 'HOLIDAY', 'BRIDGE_DAY'] + [f'SCHOOL_HOLIDAY_{region.upper()}' for region in REGIONS]
+
+# school holidays of the years workalendar does not know (first day, last day, regions), from the overviews
+# of the Rijksoverheid (schoolvakanties per schooljaar). The May and Christmas holidays follow the rules of workalendar
+PUBLISHED_YEARS = [2015, 2026, 2027]
+PUBLISHED_SCHOOL_HOLIDAYS = [
+    ('2014-12-20', '2015-01-04', REGIONS),
+    ('2015-02-14', '2015-02-22', ['south']), ('2015-02-21', '2015-03-01', ['north', 'middle']),
+    ('2015-04-25', '2015-05-03', REGIONS),
+    ('2015-07-04', '2015-08-16', ['north']), ('2015-07-11', '2015-08-23', ['middle']), ('2015-07-18', '2015-08-30', ['south']),
+    ('2015-10-10', '2015-10-18', ['south']), ('2015-10-17', '2015-10-25', ['north', 'middle']),
+    ('2015-12-19', '2016-01-03', REGIONS),
+    ('2025-12-20', '2026-01-04', REGIONS),
+    ('2026-02-14', '2026-02-22', ['middle', 'south']), ('2026-02-21', '2026-03-01', ['north']),
+    ('2026-04-25', '2026-05-03', REGIONS),
+    ('2026-07-04', '2026-08-16', ['north']), ('2026-07-11', '2026-08-23', ['south']), ('2026-07-18', '2026-08-30', ['middle']),
+    ('2026-10-10', '2026-10-18', ['south']), ('2026-10-17', '2026-10-25', ['north', 'middle']),
+    ('2026-12-19', '2027-01-03', REGIONS),
+    ('2027-02-13', '2027-02-21', ['south']), ('2027-02-20', '2027-02-28', ['north', 'middle']),
+    ('2027-05-01', '2027-05-09', REGIONS),
+    ('2027-07-10', '2027-08-22', ['north']), ('2027-07-17', '2027-08-29', ['middle']), ('2027-07-24', '2027-09-05', ['south']),
+    ('2027-10-16', '2027-10-24', ['north']), ('2027-10-23', '2027-10-31', ['middle', 'south']),
+    ('2027-12-25', '2028-01-09', REGIONS)]
+
+
+#####################
+# table building    #
+#####################
+
+def get_published_school_holidays(region, year):
+    """ School holiday dates of a region in a year from PUBLISHED_SCHOOL_HOLIDAYS, None if the year is not published """
+
+    if year not in PUBLISHED_YEARS:
+        return None
+
+    return {day.date() for first, last, regions in PUBLISHED_SCHOOL_HOLIDAYS if region in regions
+            for day in pd.date_range(first, last, freq='D') if day.year == year}
+
+
+def get_school_holidays(region, year, public_holidays):
+    """ School holiday dates of a region in a year (public holidays excluded), None if they are not known """
+
+    from workalendar.europe import NetherlandsWithSchoolHolidays
+
+    try:
+        holidays = NetherlandsWithSchoolHolidays(region=region).holidays(year)
+    except NotImplementedError:
+        return get_published_school_holidays(region, year)
+
+    public_names = {name for _, name in public_holidays}
+    return {day for day, name in holidays if name not in public_names}
+
+
+def build_table(first_day=FIRST_DAY, last_day=LAST_DAY):
+    """ Day table of the calendar features from first_day up to and including last_day """
+
+    from workalendar.europe import Netherlands
+
+    days = pd.date_range(first_day, last_day, freq='D')
+    table = pd.DataFrame({'DATE': days.strftime('%Y-%m-%d'), 'WEEKDAY': days.weekday})
+    table['WEEKEND'] = (table['WEEKDAY'] > 4).astype(int)
+
+    holidays = set()
+    school_holidays = {region: pd.Series(np.nan, index=days) for region in REGIONS}
+    for year in range(first_day.year, last_day.year + 1):
+        public_holidays = Netherlands().holidays(year)
+        holidays.update(day for day, _ in public_holidays)
+
+        for region in REGIONS:
+            school_days = get_school_holidays(region, year, public_holidays)
+            if school_days is not None:
+                in_year = days.year == year
+                school_holidays[region][in_year] = [int(day.date() in school_days) for day in days[in_year]]
+
+    table['HOLIDAY'] = [int(day.date() in holidays) for day in days]
+
+    # a working day with a day off before and after it
+    day_off = ((table['WEEKEND'] == 1) | (table['HOLIDAY'] == 1)).values
+    bridge_day = np.zeros(len(table), dtype=int)
+    bridge_day[1:-1] = ~day_off[1:-1] & day_off[:-2] & day_off[2:]
+    table['BRIDGE_DAY'] = bridge_day
+
+    for region in REGIONS:
+        table[f'SCHOOL_HOLIDAY_{region.upper()}'] = school_holidays[region].values
+
+    return table
+
+
+#####################
+# lookup            #
+#####################
+
+@lru_cache(maxsize=None)
+def load_table(path=TABLE_PATH):
+    """ First day of the table and the feature arrays ({column: float array}, one value per day) """
+
+    table = pd.read_csv(path)
+    return pd.Timestamp(table['DATE'].iloc[0]), {column: table[column].values.astype(float) for column in COLUMNS}
+
+
+def get_known_range(region=REGION):
+    """ First and last day of the table with the school holidays of the region filled in """
+
+    first_day, arrays = load_table()
+    known = np.flatnonzero(~np.isnan(arrays[f'SCHOOL_HOLIDAY_{region.upper()}']))
+    return first_day + pd.Timedelta(days=int(known[0])), first_day + pd.Timedelta(days=int(known[-1]))
+
+
+def get_calendar_features(dates, region=REGION):
+    """ WEEKEND, HOLIDAY, BRIDGE_DAY and SCHOOL_HOLIDAY (of the region) of the dates, in the order of the dates """
+
+    first_day, arrays = load_table()
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    day_numbers = ((dates - first_day).dt.days).values
+    known = (day_numbers >= 0) & (day_numbers < len(arrays['WEEKDAY']))  # NaT dates give NaN and are not known
+    positions = np.where(known, day_numbers, 0).astype(int)
+
+    features = pd.DataFrame(index=dates.index)
+    for column, source in [('HOLIDAY', 'HOLIDAY'), ('BRIDGE_DAY', 'BRIDGE_DAY'),
+                           ('SCHOOL_HOLIDAY', f'SCHOOL_HOLIDAY_{region.upper()}')]:
+        features[column] = np.where(known, arrays[source][positions], np.nan)
+    features.insert(0, 'WEEKEND', (dates.dt.weekday > 4).astype(int).values)
+
+    # the models are trained with the school holidays, a missing value is a train/serve skew
+    unknown = features['SCHOOL_HOLIDAY'].isna() & dates.notna().values
+    if unknown.any():
+        first_known, last_known = get_known_range(region)
+        warnings.warn(f'SCHOOL_HOLIDAY is missing for {int(unknown.sum())} date(s) outside the school holidays of the '
+                      f'calendar table ({first_known:%Y-%m-%d} up to {last_known:%Y-%m-%d}), add the published school '
+                      f'holidays to calendar_features.py and rebuild the table')
+
+    return features
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputed calendar table of the date features')
+    parser.add_argument('--build', action='store_true', help='rebuild the table with workalendar')
+    args = parser.parse_args()
+
+    if args.build:
+        build_table().to_csv(TABLE_PATH, index=False, float_format='%g')
+    first_day, arrays = load_table()
+    first_known, last_known = get_known_range()
+    print(f'{TABLE_PATH}: {len(arrays["WEEKDAY"])} days from {first_day:%Y-%m-%d}, '
+          f'{int(arrays["HOLIDAY"].sum())} holidays, {int(arrays["BRIDGE_DAY"].sum())} bridge days, '
+          f'school holidays ({REGION}) from {first_known:%Y-%m-%d} up to {last_known:%Y-%m-%d}')
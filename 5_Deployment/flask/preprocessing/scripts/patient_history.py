@@ -0,0 +1,204 @@
+"""
+    Patient history feature store (PreviousVisits and PrevAdmissionPercentage).
+
+    The store holds one compact row per ED visit (PATIENTNR, SEHID, AANKSDATUM, OPNAME). Every
+    visit counts as a previous visit, also the visits without a destination; only the admission
+    count (OPNAME) needs the destination. It is built once from the historical SEH export,
+    updated with the visits that changed since the last ETL run, and loaded in memory as one
+    sorted array of (patient, day) keys with the cumulative admissions, so the features of all
+    visits of a request are two searchsorted calls. PATIENTNR is a text key without leading
+    zeros, the same key whether the source delivered a number or a string.
+
+    The features are point in time: only visits in the year before the arrival date count
+    (same window as the correlated subqueries in GET_SEH_DATA and SEH_query.sql). Training uses
+    get_point_in_time_features on the full history, which is the same computation.
+"""
+import sqlite3
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+
+ADMISSION_CODES = ['OPN', 'OVER']
+HISTORY_COLUMNS = ['PATIENTNR', 'SEHID', 'AANKSDATUM', 'OPNAME']
+DAY_SHIFT = np.int64(1 << 20)  # composite key: patient code in the high bits, day number in the low bits
+
+
+####################
+# helper functions #
+####################
+
+def to_patient_keys(patients):
+    """ PATIENTNR as text without leading zeros (0123, '0123', 123 and 123.0 are the same patient) """
+
+    keys = pd.Series(patients).astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return keys.str.lstrip('0').replace('', '0').to_numpy()
+
+
+def to_ordinal(dates):
+    """ Converts dates (strings or datetimes, not missing) to day numbers """
+
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    return ((dates - pd.Timestamp('1970-01-01')) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+
+
+def one_year_before(dates):
+    """ Day numbers of the date one year earlier (like DATEADD(year, -1, date) in SQL), dates not missing """
+
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize() - pd.DateOffset(years=1)
+    return ((dates - pd.Timestamp('1970-01-01')) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+
+
+def to_percentage(n_visits, n_admissions):
+    """ Admission percentage of the previous visits, 0 if there are no previous visits """
+
+    n_visits = np.asarray(n_visits, dtype=np.float64)
+    return np.where(n_visits > 0, np.asarray(n_admissions) * 100.0 / np.maximum(n_visits, 1), 0)
+
+
+def build_history(df_seh):
+    """
+        Creates the history rows from an SEH export (needs PATIENTNR, SEHID, AANKSDATUM and BESTEMMING).
+        All visits are kept (a visit without destination is a previous visit that was not admitted),
+        visits without arrival date or patient are dropped, they can never be a previous visit
+    """
+
+    arrivals = pd.to_datetime(df_seh['AANKSDATUM'])
+    df = df_seh[arrivals.notna() & df_seh['PATIENTNR'].notna()]
+    return pd.DataFrame({'PATIENTNR': to_patient_keys(df['PATIENTNR']),
+                         'SEHID': df['SEHID'].to_numpy(),
+                         'AANKSDATUM': arrivals[df.index].dt.strftime('%Y-%m-%d').to_numpy(),
+                         'OPNAME': df['BESTEMMING'].isin(ADMISSION_CODES).astype(int).to_numpy()})
+
+
+###########################
+# point in time (batched) #
+###########################
+
+def index_history(patients, days, admissions):
+    """
+        In memory form of the history: the sorted (patient, day) keys and the cumulative admissions
+        in that order, patients are normalised keys and days are day numbers
+    """
+
+    codes = pd.Categorical(patients)
+    keys = codes.codes.astype(np.int64) * DAY_SHIFT + np.asarray(days, dtype=np.int64)
+    order = np.argsort(keys, kind='mergesort')
+
+    return {'patients': codes.categories, 'keys': keys[order],
+            'cum_admissions': np.r_[0, np.cumsum(np.asarray(admissions, dtype=np.int64)[order])]}
+
+
+def count_previous_visits(index, patients, arrival_dates):
+    """
+        Calculates PreviousVisits and PrevAdmissionPercentage for every (patient, arrival date)
+        with two searchsorted calls on the indexed history. A visit without arrival date has no previous visits
+    """
+
+    arrival_dates = pd.to_datetime(pd.Series(arrival_dates)).reset_index(drop=True)
+    known = arrival_dates.notna().to_numpy()
+    arrival_dates = arrival_dates.fillna(pd.Timestamp('1970-01-01'))
+
+    visit_codes = index['patients'].get_indexer(to_patient_keys(patients)).astype(np.int64)  # -1 for patients without history
+    visit_codes[~known] = -1
+    prefix = visit_codes * DAY_SHIFT
+
+    lower = np.searchsorted(index['keys'], prefix + one_year_before(arrival_dates), side='right')
+    upper = np.searchsorted(index['keys'], prefix + to_ordinal(arrival_dates), side='left')
+    cum_admissions = index['cum_admissions']
+
+    n_visits = np.where(visit_codes >= 0, upper - lower, 0)
+    n_admissions = np.where(visit_codes >= 0, cum_admissions[upper] - cum_admissions[lower], 0)
+
+    return pd.DataFrame({'PreviousVisits': n_visits, 'PrevAdmissionPercentage': to_percentage(n_visits, n_admissions)})
+
+
+def get_point_in_time_features(df_history, patients, arrival_dates):
+    """
+        Calculates PreviousVisits and PrevAdmissionPercentage for every (patient, arrival date)
+        with one sort of the history and two searchsorted calls (used for training)
+    """
+
+    index = index_history(to_patient_keys(df_history['PATIENTNR']), to_ordinal(df_history['AANKSDATUM']),
+                          df_history['OPNAME'].to_numpy())
+    return count_previous_visits(index, patients, arrival_dates)
+
+
+###################
+# store functions #
+###################
+
+def connect_store(path):
+    """ Opens (and creates if needed) the history store """
+
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE IF NOT EXISTS PATIENT_HISTORY '
+                '(PATIENTNR TEXT, SEHID INTEGER PRIMARY KEY, AANKSDATUM TEXT, OPNAME INTEGER)')
+    con.execute('CREATE INDEX IF NOT EXISTS IDX_PATIENT_HISTORY ON PATIENT_HISTORY (PATIENTNR, AANKSDATUM)')
+
+    return con
+
+
+def update_store(con, df_history):
+    """
+        Adds (or overwrites) closed visits in the store, returns the number of changed visits.
+        Visits that are already stored unchanged are not written, so the store file (and its
+        mtime, which makes the API reload the store) only changes when a visit changed
+    """
+
+    df_history = df_history.assign(PATIENTNR=to_patient_keys(df_history['PATIENTNR']))
+    rows = df_history[HISTORY_COLUMNS].itertuples(index=False, name=None)
+    n_changes = con.total_changes
+    con.executemany('INSERT INTO PATIENT_HISTORY (PATIENTNR, SEHID, AANKSDATUM, OPNAME) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (SEHID) DO UPDATE SET PATIENTNR = excluded.PATIENTNR, AANKSDATUM = excluded.AANKSDATUM, '
+                    'OPNAME = excluded.OPNAME WHERE PATIENTNR IS NOT excluded.PATIENTNR '
+                    'OR AANKSDATUM IS NOT excluded.AANKSDATUM OR OPNAME IS NOT excluded.OPNAME',
+                    [(patient, int(sehid), str(arrival), int(admitted)) for patient, sehid, arrival, admitted in rows])
+    n_changes = con.total_changes - n_changes
+    if n_changes:
+        con.commit()
+    else:
+        con.rollback()
+
+    return n_changes
+
+
+def load_store(con, since=None):
+    """ Loads the store in memory as the indexed history (see index_history) """
+
+    query = 'SELECT PATIENTNR, AANKSDATUM, OPNAME FROM PATIENT_HISTORY'
+    params = []
+    if since is not None:  # only the last year is needed for the features
+        query += ' WHERE AANKSDATUM >= ?'
+        params.append(str(since))
+
+    df = pd.read_sql_query(query, con, params=params)
+    # the keys are normalised again for stores written before the keys were normalised
+    return index_history(to_patient_keys(df['PATIENTNR']), to_ordinal(df['AANKSDATUM']), df['OPNAME'].to_numpy())
+
+
+def add_history_features(df_seh, store, date_col='AANKSDATUM'):
+    """ Fills PreviousVisits and PrevAdmissionPercentage of the current visits from the store """
+
+    features = count_previous_visits(store, df_seh['PATIENTNR'], df_seh[date_col])
+    df_seh['PreviousVisits'] = features['PreviousVisits'].to_numpy()
+    df_seh['PrevAdmissionPercentage'] = features['PrevAdmissionPercentage'].to_numpy()
+
+    return df_seh
+
+
+def store_cutoff(today=None):
+    """ Oldest arrival date that can still count for a visit today (one year and a day back) """
+
+    today = pd.Timestamp(today or date.today())
+    return (today - pd.DateOffset(years=1, days=1)).strftime('%Y-%m-%d')
+
+
+if __name__ == '__main__':
+    # builds the store from the historical SEH export: python3 patient_history.py SEH_export.csv store.db
+    df_seh = pd.read_csv(sys.argv[1], sep=';', na_values=[''])
+    con = connect_store(sys.argv[2])
+    update_store(con, build_history(df_seh))
+    print(f'{con.execute("SELECT COUNT(*) FROM PATIENT_HISTORY").fetchone()[0]} visits in the store')
@@ -0,0 +1,68 @@
+"""
+    Text resources of the complaint and report preprocessing, loaded on first use.
+
+    nltk takes most of the import time of the API, so it is imported by the functions that
+    tokenize and stem instead of when the preprocessing modules are imported. The Dutch stop
+    words are read from a small local file (built from the nltk stopwords corpus), so the
+    API does not read the nltk corpus or need its download. The tokenizer needs no data
+    either: the text is tokenized as one line with the Treebank rules of word_tokenize, and
+    the periods punkt would have ended a sentence with are split off. After the punctuation
+    is removed (clean_text) the words are the same as with the punkt sentence splitter.
+
+    usage (rebuilds the stop word file, in an environment with the nltk stopwords corpus):
+    python3 text_resources.py --build
+"""
+import argparse
+from functools import lru_cache
+from pathlib import Path
+
+
+STOP_WORDS_PATH = Path(__file__).resolve().parents[1] / 'resources' / 'dutch_stopwords.txt'
+
+
+@lru_cache(maxsize=None)
+def get_stop_words():
+    """ Dutch stop words of the local file """
+    return frozenset(STOP_WORDS_PATH.read_text(encoding='utf-8').split())
+
+
+@lru_cache(maxsize=None)
+def get_stemmer():
+    """ Dutch snowball stemmer (nltk is imported on the first call) """
+
+    from nltk.stem.snowball import SnowballStemmer
+    return SnowballStemmer('dutch')
+
+
+def tokenize(text):
+    """ Dutch word tokens of a text without the punkt data (nltk is imported on the first call) """
+
+    from nltk.tokenize import word_tokenize
+    tokens = word_tokenize(text, language='dutch', preserve_line=True)
+    # 'en.' becomes 'en' and '.', so a stop word before a period is still removed
+    return [part for token in tokens
+            for part in ([token[:-1], '.'] if token.endswith('.') and token.strip('.') else [token])]
+
+
+def warm_up():
+    """ Loads the stop words, the stemmer and the tokenizer, so the first request does not wait for them """
+
+    get_stop_words()
+    get_stemmer().stem(tokenize('opname')[0])
+
+
+def build_stop_words(path=STOP_WORDS_PATH):
+    """ Writes the Dutch stop words of the nltk corpus to the local file """
+
+    from nltk.corpus import stopwords
+    path.write_text(''.join(f'{word}\n' for word in stopwords.words('dutch')), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local text resources of the preprocessing')
+    parser.add_argument('--build', action='store_true', help='rebuild the stop word file from the nltk corpus')
+    args = parser.parse_args()
+
+    if args.build:
+        build_stop_words()
+    print(f'{STOP_WORDS_PATH}: {len(get_stop_words())} stop words')
@@ -0,0 +1,86 @@
+"""
+    Table-driven cleaning of the vital measurements, shared by 3_PreProcessing/VITALS_preprocessing.py
+    and the API, so training and serving clean the values the same way.
+
+    The plausible range of every label is one row of a table. The labels of the long frame
+    are converted to categorical codes once, the range and (scale, min) of every row are
+    looked up by code, and all rows are checked and scaled in one vectorized pass.
+"""
+from functools import lru_cache
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+# plausible range per label, values outside the range are dropped
+VITAL_RANGES = {'Temp': (25, 45), 'Resp': (3, 50), 'NIBP': (50, 250), 'MEWS score': (0, 3), 'HR': (30, 200)}
+LABELS = list(VITAL_RANGES)
+UNSCALED = ['MEWS score']  # MEWS is a score from 0 to 3, no need to scale
+LABEL_ALIASES = {'POLS': 'HR'}  # the heart rate is registered as HR and POLS
+
+
+def get_label_codes(labels):
+    """ Position of every label in LABELS, -1 for labels the models do not use """
+    return pd.Index(LABELS).get_indexer(pd.Series(labels).to_numpy())
+
+
+def to_float(values):
+    """ Converts the values to float (in Dutch the decimal separator is a ','), NaN if not numeric """
+    return pd.to_numeric(pd.Series(values).astype(str).str.replace(',', '.'), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def clean_vitals(df, value_col='Value1'):
+    """ Merges the heart rate labels, converts the values to float and drops missing, unknown and implausible values """
+
+    labels = df['LABEL'].replace(LABEL_ALIASES)
+    values = to_float(df[value_col])
+    codes = get_label_codes(labels)
+
+    ranges = np.array([VITAL_RANGES[label] for label in LABELS] + [(np.nan, np.nan)], dtype=np.float64)
+    lower, upper = ranges[codes, 0], ranges[codes, 1]  # code -1 picks the NaN range, so unknown labels are dropped
+    keep = (values >= lower) & (values <= upper)
+
+    df = df[keep].copy()
+    df['LABEL'] = labels[keep].values
+    df[value_col] = values[keep]
+
+    return df
+
+
+def scale_vitals(df, scalers, value_col='Value1'):
+    """ Scales the cleaned values with the {label: (scale, min)} table, the unscaled labels are kept as they are """
+
+    table = np.array([(1.0, 0.0) if label in UNSCALED else scalers[label] for label in LABELS], dtype=np.float64)
+    codes = get_label_codes(df['LABEL'])
+    df[value_col] = df[value_col].to_numpy(dtype=np.float64) * table[codes, 0] + table[codes, 1]
+
+    return df
+
+
+def fit_scalers(df, value_col='Value1'):
+    """ Fits a MinMaxScaler per scaled label on the cleaned values, from the grouped minimum and maximum """
+
+    from sklearn.preprocessing import MinMaxScaler  # only used offline, not imported by the API
+    stats = df.groupby('LABEL')[value_col].agg(['min', 'max', 'count'])
+
+    scalers = {}
+    for label, (minimum, maximum, count) in stats.iterrows():
+        if label in UNSCALED:
+            continue
+        scalers[label] = MinMaxScaler().fit([[minimum], [maximum]])
+        scalers[label].n_samples_seen_ = int(count)
+
+    return scalers
+
+
+def to_scale_table(scalers):
+    """ Converts MinMaxScalers to the {label: (scale, min)} table """
+    return {label: (scaler.scale_[0], scaler.min_[0]) for label, scaler in scalers.items()}
+
+
+@lru_cache(maxsize=None)
+def load_scalers(scaler_dir):
+    """ Loads the scaler files of the scaled labels as a {label: (scale, min)} table (once per directory) """
+    return to_scale_table({label: joblib.load(f'{scaler_dir}/{label}_scaler.pk1')
+                           for label in LABELS if label not in UNSCALED})
@@ -0,0 +1,289 @@
+"""
+    Retrospective replay of the deployed models.
+
+    Scores historical SEH/LAB/VITALS (and optionally RAD) exports for every visit at
+    every 10 minute offset after arrival, using the same preprocessing scripts and
+    models as the flask API. Visits are sharded over a process pool and the predictions
+    are streamed to a Parquet file as the shards finish.
+
+    usage (from the flask directory, so the relative paths in config.yaml resolve):
+    python3 replay.py SEH.csv LAB.csv VITALS.csv predictions.parquet [--rad-file RAD.csv]
+"""
+import argparse
+import time as timer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import feature_layout
+import flask_API
+from preprocessing.scripts import SEH_preprocessing, LAB_preprocessing, VITALS_preprocessing, RAD_preprocessing, patient_history
+
+
+SEH_COLUMNS = ['SEHID', 'PATIENTNR', 'KLACHT', 'VVCODE', 'SPECIALISM', 'TRIADATUM', 'TRIAGETIJD', 'AANKSDATUM',
+               'AANKSTIJD', 'TRIANIVCOD', 'VOORNAAM', 'ACHTERNAAM', 'GESLACHT', 'LEEFTIJD',
+               'PreviousVisits', 'PrevAdmissionPercentage']
+LAB_COLUMNS = ['PATIENTNR', 'AFDATUM', 'AFTIJD', 'UITTIJD', 'BEPCODE', 'UITSLAG', 'DESC', 'UITDATUM']
+VITAL_COLUMNS = ['PATIENTNR', 'DateTime', 'LABEL', 'Value1']
+RAD_COLUMNS = RAD_preprocessing.RAD_COLUMNS
+
+OUTPUT_SCHEMA = pa.schema([('SEHID', pa.int64()), ('OFFSET', pa.int16()), ('PREDICTION', pa.float32())])
+
+worker_config = None  # config the models of this worker process were loaded with
+
+
+#####################
+# loading functions #
+#####################
+
+def load_data(file_path):
+    """ Loads an export file (csv with ; as separator, as written by the extraction queries) """
+    return pd.read_csv(file_path, sep=';', na_values=[''], dtype={'AANKSTIJD': str, 'TRIAGETIJD': str, 'AFTIJD': str,
+                                                                   'UITTIJD': str, 'TIJD': str, 'EINDTIJD': str,
+                                                                   'ACCTIJD': str})
+
+
+def prepare_seh_export(df):
+    """ Converts the historical SEH export to the SEH_REG layout the API receives """
+
+    df = df.rename(columns={'AGE': 'LEEFTIJD'})
+    for col in ('VOORNAAM', 'ACHTERNAAM'):
+        if col not in df.columns:
+            df[col] = ''
+
+    # the extraction query no longer computes the previous visits, use the point in time values of the history
+    if 'PreviousVisits' not in df.columns:
+        features = patient_history.get_point_in_time_features(patient_history.build_history(df), df['PATIENTNR'],
+                                                              df['AANKSDATUM'])
+        df['PreviousVisits'] = features['PreviousVisits'].values
+        df['PrevAdmissionPercentage'] = features['PrevAdmissionPercentage'].values
+
+    df['AANKOMST'] = SEH_preprocessing.merge_datetime(df['AANKSDATUM'], df['AANKSTIJD'])
+    df['TRIAGE'] = SEH_preprocessing.merge_datetime(df['TRIADATUM'], df['TRIAGETIJD'])
+    if 'EINDTIJD' in df.columns:
+        df['EIND'] = SEH_preprocessing.time_to_datetime(df['AANKOMST'], df['EINDTIJD'])[0]
+    else:
+        df['EIND'] = pd.NaT
+
+    # the live pipeline merges on PATIENTNR, a replay shard can hold several visits of one patient
+    df['PATIENTNR'] = df['SEHID']
+
+    return df[[*SEH_COLUMNS, 'AANKOMST', 'TRIAGE', 'EIND']]
+
+
+def prepare_lab_export(df, df_seh):
+    """ Converts the historical LAB export to the SEH_LAB layout and adds the sample and result timestamps """
+
+    df = df.rename(columns={'TIJD': 'UITTIJD'})
+    df = df[df['SEHID'].isin(df_seh['SEHID'])].copy()
+    df['AFNAME_TIJDSTIP'] = LAB_preprocessing.merge_datetime(df['AFDATUM'], df['AFTIJD'])
+
+    if 'UITDATUM' in df.columns:
+        df['UITSLAG_TIJDSTIP'] = LAB_preprocessing.merge_datetime(df['UITDATUM'], df['UITTIJD'])
+    else:
+        # the extraction query only has the result time, the result is on the sample date or the day after
+        df['UITSLAG_TIJDSTIP'] = SEH_preprocessing.time_to_datetime(df['AFNAME_TIJDSTIP'], df['UITTIJD'])[0]
+        df['UITDATUM'] = df['UITSLAG_TIJDSTIP'].dt.strftime('%Y-%m-%d')
+
+    df['PATIENTNR'] = df['SEHID']
+
+    return df[['SEHID', *LAB_COLUMNS, 'AFNAME_TIJDSTIP', 'UITSLAG_TIJDSTIP']]
+
+
+def prepare_vital_export(df, df_seh):
+    """ Converts the historical VITALS export to the SEH_VITALS layout """
+
+    df = df[df['SEHID'].isin(df_seh['SEHID'])].copy()
+    df['TIJDSTIP'] = pd.to_datetime(df['DateTime'])
+    df['PATIENTNR'] = df['SEHID']
+
+    return df[['SEHID', *VITAL_COLUMNS, 'TIJDSTIP']]
+
+
+def prepare_rad_export(df, df_seh):
+    """ Converts the historical RAD export to the SEH_RAD layout and adds the accord timestamp """
+
+    # only the accorded reports with text are used, like RAD_preprocessing.load_data
+    df = df[df['SEHID'].isin(df_seh['SEHID']) & df['TRANSTEXT'].notna() & df['ACCDATUM'].notna()
+            & df['ACCTIJD'].notna()].copy()
+    df['PATIENTNR'] = df['SEHID']
+    df['ACCORD'] = RAD_preprocessing.merge_datetime(df['ACCDATUM'], df['ACCTIJD'])
+
+    return df[['SEHID', *RAD_COLUMNS, 'ACCORD']]
+
+
+########################
+# point in time replay #
+########################
+
+def get_lab_data_at(df_lab, current_times):
+    """ Gets the lab rows known at the given time per visit, results that are not back yet are '-volgt-' """
+
+    df_lab = df_lab[df_lab['AFNAME_TIJDSTIP'] < current_times.loc[df_lab['SEHID']].values]
+    pending = df_lab['UITSLAG_TIJDSTIP'] >= current_times.loc[df_lab['SEHID']].values
+
+    df_lab = df_lab[LAB_COLUMNS].copy()
+    df_lab.loc[pending, 'UITSLAG'] = '-volgt-'
+
+    return df_lab
+
+
+def get_vital_data_at(df_vitals, current_times):
+    """ Gets the vital rows measured before the given time per visit """
+
+    known = df_vitals['TIJDSTIP'] < current_times.loc[df_vitals['SEHID']].values
+    return df_vitals.loc[known, VITAL_COLUMNS]
+
+
+def score_batch(X, offset):
+    """ Scores the feature rows with the model the API selects for the offset """
+
+    return flask_API.predict_proba(flask_API.models[flask_API.get_model_time(offset)], X)
+
+
+def get_rad_data_at(df_rad, scores, current_times):
+    """ Gets the score of the last report accorded before the given time per visit """
+
+    known = (df_rad['ACCORD'] < current_times.loc[df_rad['SEHID']].values).values
+    return RAD_preprocessing.get_latest_reports(df_rad[known], scores[known])
+
+
+def iter_feature_matrices(df_seh, df_lab, df_vitals, df_rad, offsets):
+    """
+        Yields the offset, SEHIDs and feature matrix of the visits still in the ED at every offset of a shard.
+        The reports (df_rad, None without a RAD export) are scored like the API does when the layout has RAD_PRED
+    """
+
+    config = flask_API.config
+    layout = flask_API.layout
+    triage_times = df_seh.set_index('SEHID')['TRIAGE']
+    end_times = df_seh.set_index('SEHID')['EIND']
+    arrival_times = df_seh.set_index('SEHID')['AANKOMST']
+
+    # the SEH stream only changes at triage, so it is written (and the complaint text scored) once per shard
+    processed_seh = SEH_preprocessing.prepare_seh_data(df_seh[SEH_COLUMNS].to_dict('list'))
+    X_seh = feature_layout.create_matrix(layout, len(processed_seh))
+    feature_layout.write_seh_data(X_seh, layout, processed_seh)
+    feature_layout.write_column(X_seh, layout, 'KLACHT_PRED', flask_API.get_text_preds(processed_seh['KLACHT']))
+    triage_slot = layout['columns'].get_loc('TRIANIVCOD')
+    triage_codes = X_seh[:, triage_slot].copy()
+
+    # every report is scored once per shard, only the selection of the accorded reports is repeated per offset
+    use_rad = df_rad is not None and flask_API.rad_model is not None and 'RAD_PRED' in layout['columns']
+    if use_rad:
+        rad_scores = np.asarray(flask_API.get_report_scores(df_rad))
+
+    for offset in offsets:
+        current_times = arrival_times + timedelta(minutes=offset)
+        in_ed = (end_times.isna() | (current_times < end_times)).values
+        if not in_ed.any():
+            continue
+
+        X = X_seh.copy()
+        X[:, triage_slot] = np.where((triage_times < current_times).values, triage_codes, np.nan)
+
+        lab_data = get_lab_data_at(df_lab, current_times)
+        vital_data = get_vital_data_at(df_vitals, current_times)
+        processed_lab = LAB_preprocessing.get_latest_lab_data(lab_data.to_dict('list'), config,
+                                                               flask_API.get_scalers('lab'))
+        processed_vitals = VITALS_preprocessing.get_latest_vital_data(vital_data.to_dict('list'), config,
+                                                                      flask_API.get_scalers('vitals'))
+        feature_layout.write_long_data(X, layout, processed_seh['PATIENTNR'], processed_lab, 'DESC', 'UITSLAG')
+        feature_layout.write_long_data(X, layout, processed_seh['PATIENTNR'], processed_vitals, 'LABEL', 'Value1')
+        if use_rad:
+            rad_preds = get_rad_data_at(df_rad, rad_scores, current_times)
+            feature_layout.write_column(X, layout, 'RAD_PRED',
+                                        processed_seh['PATIENTNR'].map(rad_preds).to_numpy(dtype=np.float32))
+
+        yield offset, processed_seh['SEHID'][in_ed].astype('int64').values, X[in_ed]
+
+
+def replay_shard(config_path, df_seh, df_lab, df_vitals, df_rad, offsets):
+    """ Replays all offsets for a shard of visits, returns one row per (visit, offset) """
+
+    init_worker(config_path)
+    results = []
+    for offset, sehids, X in iter_feature_matrices(df_seh, df_lab, df_vitals, df_rad, offsets):
+        results.append(pd.DataFrame({'SEHID': sehids, 'OFFSET': np.int16(offset),
+                                     'PREDICTION': score_batch(X, offset).astype('float32')}))
+
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=OUTPUT_SCHEMA.names)
+
+
+###################
+# process workers #
+###################
+
+def init_worker(config_path):
+    """ Loads the config and models on the first shard of a worker process (the pool initializer needs python 3.7) """
+    global worker_config
+
+    if worker_config != config_path:
+        flask_API.load_models(config_path)
+        worker_config = config_path
+
+
+def get_shard_rows(df, groups, shard):
+    """ Rows of df (grouped on SEHID) of the visits of the shard, None stays None """
+
+    if df is None:
+        return None
+    return df.iloc[[idx for sehid in shard['SEHID'] for idx in groups.get(sehid, [])]]
+
+
+def iter_shards(df_seh, df_lab, df_vitals, shard_size, df_rad=None):
+    """ Splits the visits into shards with their own lab, vital and report rows """
+
+    frames = [df_lab, df_vitals, df_rad]
+    groups = [df.groupby('SEHID').indices if df is not None else None for df in frames]
+
+    for start in range(0, len(df_seh), shard_size):
+        shard = df_seh.iloc[start:start + shard_size]
+        yield (shard, *[get_shard_rows(df, df_groups, shard) for df, df_groups in zip(frames, groups)])
+
+
+def replay(df_seh, df_lab, df_vitals, out_path, config_path='./config.yaml', offsets=flask_API.MODEL_TIMES,
+           shard_size=500, workers=None, df_rad=None):
+    """ Replays all visits over a process pool and streams the predictions to a parquet file """
+
+    start = timer.time()
+    n_rows = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+         pq.ParquetWriter(out_path, OUTPUT_SCHEMA) as writer:
+
+        futures = [executor.submit(replay_shard, config_path, *shard, list(offsets))
+                   for shard in iter_shards(df_seh, df_lab, df_vitals, shard_size, df_rad)]
+
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            df_res = future.result()
+            writer.write_table(pa.Table.from_pandas(df_res, schema=OUTPUT_SCHEMA, preserve_index=False))
+            n_rows += len(df_res)
+            print(f'{n_done}/{len(futures)} shards done, {n_rows} predictions ({timer.time() - start:.0f}s)')
+
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays the deployed models over historical exports')
+    parser.add_argument('seh_file')
+    parser.add_argument('lab_file')
+    parser.add_argument('vital_file')
+    parser.add_argument('out_file', help='parquet file to write the predictions to')
+    parser.add_argument('--rad-file', default=None, help='RAD export, scored when the layout has RAD_PRED')
+    parser.add_argument('--config', default='./config.yaml')
+    parser.add_argument('--shard-size', type=int, default=500, help='number of visits per shard')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: cpu count)')
+    args = parser.parse_args()
+
+    df_seh = prepare_seh_export(load_data(args.seh_file))
+    df_lab = prepare_lab_export(load_data(args.lab_file), df_seh)
+    df_vitals = prepare_vital_export(load_data(args.vital_file), df_seh)
+    df_rad = prepare_rad_export(load_data(args.rad_file), df_seh) if args.rad_file else None
+
+    replay(df_seh, df_lab, df_vitals, args.out_file, args.config, shard_size=args.shard_size, workers=args.workers,
+           df_rad=df_rad)
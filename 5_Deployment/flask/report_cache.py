@@ -0,0 +1,51 @@
+"""
+    Cache of the processed radiology reports.
+
+    A report is tokenized, stemmed and scored by the report text model once: the processed
+    text and the score are kept under the report key (report number and accord moment),
+    so the next refreshes during the visit only look the report up. The cache keeps the
+    most recently used reports up to max_size, so reports of visits that left the ED drop
+    out on their own.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ReportCache:
+    """ Least recently used cache of report key -> (processed text, score) """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get_many(self, keys):
+        """ Gets the cached entries of the keys, returns {key: (text, score)} for the keys that are cached """
+
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+            self.counters['hits'] += len(found)
+            self.counters['misses'] += len(set(keys)) - len(found)
+
+        return found
+
+    def put_many(self, items):
+        """ Adds the {key: (text, score)} entries, the least recently used entries are removed above max_size """
+
+        with self.lock:
+            for key, entry in items.items():
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """ Counters and the number of cached reports """
+
+        with self.lock:
+            return {**self.counters, 'cached_reports': len(self.entries), 'max_size': self.max_size}
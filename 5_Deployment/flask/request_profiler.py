@@ -0,0 +1,201 @@
+"""
+    On-demand sampling profiler for live requests.
+
+    A profiling session covers the next N requests or a time window. A sampler thread
+    takes the stack of every thread that is handling a tracked request every few
+    milliseconds (sys._current_frames, the request threads are never paused or traced),
+    and counts the stacks. The counts are reported per function (samples in the function
+    itself and samples with the function on the stack) and as a collapsed stack file
+    (`frame;frame;frame count` per line) for flame graph tools. When no session runs a
+    request only reads the `active` flag, and a session is bounded in time and in the
+    number of distinct stacks it keeps, so it can be started under real load.
+"""
+import os
+import sys
+import threading
+import time
+
+
+class NoTracking:
+    """ Context manager of the requests that are not profiled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_TRACKING = NoTracking()
+
+
+def get_label(code):
+    """ Frame label of a code object: file:function (';' and ' ' separate the collapsed stack format) """
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'.replace(';', ',').replace(' ', '_')
+
+
+def get_stack(frame, max_depth=200):
+    """ Collapsed stack of a frame, from the outermost call to the frame itself """
+
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(get_label(frame.f_code))
+        frame = frame.f_back
+
+    return ';'.join(reversed(labels))
+
+
+class RequestTracker:
+    """ Marks the thread of a request as profiled while the request runs """
+
+    def __init__(self, profiler, session):
+        self.profiler = profiler
+        self.session = session
+        self.thread_id = threading.get_ident()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.request_done(self.session, self.thread_id)
+        return False
+
+
+class SamplingProfiler:
+    """ Samples the stacks of the tracked requests for the next N requests or a time window """
+
+    def __init__(self, max_seconds=300, max_stacks=20000):
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()
+        self.active = False
+        self.session = None
+        self.stacks = {}
+        self.threads = set()  # ids of the threads handling a tracked request
+
+    def start(self, requests=None, seconds=None, interval=0.005):
+        """ Starts a session for the next `requests` requests and/or `seconds` seconds, False if one is running """
+
+        seconds = min(seconds or self.max_seconds, self.max_seconds)
+        with self.lock:
+            if self.active:
+                return False
+            self.session = {'requests': requests, 'requests_started': 0, 'requests_done': 0, 'seconds': seconds,
+                            'interval': interval, 'samples': 0, 'dropped_samples': 0, 'started': time.time(),
+                            'stopped': None, 'stop': threading.Event()}
+            self.stacks = {}
+            self.threads = set()
+            self.active = True
+
+        threading.Thread(target=self.sample_loop, args=(self.session,), name='request-profiler', daemon=True).start()
+        return True
+
+    def stop(self, session=None):
+        """ Ends the running session (only if it is the given session) """
+
+        with self.lock:
+            if self.active and (session is None or session is self.session):
+                self.active = False
+                self.session['stopped'] = time.time()
+                self.session['stop'].set()
+
+    def track(self):
+        """ Context manager around a request, the request is profiled if a session runs and wants more requests """
+
+        if not self.active:
+            return NO_TRACKING
+
+        with self.lock:
+            session = self.session
+            if not self.active or (session['requests'] is not None and session['requests_started'] >= session['requests']):
+                return NO_TRACKING
+            session['requests_started'] += 1
+            tracker = RequestTracker(self, session)
+            self.threads.add(tracker.thread_id)
+
+        return tracker
+
+    def request_done(self, session, thread_id):
+        """ Stops sampling the thread of a finished request, the session ends after its last request """
+
+        with self.lock:
+            if session is not self.session:
+                return
+            self.threads.discard(thread_id)
+            session['requests_done'] += 1
+            last = session['requests'] is not None and session['requests_done'] >= session['requests']
+
+        if last:
+            self.stop(session)
+
+    def sample_loop(self, session):
+        """ Samples the tracked threads until the session is stopped or its time is up """
+
+        deadline = session['started'] + session['seconds']
+        while not session['stop'].wait(session['interval']):
+            if time.time() >= deadline:
+                self.stop(session)
+                break
+
+            with self.lock:
+                threads = list(self.threads)
+            if not threads:
+                continue
+
+            frames = sys._current_frames()
+            stacks = [get_stack(frames[thread_id]) for thread_id in threads if thread_id in frames]
+            del frames  # the frames keep the locals of the requests alive
+
+            with self.lock:
+                for stack in stacks:
+                    if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                        session['samples'] += 1
+                    else:
+                        session['dropped_samples'] += 1
+
+    def status(self):
+        """ Settings and progress of the last session, None if no session was started """
+
+        with self.lock:
+            if self.session is None:
+                return None
+            status = {key: value for key, value in self.session.items() if key != 'stop'}
+            status['active'] = self.active
+            status['interval_ms'] = status.pop('interval') * 1000
+
+        return status
+
+    def report(self, stages=None, top=30):
+        """
+            Samples per function of the last session: `self` samples in the function itself and `total`
+            samples with the function on the stack, most self samples first. With stages ({stage: [function labels]})
+            the samples with one of the functions of a stage on the stack are added per stage.
+        """
+
+        with self.lock:
+            stacks = dict(self.stacks)
+
+        functions = {}
+        for stack, count in stacks.items():
+            labels = stack.split(';')
+            for label in set(labels):
+                functions.setdefault(label, {'function': label, 'self': 0, 'total': 0})['total'] += count
+            functions[labels[-1]]['self'] += count
+
+        report = {**(self.status() or {}),
+                  'functions': sorted(functions.values(), key=lambda function: (-function['self'], -function['total']))[:top]}
+        if stages:
+            report['stages'] = {stage: sum(count for stack, count in stacks.items()
+                                           if any(label in stack.split(';') for label in labels))
+                                for stage, labels in stages.items()}
+
+        return report
+
+    def collapsed(self):
+        """ Collapsed stacks of the last session, one `frame;frame;frame count` line per distinct stack """
+
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
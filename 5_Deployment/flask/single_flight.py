@@ -0,0 +1,79 @@
+"""
+    Single-flight coalescing of identical requests.
+
+    The dashboards on the ED workstations poll with (nearly always) the same payload.
+    The payload is canonicalized and hashed; the first request with a hash computes the
+    result, concurrent requests with the same hash wait for that result, and the result
+    is kept for a short window so refreshes right after it are served from memory.
+"""
+import hashlib
+import json
+import threading
+import time
+
+
+def payload_key(payload):
+    """ sha256 of the canonical json of the payload (sorted keys, no whitespace) """
+
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """ Runs one computation per key at a time and keeps the result for `window` seconds """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> {'done': Event, 'result', 'error', 'expires'}
+        self.counters = {'computed': 0, 'coalesced': 0, 'cached': 0, 'errors': 0}
+
+    def purge(self, now):
+        """ Removes the finished entries whose window has passed (call with the lock held) """
+
+        expired = [key for key, entry in self.entries.items() if entry['done'].is_set() and entry['expires'] <= now]
+        for key in expired:
+            del self.entries[key]
+
+    def run(self, key, compute):
+        """ Returns compute() for the key, shared with concurrent and recent calls with the same key """
+
+        with self.lock:
+            now = time.monotonic()
+            self.purge(now)
+            entry = self.entries.get(key)
+
+            if entry is None:
+                entry = {'done': threading.Event(), 'result': None, 'error': None, 'expires': float('inf')}
+                self.entries[key] = entry
+                owner = True
+                self.counters['computed'] += 1
+            else:
+                owner = False
+                self.counters['cached' if entry['done'].is_set() else 'coalesced'] += 1
+
+        if owner:
+            try:
+                entry['result'] = compute()
+            except Exception as e:
+                entry['error'] = e
+            with self.lock:
+                if entry['error'] is not None:  # errors are not kept, the next request tries again
+                    self.counters['errors'] += 1
+                    self.entries.pop(key, None)
+                entry['expires'] = time.monotonic() + self.window
+                entry['done'].set()
+        else:
+            entry['done'].wait()
+
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['result']
+
+    def stats(self):
+        """ Counters and the number of keys in flight or cached """
+
+        with self.lock:
+            in_flight = sum(not entry['done'].is_set() for entry in self.entries.values())
+            return {**self.counters, 'in_flight': in_flight, 'cached_keys': len(self.entries) - in_flight,
+                    'window': self.window}
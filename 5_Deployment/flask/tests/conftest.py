@@ -0,0 +1,8 @@
+"""
+    The tests import the API modules from the flask directory, like the scripts there do.
+"""
+import sys
+from pathlib import Path
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,153 @@
+"""
+    The push channel (BoardStream) with a stand-in score function and a fixed clock: only new and
+    changed visits are scored, the ticker scores a visit that crossed a 10 minute model time,
+    a lagging client gets a snapshot and a reconnecting client resumes after Last-Event-ID.
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from board_stream import BoardStream  # noqa: E402
+
+
+ARRIVAL = datetime(2024, 3, 1, 10, 0)
+
+
+class Clock:
+    """ Clock of the stream that only moves when the test moves it """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Scorer:
+    """ Score function of the stream: the prediction is the model time / 1000, the scored SEHIDs are recorded """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, payload, current_datetime):
+        sehids = payload['seh_data']['SEHID']
+        self.calls.append(sorted(sehids))
+        model_time = min(int((current_datetime - ARRIVAL).total_seconds() / 60) // 10 * 10, 180)
+        return [{'SEHID': sehid, 'PREDICTION': model_time / 1000, 'TIMEDELTA': model_time} for sehid in sehids]
+
+
+def create_board(lab_values=(1.0, 2.0)):
+    """ Board of two visits (patients 100 and 101) with one lab result each """
+
+    return {'seh_data': {'SEHID': [1, 2], 'PATIENTNR': [100, 101], 'AANKSDATUM': ['2024-03-01'] * 2,
+                         'AANKSTIJD': ['10:00:00'] * 2, 'KLACHT': ['pijn', 'val']},
+            'lab_data': {'PATIENTNR': [100, 101], 'DESC': ['CRP', 'CRP'], 'UITSLAG': list(lab_values)}}
+
+
+@pytest.fixture
+def clock():
+    return Clock(ARRIVAL + timedelta(minutes=5))
+
+
+@pytest.fixture
+def scorer():
+    return Scorer()
+
+
+@pytest.fixture
+def stream(scorer, clock):
+    return BoardStream(scorer, queue_size=10, log_size=100, tick=0, clock=clock)
+
+
+def get_events(stream, client):
+    """ Events in the queue of a client """
+
+    events = []
+    while not client['queue'].empty():
+        events.append(client['queue'].get_nowait())
+    return events
+
+
+def test_only_new_and_changed_visits_are_scored(stream, scorer):
+    assert stream.update(create_board()) == {'visits': 2, 'scored': 2, 'events': 2}
+    assert stream.update(create_board()) == {'visits': 2, 'scored': 0, 'events': 0}
+
+    # a new lab result of patient 101 only changes visit 2, its prediction is the same so no event is sent
+    assert stream.update(create_board(lab_values=(1.0, 3.0))) == {'visits': 2, 'scored': 1, 'events': 0}
+    assert scorer.calls == [[1, 2], [2]]
+    assert stream.stats()['unchanged'] == 3
+
+
+def test_removed_visits_are_published(stream):
+    stream.update(create_board())
+    client, _ = stream.subscribe()
+
+    board = create_board()
+    board['seh_data'] = {column: values[:1] for column, values in board['seh_data'].items()}
+    stream.update(board)
+
+    assert [(event['event'], event['data']) for event in get_events(stream, client)] == [('removed', {'SEHID': 2})]
+
+
+def test_tick_scores_the_visits_that_crossed_a_model_time(stream, scorer, clock):
+    stream.update(create_board())
+    client, _ = stream.subscribe()
+
+    clock.now = ARRIVAL + timedelta(minutes=9)
+    stream.run_tick()
+    assert scorer.calls == [[1, 2]]
+
+    clock.now = ARRIVAL + timedelta(minutes=10)
+    stream.run_tick()
+    assert scorer.calls == [[1, 2], [1, 2]]
+
+    events = get_events(stream, client)
+    assert [(event['data']['SEHID'], event['data']['TIMEDELTA'], event['data']['REASON']) for event in events] == \
+        [(1, 10, 'model_time'), (2, 10, 'model_time')]
+
+
+def test_failed_visits_are_scored_again(stream, scorer):
+    stream.score = lambda payload, now: [{'SEHID': sehid, 'PREDICTION': '', 'TIMEDELTA': ''}
+                                         for sehid in payload['seh_data']['SEHID']]
+    stream.update(create_board())
+
+    stream.score = scorer
+    assert stream.update(create_board())['scored'] == 2
+
+
+def test_lagging_client_gets_a_snapshot(scorer, clock):
+    stream = BoardStream(scorer, queue_size=1, log_size=100, tick=0, clock=clock)
+    client, first_events = stream.subscribe()
+    assert first_events[0]['event'] == 'snapshot'
+
+    stream.update(create_board())  # two prediction events, the queue holds one
+    assert client['lagging']
+
+    events = stream.iter_events(client, [], heartbeat=0.01)
+    assert next(events).startswith('retry:')
+    snapshot = next(events)
+    assert 'event: snapshot' in snapshot
+    data = json.loads(snapshot.split('data: ')[1])
+    assert sorted(result['SEHID'] for result in data['result']) == [1, 2]
+    assert not client['lagging']
+    events.close()
+
+    assert stream.stats()['clients'] == 0
+
+
+def test_resume_after_last_event_id(stream):
+    stream.update(create_board())
+    first_id = stream.log[0]['id']
+
+    _, missed = stream.subscribe(first_id)
+    assert [event['data']['SEHID'] for event in missed] == [2]
+
+    # an id of another process or of an event that is no longer kept gives a snapshot
+    for last_event_id in ['other:1', f'{stream.epoch}:99']:
+        _, first_events = stream.subscribe(last_event_id)
+        assert [event['event'] for event in first_events] == ['snapshot']
+
+    assert stream.stats()['resumed'] == 1
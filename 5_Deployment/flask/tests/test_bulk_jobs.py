@@ -0,0 +1,97 @@
+"""
+    Bulk jobs: payload splitting, the bound on the queued shards (429 from /jobs), cancelling and
+    streaming the results. The shards run in a spawned process pool, so score_shard is a module
+    level function the workers can import.
+"""
+import time
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from bulk_jobs import BulkJobs, split_payload  # noqa: E402
+
+
+def score_shard(delay, shard):
+    """ One result row per visit, after delay seconds """
+
+    time.sleep(delay)
+    return [{'SEHID': sehid} for sehid in shard['seh_data']['SEHID']]
+
+
+def get_payload(n_visits):
+    return {'seh_data': {'SEHID': list(range(n_visits)), 'PATIENTNR': [sehid % 3 for sehid in range(n_visits)]},
+            'lab_data': {'PATIENTNR': [0, 1, 2, 2], 'UITSLAG': [1, 2, 3, 4]},
+            'vital_data': []}
+
+
+def wait_until_done(jobs, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with jobs.changed:
+            if all(future.done() for future in jobs.jobs[job_id]['futures']):
+                return
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+@pytest.fixture
+def jobs():
+    jobs = BulkJobs(score_shard, (0.0,), workers=1, max_queued_shards=4)
+    yield jobs
+    if jobs.executor is not None:
+        jobs.executor.shutdown(wait=True)
+
+
+def test_split_payload_keeps_the_rows_of_the_shard_patients():
+    shards = split_payload(get_payload(5), 2)
+
+    assert [shard['seh_data']['SEHID'] for shard in shards] == [[0, 1], [2, 3], [4]]
+    assert [shard['lab_data']['UITSLAG'] for shard in shards] == [[1, 2], [1, 3, 4], [2]]
+    assert all('vital_data' not in shard for shard in shards)  # empty streams are left out
+
+
+def test_iter_results_streams_all_rows_then_the_progress(jobs):
+    job_id = jobs.submit(split_payload(get_payload(5), 2))
+
+    items = [item for item in jobs.iter_results(job_id, timeout=1) if item is not None]
+    assert sorted(row['SEHID'] for row in items[:-1]) == [0, 1, 2, 3, 4]
+    assert items[-1]['status'] == 'done'
+    assert (items[-1]['shards_done'], items[-1]['n_shards'], items[-1]['n_rows']) == (3, 3, 5)
+
+
+def test_cancel_drops_the_results(jobs):
+    jobs.shard_args = (0.5,)
+    job_id = jobs.submit(split_payload(get_payload(3), 1))
+
+    assert jobs.cancel(job_id)
+    assert not jobs.cancel('unknown')
+    wait_until_done(jobs, job_id)
+
+    progress = jobs.progress(job_id)
+    assert (progress['status'], progress['n_rows']) == ('cancelled', 0)
+    assert list(jobs.iter_results(job_id))[-1]['status'] == 'cancelled'
+
+
+def test_queue_bound_refuses_jobs(jobs):
+    jobs.shard_args = (0.5,)
+    job_id = jobs.submit(split_payload(get_payload(3), 1))
+
+    assert jobs.submit(split_payload(get_payload(2), 1)) is None  # 3 + 2 shards > 4
+    assert jobs.submit(split_payload(get_payload(1), 1)) is not None
+
+    wait_until_done(jobs, job_id)
+    assert jobs.stats()['queued_shards'] <= 1
+
+
+def test_jobs_answers_429_when_the_queue_is_full(monkeypatch):
+    pytest.importorskip('flask')
+    import flask_API
+
+    monkeypatch.setattr(flask_API, 'config', {'bulk_shard_size': 1}, raising=False)  # set by load_models
+    monkeypatch.setattr(flask_API, 'bulk', BulkJobs(score_shard, (0.0,), workers=1, max_queued_shards=1))
+
+    response = flask_API.app.test_client().post('/jobs', json=get_payload(2))
+    assert response.status_code == 429
+    assert response.get_json()['max_queued_shards'] == 1
+    assert flask_API.bulk.executor is None  # refused before a pool was started
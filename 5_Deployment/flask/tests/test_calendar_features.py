@@ -0,0 +1,77 @@
+"""
+    The calendar day table against the Dutch public holidays of 2015 up to 2035, computed here from
+    the date of Easter, and the lookups of bridge days, school holidays and dates outside the table.
+"""
+from datetime import date, timedelta
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import numpy as np  # noqa: E402
+
+from preprocessing.scripts import calendar_features  # noqa: E402
+
+
+def get_easter(year):
+    """ Easter Sunday (anonymous Gregorian algorithm) """
+
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7  # noqa: E741
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def get_public_holidays(year):
+    """ New Year, Good Friday, Easter, King's Day, Liberation Day, Ascension, Whitsun and Christmas """
+
+    easter = get_easter(year)
+    kings_day = date(year, 4, 27) if date(year, 4, 27).weekday() != 6 else date(year, 4, 26)
+    return {date(year, 1, 1), kings_day, date(year, 5, 5), date(year, 12, 25), date(year, 12, 26)} | \
+        {easter + timedelta(days=days) for days in [-2, 0, 1, 39, 49, 50]}
+
+
+def test_public_holidays_2015_2035():
+    assert get_easter(2024) == date(2024, 3, 31) and get_easter(2035) == date(2035, 3, 25)
+
+    days = pd.date_range('2015-01-01', '2035-12-31', freq='D')
+    with pytest.warns(UserWarning):  # the school holidays after 2027 are not published
+        features = calendar_features.get_calendar_features(days)
+
+    holidays = set().union(*[get_public_holidays(year) for year in range(2015, 2036)])
+    assert features['HOLIDAY'].tolist() == [float(day.date() in holidays) for day in days]
+    assert features['WEEKEND'].tolist() == [int(day.weekday() > 4) for day in days]
+
+
+def test_bridge_days():
+    features = calendar_features.get_calendar_features(['2025-05-29', '2025-05-30', '2025-06-02', '2026-05-15'])
+    # the Friday after Ascension is a bridge day, the Monday after a weekend is not
+    assert features['BRIDGE_DAY'].tolist() == [0, 1, 0, 1]
+
+
+def test_school_holidays_of_the_region():
+    # spring holiday 2026 (published): the south and middle start a week before the north
+    dates = ['2026-02-20', '2026-02-23', '2026-03-02']
+    assert calendar_features.get_calendar_features(dates)['SCHOOL_HOLIDAY'].tolist() == [0, 1, 0]
+    assert calendar_features.get_calendar_features(dates, region='south')['SCHOOL_HOLIDAY'].tolist() == [1, 0, 0]
+
+
+def test_dates_outside_the_table():
+    with pytest.warns(UserWarning, match='SCHOOL_HOLIDAY is missing for 1 date'):  # a missing date is not warned about
+        features = calendar_features.get_calendar_features(['2014-12-31 10:15', None])
+
+    assert features['WEEKEND'].tolist() == [0, 0]
+    assert np.isnan(features[['HOLIDAY', 'BRIDGE_DAY', 'SCHOOL_HOLIDAY']].values).all()
+
+
+def test_missing_school_holidays_give_a_warning():
+    with pytest.warns(UserWarning, match='SCHOOL_HOLIDAY is missing for 1 date'):
+        features = calendar_features.get_calendar_features(['2027-12-31', '2030-04-27'])
+
+    assert features['HOLIDAY'].tolist() == [0, 1]
+    assert features['SCHOOL_HOLIDAY'].isna().tolist() == [False, True]
@@ -0,0 +1,85 @@
+"""
+    The drift monitor on synthetic features: rows like the reference give no alerts, a shifted
+    feature gives a PSI alert, a feature that goes missing gives a missing rate alert and a feature
+    that is always missing in the reference is never alerted on.
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import numpy as np  # noqa: E402
+
+import drift_monitor  # noqa: E402
+
+
+LAYOUT_COLUMNS = pd.Index(['b', 'extra', 'a', 'c'])  # the layout order differs from the reference order
+
+
+def get_rows(rng, n_rows, shift_a=0.0, missing_b=0.0):
+    """ Rows in the layout order: a and b standard normal, extra and c only present while scoring """
+
+    X = np.column_stack([rng.normal(size=n_rows), rng.normal(size=n_rows), rng.normal(size=n_rows) + shift_a,
+                         rng.normal(size=n_rows)])
+    X[rng.random(n_rows) < missing_b, 0] = np.nan
+    return X
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(5000, 3))
+    X[:, 2] = np.nan  # c has no export in the reference
+    X[rng.random(len(X)) < 0.1, 1] = np.nan
+
+    reference = drift_monitor.create_reference({10: [X[:2500], X[2500:]]}, ['a', 'b', 'c'])
+    drift_monitor.save_reference(reference, tmp_path / 'reference.npz')
+    return drift_monitor.DriftMonitor(drift_monitor.load_reference(tmp_path / 'reference.npz', LAYOUT_COLUMNS), halflife=5000)
+
+
+def get_alerts(report):
+    return sorted((alert['FEATURE'], alert['ALERT']) for alert in report['alerts'])
+
+
+def test_reference_counts(monitor):
+    reference = monitor.reference
+    assert reference['slots'].tolist() == [2, 0, 3]
+    assert reference['rows'][drift_monitor.MODEL_TIMES.index(10)] == 5000
+    assert reference['counts'][drift_monitor.MODEL_TIMES.index(10)].sum(axis=1).tolist() == \
+        [5000, 5000 - reference['missing'][1, 1], 0]
+
+
+def test_rows_like_the_reference_give_no_alerts(monitor):
+    monitor.update(10, get_rows(np.random.default_rng(1), 2000))
+    report = monitor.report(min_rows=200)
+
+    assert get_alerts(report) == []  # c is present now but always missing in the reference, so not alerted on
+    psi = {entry['FEATURE']: entry['PSI'] for entry in report['features']}
+    assert psi['a'] < 0.05 and psi['b'] < 0.05
+
+
+def test_a_shifted_feature_gives_a_psi_alert(monitor):
+    monitor.update(10, get_rows(np.random.default_rng(1), 2000, shift_a=1.0))
+    assert get_alerts(monitor.report(min_rows=200)) == [('a', 'psi')]
+
+
+def test_a_missing_feature_gives_a_missing_rate_alert(monitor):
+    monitor.update(10, get_rows(np.random.default_rng(1), 2000, missing_b=0.6))
+    assert get_alerts(monitor.report(min_rows=200)) == [('b', 'missing_rate')]
+
+
+def test_model_times_without_enough_rows_are_not_reported(monitor):
+    monitor.update(10, get_rows(np.random.default_rng(1), 100, shift_a=3.0))
+    monitor.update(20, get_rows(np.random.default_rng(1), 1000, shift_a=3.0))  # no reference rows for 20 minutes
+
+    report = monitor.report(min_rows=200)
+    assert report['alerts'] == [] and report['features'] == []
+
+
+def test_old_rows_decay(monitor):
+    rng = np.random.default_rng(1)
+    monitor.update(10, get_rows(rng, 5000, shift_a=1.0))
+    monitor.update(10, get_rows(rng, 5000))
+
+    assert monitor.report()['rows'][10] == pytest.approx(7500)
+    monitor.reset()
+    assert monitor.report()['rows'][10] == 0
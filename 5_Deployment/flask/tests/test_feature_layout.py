@@ -0,0 +1,72 @@
+"""
+    The feature layout on a small set of model features: the SEH stream (direct, label encoded and
+    one-hot columns) and the long lab and vital rows are written to the slots the models expect.
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import numpy as np  # noqa: E402
+
+import feature_layout  # noqa: E402
+
+
+FEATURE_NAMES = ['AGE', 'GESLACHT', 'VVCODE_AMB', 'VVCODE_EV', 'VVCODE_nan', 'Glucose', 'HR']
+ENCODERS = {'labels': {'GESLACHT': ['M', 'V']}, 'one_hot': {'VVCODE': ['AMB', 'EV', 'TAXI', 'nan']}}
+
+
+@pytest.fixture
+def layout():
+    models = {time: {'feature_names': FEATURE_NAMES} for time in [0, 10]}
+    return feature_layout.compile_layout(models, ENCODERS, extra_columns=['RAD_PRED', 'HR'])
+
+
+def test_compile_layout(layout):
+    assert layout['columns'].tolist() == FEATURE_NAMES + ['RAD_PRED']  # HR is a model feature already
+    assert layout['direct'] == ['AGE', 'Glucose', 'HR', 'RAD_PRED']
+    assert layout['one_hot']['VVCODE'][1].tolist() == [2, 3, -1, 4]  # TAXI is not a model feature
+    assert layout['readable'][:4] == ['Leeftijd', 'Geslacht', 'Vervoer: AMB', 'Vervoer: EV']
+
+
+def test_models_with_other_features_are_refused():
+    models = {0: {'feature_names': FEATURE_NAMES}, 10: {'feature_names': FEATURE_NAMES[::-1]}}
+    with pytest.raises(ValueError, match='10 min model'):
+        feature_layout.compile_layout(models, ENCODERS)
+
+    models = {0: {'feature_names': None}}
+    assert feature_layout.compile_layout(models, ENCODERS)['model_columns'].tolist() == feature_layout.FEATURE_COLUMNS
+
+
+def test_write_seh_data(layout):
+    df_seh = pd.DataFrame({'AGE': [70, 35, 50, 20], 'GESLACHT': ['V', 'M', 'X', None],
+                           'VVCODE': ['EV', 'TAXI', np.nan, 'ONBEKEND']})
+
+    X = feature_layout.create_matrix(layout, len(df_seh))
+    feature_layout.write_seh_data(X, layout, df_seh)
+
+    np.testing.assert_array_equal(X[:, :5], [[70, 1, 0, 1, 0], [35, 0, 0, 0, 0], [50, np.nan, 0, 0, 1],
+                                             [20, np.nan, 0, 0, 0]])
+    assert np.isnan(X[:, 5:]).all()  # the lab, vital and RAD_PRED slots are still missing
+
+
+def test_write_long_data(layout):
+    patients = pd.Series([100, '200', 100])  # patient 100 has two visits
+    df_long = pd.DataFrame({'PATIENTNR': ['100', 200, 200, 300, 100],
+                            'DESC': ['Glucose', 'Glucose', 'HR', 'Glucose', 'Natrium'],
+                            'UITSLAG': ['5.5', 'hoog', 80, 7.0, 140]})
+
+    X = feature_layout.create_matrix(layout, len(patients))
+    feature_layout.write_long_data(X, layout, patients, df_long, 'DESC', 'UITSLAG')
+    feature_layout.write_column(X, layout, 'RAD_PRED', [0.1, 0.2, 0.3])
+
+    columns = layout['columns'].tolist()
+    np.testing.assert_array_equal(X[:, [columns.index('Glucose'), columns.index('HR')]], [[5.5, np.nan], [np.nan, 80], [5.5, np.nan]])
+    np.testing.assert_allclose(X[:, -1], [0.1, 0.2, 0.3])
+
+
+def test_the_models_only_see_their_own_columns(layout):
+    X = feature_layout.create_matrix(layout, 2)
+
+    model_matrix = feature_layout.get_model_matrix(layout, X)
+    assert model_matrix.shape == (2, len(FEATURE_NAMES)) and np.shares_memory(model_matrix, X)
+    assert feature_layout.to_frame(layout, X).columns.tolist() == FEATURE_NAMES
@@ -0,0 +1,22 @@
+"""
+    The import report of the API (import_report.py), in a fresh interpreter: none of the deferred
+    packages may be imported when flask_API is imported. The import time depends on the machine,
+    so it is printed (pytest -s) and not checked. `-X importtime` needs python 3.7 or later, so the
+    test is skipped on the python 3.6 image.
+"""
+import sys
+
+import pytest
+
+import import_report
+
+
+@pytest.mark.skipif(sys.version_info < import_report.MIN_VERSION, reason='-X importtime needs python 3.7 or later')
+def test_no_deferred_packages_are_imported():
+    for package in ['flask', 'numpy', 'pandas', 'yaml']:  # imported by flask_API at module level
+        pytest.importorskip(package)
+
+    total, packages = import_report.summarize(import_report.get_import_times('flask_API'), 'flask_API')
+    print(f'import flask_API: {total:.3f} s')
+
+    assert [package for package, _ in packages if package in import_report.DEFERRED] == []
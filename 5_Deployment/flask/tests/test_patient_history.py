@@ -0,0 +1,81 @@
+"""
+    The patient history store on a small visit table: the features only count the visits of the
+    year before the arrival date (not the same day, not later), and update_store only writes
+    visits that changed.
+"""
+import pytest
+
+pytest.importorskip('pandas')
+
+import pandas as pd  # noqa: E402
+
+from preprocessing.scripts import patient_history  # noqa: E402
+
+
+VISITS = pd.DataFrame({
+    'SEHID': [1, 2, 3, 4, 5, 6],
+    'PATIENTNR': ['0100', 100, 100, 100, 100.0, 200],
+    'AANKSDATUM': ['2022-03-01', '2023-02-28', '2023-03-01', '2023-06-15', '2023-06-15', '2023-06-01'],
+    'BESTEMMING': ['OPN', 'HUIS', None, 'OVER', 'HUIS', 'OPN'],
+})
+
+
+@pytest.fixture
+def store():
+    con = patient_history.connect_store(':memory:')
+    yield con
+    con.close()
+
+
+def get_features(df_history, patients, arrival_dates):
+    features = patient_history.get_point_in_time_features(df_history, patients, arrival_dates)
+    return list(zip(features['PreviousVisits'], features['PrevAdmissionPercentage']))
+
+
+def test_only_the_year_before_the_arrival_counts():
+    df_history = patient_history.build_history(VISITS)
+
+    # 2022-03-01 is exactly one year before 2023-03-01 and does not count, the same day does not count either
+    assert get_features(df_history, [100, 100, 100, 100, 200, 300], ['2022-03-01', '2023-03-01', '2023-03-02',
+                                                                    '2023-06-15', '2023-06-02', '2023-06-02']) == \
+        [(0, 0.0), (1, 0.0), (2, 0.0), (2, 0.0), (1, 100.0), (0, 0.0)]
+
+    # the visits of 2023-06-15 count the day after, only 2023-06-15 OVER is an admission (2022-03-01 OPN is too old)
+    assert get_features(df_history, ['100'], [pd.Timestamp('2023-06-16 08:30')]) == [(4, 25.0)]
+
+
+def test_visits_without_arrival_have_no_previous_visits():
+    df_history = patient_history.build_history(VISITS)
+    assert get_features(df_history, [100, 100], [None, '2023-06-16']) == [(0, 0.0), (4, 25.0)]
+
+
+def test_the_store_gives_the_same_features(store):
+    df_history = patient_history.build_history(VISITS)
+    assert patient_history.update_store(store, df_history) == 6
+
+    df_seh = pd.DataFrame({'PATIENTNR': [100, 200], 'AANKSDATUM': ['2023-06-16', '2023-06-02']})
+    df_seh = patient_history.add_history_features(df_seh, patient_history.load_store(store))
+    assert df_seh[['PreviousVisits', 'PrevAdmissionPercentage']].values.tolist() == [[4, 25.0], [1, 100.0]]
+
+    # since leaves out the visits that can no longer count
+    index = patient_history.load_store(store, since='2023-01-01')
+    assert len(index['keys']) == 5
+
+
+def test_update_store_only_writes_changed_visits(store):
+    df_history = patient_history.build_history(VISITS)
+    patient_history.update_store(store, df_history)
+
+    assert patient_history.update_store(store, df_history) == 0
+
+    # visit 3 got its destination (admitted), visit 7 is new
+    changed = patient_history.build_history(pd.DataFrame({
+        'SEHID': [3, 7], 'PATIENTNR': [100, 300], 'AANKSDATUM': ['2023-03-01', '2023-07-01'], 'BESTEMMING': ['OPN', None]}))
+    assert patient_history.update_store(store, pd.concat([df_history, changed])) == 2
+    assert store.execute('SELECT PATIENTNR, OPNAME FROM PATIENT_HISTORY WHERE SEHID IN (3, 7) ORDER BY SEHID').fetchall() == \
+        [('100', 1), ('300', 0)]
+    assert store.execute('SELECT COUNT(*) FROM PATIENT_HISTORY').fetchone()[0] == 7
+
+
+def test_store_cutoff_is_one_year_and_a_day_back():
+    assert patient_history.store_cutoff('2024-03-01') == '2023-02-28'
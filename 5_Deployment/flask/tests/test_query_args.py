@@ -0,0 +1,38 @@
+"""
+    Query string arguments that are not numbers are answered with 400 instead of an internal error.
+"""
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('pandas')
+
+import flask_API  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(flask_API, 'config', {'explain_top_k': 5, 'debug_token': 'secret'}, raising=False)  # set by load_models
+    return flask_API.app.test_client()
+
+
+def test_explain_top_k(client):
+    assert flask_API.get_explain_top_k({}) == 0
+    assert flask_API.get_explain_top_k({'explain': 'true', 'top_k': '0'}) == 1
+    with pytest.raises(ValueError):
+        flask_API.get_explain_top_k({'explain': 'true', 'top_k': 'abc'})
+
+
+def test_get_predictions_refuses_a_top_k_that_is_not_a_number(client):
+    response = client.post('/get_predictions?explain=true&top_k=abc', json={'seh_data': {}})
+    assert response.status_code == 400
+    assert 'top_k' in response.get_json()['error']
+
+
+def test_profile_report_refuses_a_top_that_is_not_a_number(client):
+    assert flask_API.profiler.start(1, None, 0.005)
+    flask_API.profiler.stop()
+
+    response = client.get('/debug/profile?top=abc', headers={'X-Debug-Token': 'secret'})
+    assert response.status_code == 400
+    assert 'top' in response.get_json()['error']
+    assert client.get('/debug/profile?top=3', headers={'X-Debug-Token': 'secret'}).status_code == 200
@@ -0,0 +1,83 @@
+"""
+    Single-flight coalescing: concurrent calls with the same key share one computation, the result
+    is kept for the window and errors are not kept.
+"""
+import threading
+import time
+import types
+
+import pytest
+
+import single_flight
+from single_flight import SingleFlight, payload_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Replaces time.monotonic in single_flight with a clock the test moves """
+
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(single_flight, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_payload_key_ignores_the_key_order():
+    assert payload_key({'a': 1, 'b': [1, 2]}) == payload_key({'b': [1, 2], 'a': 1})
+    assert payload_key({'a': 1, 'b': [1, 2]}) != payload_key({'a': 1, 'b': [2, 1]})
+
+
+def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight(window=10)
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'result': 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.run('key', compute))) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+
+    deadline = time.time() + 5
+    while flight.stats()['coalesced'] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert flight.stats()['in_flight'] == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1 and results == [{'result': 42}] * 5
+    assert all(result is results[0] for result in results)
+    stats = flight.stats()
+    assert (stats['computed'], stats['coalesced'], stats['in_flight'], stats['cached_keys']) == (1, 4, 0, 1)
+
+
+def test_the_result_is_kept_for_the_window(clock):
+    flight = SingleFlight(window=10)
+    values = iter(range(10))
+
+    assert flight.run('key', lambda: next(values)) == 0
+    clock.now += 9.9
+    assert flight.run('key', lambda: next(values)) == 0
+    assert flight.run('other', lambda: next(values)) == 1
+    clock.now += 0.1
+    assert flight.run('key', lambda: next(values)) == 2
+
+    assert {name: flight.stats()[name] for name in ['computed', 'cached']} == {'computed': 3, 'cached': 1}
+
+
+def test_errors_are_not_kept(clock):
+    flight = SingleFlight(window=10)
+
+    def fail():
+        raise ValueError('no models')
+
+    with pytest.raises(ValueError, match='no models'):
+        flight.run('key', fail)
+    assert flight.run('key', lambda: 'ok') == 'ok'
+    assert flight.stats()['errors'] == 1 and flight.stats()['cached_keys'] == 1
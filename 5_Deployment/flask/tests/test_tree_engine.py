@@ -0,0 +1,42 @@
+"""
+    The compiled trees give the same probabilities as xgboost (also for missing values) and the
+    feature contributions add up to the raw score.
+"""
+import pytest
+
+xgboost = pytest.importorskip('xgboost')
+
+import numpy as np  # noqa: E402
+
+import tree_engine  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def model_and_data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(500, 6)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int)
+    X[rng.random(X.shape) < 0.2] = np.nan
+
+    model = xgboost.XGBClassifier(n_estimators=30, max_depth=4, learning_rate=0.3, base_score=0.3)
+    model.fit(X, y)
+
+    return model, X
+
+
+def test_probabilities_match_xgboost(model_and_data, tmp_path):
+    model, X = model_and_data
+    tree_engine.save_engine(tree_engine.compile_model(model), tmp_path / 'trees.npz')
+    engine = tree_engine.load_engine(tmp_path / 'trees.npz')
+
+    assert np.abs(tree_engine.predict_proba(engine, X) - model.predict_proba(X)[:, 1]).max() <= 1e-6
+
+
+def test_contributions_sum_to_the_margin(model_and_data):
+    model, X = model_and_data
+    engine = tree_engine.compile_model(model)
+
+    contribs = tree_engine.predict_contributions(engine, X)
+    assert contribs.shape == (len(X), X.shape[1] + 1)
+    np.testing.assert_allclose(contribs.sum(axis=1), tree_engine.predict_margin(engine, X), atol=1e-5)
+    np.testing.assert_allclose(contribs.sum(axis=1), model.predict(X, output_margin=True), atol=1e-5)
@@ -0,0 +1,40 @@
+"""
+    The vital cleaning table: values outside the plausible range of their label (bounds included)
+    are dropped, as are unknown labels and values that are not numbers; POLS is merged into HR.
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import numpy as np  # noqa: E402
+
+from preprocessing.scripts import vitals_cleaning  # noqa: E402
+
+
+def get_vitals(rows):
+    return pd.DataFrame(rows, columns=['PATIENTNR', 'LABEL', 'Value1'])
+
+
+def test_only_plausible_values_are_kept():
+    df = get_vitals([(1, 'Temp', '24,9'), (1, 'Temp', '25'), (1, 'Temp', '37,5'), (1, 'Temp', '45'), (1, 'Temp', 45.1),
+                     (2, 'Resp', 2), (2, 'Resp', 3), (2, 'NIBP', 251), (2, 'NIBP', 120), (2, 'MEWS score', 4),
+                     (2, 'MEWS score', 0), (3, 'HR', 29), (3, 'HR', 200), (3, 'POLS', 80), (3, 'POLS', 250),
+                     (3, 'SpO2', 98), (3, 'Temp', 'onbekend'), (3, 'Temp', None)])
+
+    df = vitals_cleaning.clean_vitals(df)
+    assert list(zip(df['PATIENTNR'], df['LABEL'], df['Value1'])) == \
+        [(1, 'Temp', 25.0), (1, 'Temp', 37.5), (1, 'Temp', 45.0), (2, 'Resp', 3.0), (2, 'NIBP', 120.0),
+         (2, 'MEWS score', 0.0), (3, 'HR', 200.0), (3, 'HR', 80.0)]
+    assert df['PATIENTNR'].dtype == np.int64  # the patients still match the other streams
+
+
+def test_no_plausible_values():
+    df = vitals_cleaning.clean_vitals(get_vitals([(1, 'Temp', 50), (1, 'SpO2', 98)]))
+    assert df.empty and list(df.columns) == ['PATIENTNR', 'LABEL', 'Value1']
+
+
+def test_scaling_leaves_mews_as_it_is():
+    scalers = {label: (0.5, -1.0) for label in vitals_cleaning.LABELS if label not in vitals_cleaning.UNSCALED}
+    df = vitals_cleaning.clean_vitals(get_vitals([(1, 'Temp', 40), (1, 'MEWS score', 2), (1, 'POLS', 60)]))
+
+    assert vitals_cleaning.scale_vitals(df, scalers)['Value1'].tolist() == [19.0, 2.0, 29.0]
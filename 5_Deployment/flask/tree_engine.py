@@ -0,0 +1,192 @@
+"""
+    NumPy inference engine for the time based xgboost models.
+
+    A model is compiled once into flat arrays over all nodes of all trees (split feature,
+    threshold, left and right child, missing direction and leaf value). Leaves point to
+    themselves, so a batch is scored by moving all (visit, tree) pointers one level down
+    per step for the depth of the deepest tree, and summing the leaf values. Missing
+    values follow the default direction xgboost learned for the split. The cover weighted
+    mean leaf value of every node is kept as well, for the feature contributions.
+
+    The compiled models are saved as .npz files, so serving them only needs NumPy.
+
+    usage (from the flask directory): python3 tree_engine.py [--config config.yaml]
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+ENGINE_ARRAYS = ['feature', 'threshold', 'left', 'right', 'default_left', 'value', 'mean', 'roots']
+
+
+#####################
+# model compiling   #
+#####################
+
+def get_model_json(booster):
+    """ Gets the json dump of the booster (older xgboost versions can only write it to a file) """
+
+    try:
+        return json.loads(booster.save_raw(raw_format='json'))
+    except TypeError:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            booster.save_model(os.path.join(tmp_dir, 'model.json'))
+            with open(os.path.join(tmp_dir, 'model.json')) as model_file:
+                return json.load(model_file)
+
+
+def get_depth(left, right, root):
+    """ Depth of one tree (number of splits on the longest path) """
+
+    depth, level = 0, [root]
+    while True:
+        level = [child for node in level for child in (left[node], right[node]) if child != -1]
+        if not level:
+            return depth
+        depth += 1
+
+
+def get_node_means(left, right, values, cover):
+    """ Cover weighted mean leaf value below every node (children always have a higher id than their parent) """
+
+    means = np.array(values, dtype=np.float64)
+    for node in range(len(left) - 1, -1, -1):
+        if left[node] != -1:
+            means[node] = (means[left[node]] * cover[left[node]] + means[right[node]] * cover[right[node]]) / cover[node]
+
+    return means
+
+
+def compile_model(model):
+    """ Compiles a (binary:logistic) xgboost model to flat node arrays """
+
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    learner = get_model_json(booster)['learner']
+
+    if learner['objective']['name'] != 'binary:logistic':
+        raise ValueError(f'Objective {learner["objective"]["name"]} is not supported')
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(f'Booster {learner["gradient_booster"]["name"]} is not supported')
+
+    trees = learner['gradient_booster']['model']['trees']
+    best_iteration = booster.attr('best_iteration')
+    if best_iteration is not None:  # predict_proba only uses the trees up to the best iteration
+        num_parallel_tree = int(learner['gradient_booster']['model']['gbtree_model_param']['num_parallel_tree'])
+        trees = trees[:(int(best_iteration) + 1) * num_parallel_tree]
+
+    arrays = {name: [] for name in ENGINE_ARRAYS}
+    offset, depth = 0, 0
+    for tree in trees:
+        left = np.asarray(tree['left_children'], dtype=np.int32)
+        right = np.asarray(tree['right_children'], dtype=np.int32)
+        is_leaf = left == -1
+        nodes = np.arange(len(left), dtype=np.int32)
+
+        arrays['feature'].append(np.where(is_leaf, 0, tree['split_indices']).astype(np.int32))
+        arrays['threshold'].append(np.asarray(tree['split_conditions'], dtype=np.float32))
+        arrays['left'].append(np.where(is_leaf, nodes, left) + offset)
+        arrays['right'].append(np.where(is_leaf, nodes, right) + offset)
+        arrays['default_left'].append(np.asarray(tree['default_left'], dtype=bool))
+        arrays['value'].append(np.where(is_leaf, tree['split_conditions'], 0).astype(np.float32))
+        arrays['mean'].append(get_node_means(left, right, tree['split_conditions'], tree['sum_hessian']))
+        arrays['roots'].append(np.array([offset], dtype=np.int32))
+
+        depth = max(depth, get_depth(left, right, 0))
+        offset += len(left)
+
+    engine = {name: np.concatenate(values) for name, values in arrays.items()}
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    engine['base_margin'] = np.float64(np.log(base_score / (1 - base_score)))
+    engine['depth'] = np.int32(depth)
+    engine['feature_names'] = np.array(booster.feature_names or [], dtype=str)
+
+    return engine
+
+
+def save_engine(engine, path):
+    """ Saves the compiled model as a .npz file """
+    np.savez(path, **engine)
+
+
+def load_engine(path):
+    """ Loads a compiled model """
+
+    with np.load(path) as data:
+        engine = {name: data[name] for name in data.files}
+    engine['feature_names'] = engine['feature_names'].tolist() or None
+
+    return engine
+
+
+#####################
+# inference         #
+#####################
+
+def predict_margin(engine, X):
+    """ Raw scores of the visits (rows of X, in the feature order of the model) """
+
+    X = np.asarray(X, dtype=np.float32)
+    feature, threshold = engine['feature'], engine['threshold']
+    left, right, default_left = engine['left'], engine['right'], engine['default_left']
+
+    nodes = np.broadcast_to(engine['roots'], (len(X), len(engine['roots'])))
+    for _ in range(int(engine['depth'])):
+        values = np.take_along_axis(X, feature[nodes], axis=1)
+        go_left = np.where(np.isnan(values), default_left[nodes], values < threshold[nodes])
+        nodes = np.where(go_left, left[nodes], right[nodes])
+
+    return engine['base_margin'] + engine['value'][nodes].sum(axis=1, dtype=np.float64)
+
+
+def predict_contributions(engine, X):
+    """
+        Feature contributions to the raw score, the last column is the bias (like pred_contribs with
+        approx_contribs=True): every split on the path adds the change of the mean leaf value to its feature
+    """
+
+    X = np.asarray(X, dtype=np.float32)
+    feature, threshold, mean = engine['feature'], engine['threshold'], engine['mean']
+    left, right, default_left = engine['left'], engine['right'], engine['default_left']
+    n_rows, n_features = X.shape
+
+    nodes = np.broadcast_to(engine['roots'], (n_rows, len(engine['roots'])))
+    row_offsets = np.arange(n_rows)[:, None] * (n_features + 1)
+    contribs = np.zeros(n_rows * (n_features + 1))
+    contribs[n_features::n_features + 1] = engine['base_margin'] + mean[engine['roots']].sum()
+
+    for _ in range(int(engine['depth'])):
+        values = np.take_along_axis(X, feature[nodes], axis=1)
+        go_left = np.where(np.isnan(values), default_left[nodes], values < threshold[nodes])
+        children = np.where(go_left, left[nodes], right[nodes])
+        contribs += np.bincount((row_offsets + feature[nodes]).ravel(), weights=(mean[children] - mean[nodes]).ravel(),
+                                minlength=len(contribs))
+        nodes = children
+
+    return contribs.reshape(n_rows, n_features + 1)
+
+
+def predict_proba(engine, X):
+    """ Admission probabilities of the visits (like predict_proba(X)[:, 1]) """
+    return 1 / (1 + np.exp(-predict_margin(engine, X)))
+
+
+if __name__ == '__main__':
+    # compiles the {time}_min_xgboost.joblib models of the config to {time}_min_trees.npz
+    import joblib
+    import yaml
+
+    parser = argparse.ArgumentParser(description='Compiles the xgboost models to NumPy tree arrays')
+    parser.add_argument('--config', default='./config.yaml')
+    args = parser.parse_args()
+
+    with open(args.config) as stream:
+        config = yaml.safe_load(stream)
+
+    for time in range(0, 190, 10):
+        model = joblib.load(f'{config["model_dir"]}/{time}_min_xgboost.joblib')
+        save_engine(compile_model(model), f'{config["model_dir"]}/{time}_min_trees.npz')
+        print(f'{time}_min_trees.npz written')